@@ -0,0 +1,159 @@
+"""Versioned JSON API for integrations
+
+    GET  /api/v1/vins/<vin>       decode one VIN
+    POST /api/v1/vins/batch       decode {"vins": [...]}, for a logged-in user
+    GET  /api/v1/garage           the logged-in user's cars, ?after=<car id> for the next page
+    GET  /api/v1/garage/<vin>     one of the logged-in user's cars
+    GET  /api/v1/garage/export    every car as a streamed download, ?format=csv or ndjson
+
+Lookups go through the same caches and queries as the HTML routes, and
+responses are serialized directly, without templates.
+"""
+import csv
+import orjson
+from flask import Blueprint, Response, current_app, jsonify, request, session, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from models import Car, SPEC_FIELDS, fetch_car_data, fetch_car_data_batch
+from vin import check_digit_matches, validate_vin, validate_vins
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes with orjson, skipping the str round trip for responses"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default), mimetype=self.mimetype)
+
+
+def use_fast_json(app):
+    """Serialize the app's JSON with orjson"""
+    app.json = OrjsonProvider(app)
+
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def error(message, status):
+    return jsonify(error=message), status
+
+def car_info_json(car_info):
+    return {field: getattr(car_info, field) for field in SPEC_FIELDS}
+
+@api.route('/vins/<vin>')
+def decode_vin(vin):
+    """Decoded car info for one VIN"""
+    vin = vin.strip().upper()
+    message = validate_vin(vin)
+    if message:
+        return error(message, 400)
+
+    car_info = fetch_car_data(vin)
+    if not car_info:
+        return error('Car info could not be retrieved.', 404)
+
+    return jsonify(vin=vin, check_digit_ok=check_digit_matches(vin), car_info=car_info)
+
+@api.route('/vins/batch', methods=['POST'])
+def decode_vin_batch():
+    """Decoded car info for up to BULK_ADD_MAX_VINS VINs, in request order"""
+    if not session.get('user_id'):
+        return error('User not logged in.', 401)
+
+    data = request.get_json(silent=True) or {}
+    vins = data.get('vins')
+    if not isinstance(vins, list) or not all(isinstance(vin, str) for vin in vins):
+        return error('Expected {"vins": [...]}.', 400)
+
+    max_vins = current_app.config['BULK_ADD_MAX_VINS']
+    if len(vins) > max_vins:
+        return error(f'At most {max_vins} VINs can be decoded at once.', 400)
+
+    vins = [vin.strip().upper() for vin in vins]
+    checks = validate_vins(vins)
+    car_data_by_vin = fetch_car_data_batch(list(dict.fromkeys(
+        vin for vin, (message, _) in zip(vins, checks) if not message)))
+
+    results = []
+    for vin, (message, check_digit_ok) in zip(vins, checks):
+        car_info = None if message else car_data_by_vin.get(vin) or None
+        if not message and not car_info:
+            message = 'Car info could not be retrieved.'
+        results.append({'vin': vin, 'check_digit_ok': check_digit_ok, 'car_info': car_info, 'error': message})
+
+    return jsonify(results=results)
+
+@api.route('/garage')
+def garage():
+    """One page of the logged-in user's cars"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return error('User not logged in.', 401)
+
+    after = request.args.get('after', 0, type=int)
+    cars, next_after = Car.garage_page(user_id, after, current_app.config['GARAGE_PAGE_SIZE'])
+    return jsonify(cars=[car._asdict() for car in cars], next_after=next_after)
+
+@api.route('/garage/<vin>')
+def garage_car(vin):
+    """One of the logged-in user's cars with its car info"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return error('User not logged in.', 401)
+
+    car = Car.find_for_user(vin, user_id)
+    if not car:
+        return error('Car not found.', 404)
+
+    car_info = car.details
+    return jsonify(
+        id=car.id, vin=car.vin, decode_status=car.decode_status,
+        decode_error=car.decode_job.error if car.decode_job else None,
+        car_info=car_info_json(car_info) if car_info else None)
+
+
+EXPORT_COLUMNS = ('vin',) + SPEC_FIELDS + ('decode_status',)
+
+
+class _Line:
+    """File-like target that hands back what csv.writer writes to it"""
+
+    def write(self, line):
+        return line
+
+def csv_lines(batches):
+    writer = csv.writer(_Line())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for rows in batches:
+        yield ''.join(writer.writerow([getattr(row, column) for column in EXPORT_COLUMNS]) for row in rows)
+
+def ndjson_lines(batches):
+    dumps = current_app.json.dumps
+    for rows in batches:
+        yield ''.join(dumps({column: getattr(row, column) for column in EXPORT_COLUMNS}) + '\n' for row in rows)
+
+EXPORT_FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+}
+
+@api.route('/garage/export')
+def garage_export():
+    """Stream every car of the logged-in user with its car info, one batch of rows at a time"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return error('User not logged in.', 401)
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return error('format must be csv or ndjson.', 400)
+
+    lines, mimetype = EXPORT_FORMATS[export_format]
+    batches = Car.garage_export(user_id, current_app.config['EXPORT_BATCH_SIZE'])
+    return Response(stream_with_context(lines(batches)), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=garage.{export_format}'})
@@ -1,33 +1,227 @@
+import csv
+import gc
+import io
+import math
 import os
-from flask import Flask, render_template, request, flash, redirect, session, url_for
-from models import db, connect_db, User, Car, CarInfo, fetch_car_data, save_car_data
-from form import LoginForm, RegistrationForm, EditUserProfileForm, EditCarInfoForm
+import re
+from datetime import datetime, timezone
+import click
+from flask import Flask, current_app, make_response, render_template, request, flash, redirect, session, url_for
+from flask.cli import with_appcontext
+from werkzeug.middleware.proxy_fix import ProxyFix
+from models import (db, connect_db, User, Car, CarInfo, cached_car_data, fetch_car_data,
+                    has_required_fields, retry_failed_decode, save_car_data, save_car_data_batch, save_pending_car,
+                    touch_garage)
+from decode_jobs import decode_worker
+from garage_import import import_garage, read_import_csv
+from vin import validate_vin, validate_vins, check_digit_matches
+from vpic import VPIC_BASE_URL, connect_vpic
+import offline_vpic
+from offline_vpic import connect_offline_vpic
+from passwords import password_hasher
+from rate_limit import rate_limiter
+from metrics import metrics
+from query_budget import query_budget
+from profiling import make_token, request_profiler
+from api import api, use_fast_json
+from form import LoginForm, RegistrationForm, EditUserProfileForm, EditCarInfoForm, BulkAddCarsForm, ImportGarageForm
+
+
+
+routes = []
+
+def route(rule, **options):
+    """Register a view on every app create_app() builds"""
+    def decorator(view):
+        routes.append((rule, view, options))
+        return view
+    return decorator
+
+
+def create_app(config=None):
+    """Build and configure the app
+
+    Nothing here connects to the database or starts a pool: connections
+    are opened by the first request that needs one, and the tables are
+    created by `flask --app app init-db`. With APP_PRELOAD set, the
+    read-only state workers share is built up front so a preloading
+    server (gunicorn --preload) can fork it into every worker.
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = (
+        os.environ.get('DATABASE_URL', 'postgresql:///car_lookup'))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ECHO'] = False
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+    app.config['VIN_DECODE_CACHE_TTL'] = int(os.environ.get('VIN_DECODE_CACHE_TTL', 7 * 24 * 60 * 60))
+    app.config['VIN_MEMORY_CACHE_MAX_ENTRIES'] = int(os.environ.get('VIN_MEMORY_CACHE_MAX_ENTRIES', 1024))
+    app.config['VIN_MEMORY_CACHE_MAX_BYTES'] = int(os.environ.get('VIN_MEMORY_CACHE_MAX_BYTES', 4 * 1024 * 1024))
+    app.config['VIN_MEMORY_CACHE_TTL'] = int(os.environ.get('VIN_MEMORY_CACHE_TTL', 60 * 60))
+    app.config['VPIC_BASE_URL'] = os.environ.get('VPIC_BASE_URL', VPIC_BASE_URL)
+    app.config['VPIC_CONNECT_TIMEOUT'] = float(os.environ.get('VPIC_CONNECT_TIMEOUT', 3.05))
+    app.config['VPIC_READ_TIMEOUT'] = float(os.environ.get('VPIC_READ_TIMEOUT', 10))
+    app.config['VPIC_MAX_RETRIES'] = int(os.environ.get('VPIC_MAX_RETRIES', 2))
+    app.config['VPIC_BACKOFF_FACTOR'] = float(os.environ.get('VPIC_BACKOFF_FACTOR', 0.25))
+    app.config['VPIC_POOL_SIZE'] = int(os.environ.get('VPIC_POOL_SIZE', 10))
+    app.config['VPIC_BATCH_SIZE'] = int(os.environ.get('VPIC_BATCH_SIZE', 50))
+    app.config['VPIC_OFFLINE_DB'] = os.environ.get('VPIC_OFFLINE_DB')
+    app.config['BULK_ADD_MAX_VINS'] = int(os.environ.get('BULK_ADD_MAX_VINS', 500))
+    app.config['IMPORT_MAX_ROWS'] = int(os.environ.get('IMPORT_MAX_ROWS', 50000))
+    app.config['DECODE_WORKERS'] = int(os.environ.get('DECODE_WORKERS', 4))
+    app.config['DECODE_JOB_TIMEOUT'] = int(os.environ.get('DECODE_JOB_TIMEOUT', 300))
+    app.config['DECODE_JOB_MAX_ATTEMPTS'] = int(os.environ.get('DECODE_JOB_MAX_ATTEMPTS', 5))
+    app.config['DECODE_JOB_RETRY_DELAY'] = float(os.environ.get('DECODE_JOB_RETRY_DELAY', 30))
+    app.config['DECODE_JOB_SWEEP_INTERVAL'] = float(os.environ.get('DECODE_JOB_SWEEP_INTERVAL', 60))
+    app.config['DECODE_JOBS_EAGER'] = os.environ.get('DECODE_JOBS_EAGER', '') == '1'
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    app.config['BCRYPT_POOL_SIZE'] = int(os.environ.get('BCRYPT_POOL_SIZE', 2))
+    app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+    app.config['RATE_LIMIT_STORAGE_URL'] = os.environ.get('RATE_LIMIT_STORAGE_URL')
+    app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+    app.config['RATE_LIMIT_IP_BURST'] = int(os.environ.get('RATE_LIMIT_IP_BURST', 20))
+    app.config['RATE_LIMIT_IP_PER_MINUTE'] = int(os.environ.get('RATE_LIMIT_IP_PER_MINUTE', 20))
+    app.config['RATE_LIMIT_EMAIL_BURST'] = int(os.environ.get('RATE_LIMIT_EMAIL_BURST', 5))
+    app.config['RATE_LIMIT_EMAIL_PER_MINUTE'] = int(os.environ.get('RATE_LIMIT_EMAIL_PER_MINUTE', 5))
+    app.config['GARAGE_PAGE_SIZE'] = int(os.environ.get('GARAGE_PAGE_SIZE', 50))
+    app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+    app.config['APP_PRELOAD'] = os.environ.get('APP_PRELOAD', '') == '1'
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+    app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')
+    app.config['METRICS_FLUSH_INTERVAL'] = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+    app.config['SERVER_TIMING_ENABLED'] = os.environ.get('SERVER_TIMING_ENABLED', '') == '1'
+    app.config['PROFILE_SECRET'] = os.environ.get('PROFILE_SECRET')
+    app.config['PROFILE_SAMPLE_RATE'] = int(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    app.config['PROFILE_MODE'] = os.environ.get('PROFILE_MODE', 'sample')
+    app.config['PROFILE_INTERVAL'] = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+    app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR')
+    app.config['PROFILE_MAX_FILES'] = int(os.environ.get('PROFILE_MAX_FILES', 200))
+    app.config['PROFILE_MAX_BYTES'] = int(os.environ.get('PROFILE_MAX_BYTES', 100 * 1024 * 1024))
+    app.config['QUERY_BUDGET_ENABLED'] = os.environ.get('QUERY_BUDGET_ENABLED', '1') == '1'
+    app.config['QUERY_BUDGET'] = int(os.environ.get('QUERY_BUDGET', 30))
+    app.config['QUERY_REPEAT_LIMIT'] = int(os.environ.get('QUERY_REPEAT_LIMIT', 5))
+    if config:
+        app.config.update(config)
+
+    trust_proxies(app)
+    connect_db(app)
+    connect_vpic(app)
+    connect_offline_vpic(app)
+    decode_worker.init_app(app)
+    password_hasher.init_app(app)
+    rate_limiter.init_app(app)
+    metrics.init_app(app)
+    query_budget.init_app(app)
+    request_profiler.init_app(app)
+
+    for rule, view, options in routes:
+        app.add_url_rule(rule, view_func=view, **options)
+    app.register_blueprint(api)
+    use_fast_json(app)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(import_garage_command)
+    app.cli.add_command(profile_token_command)
+
+    if app.config['APP_PRELOAD']:
+        preload(app)
+
+    return app
+
+def trust_proxies(app):
+    """Take remote_addr and the scheme from the X-Forwarded-* headers set by TRUSTED_PROXIES proxies"""
+    proxies = app.config['TRUSTED_PROXIES']
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+
+def preload(app):
+    """Load the offline snapshot and compile templates before workers are forked"""
+    if offline_vpic.decoder:
+        offline_vpic.decoder.load()
+    for name in app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html')):
+        app.jinja_env.get_template(name)
+    gc.freeze()
+
+def after_fork(app):
+    """Drop what a preloaded parent left behind that a worker must not share"""
+    with app.app_context():
+        db.engine.dispose(close=False)
+    connect_vpic(app)
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create the database tables"""
+    db.create_all()
+    click.echo('Initialized the database.')
+
+@click.command('import-garage')
+@click.argument('email')
+@click.argument('path', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--decode-missing/--no-decode-missing', default=True,
+              help='Queue a decode for cars missing year, make or model.')
+@with_appcontext
+def import_garage_command(email, path, decode_missing):
+    """Import a CSV of vehicle records into a user's garage"""
+    user = User.query.filter_by(email=email).first()
+    if not user:
+        raise click.ClickException(f'No user with email {email}.')
+
+    try:
+        rows, invalid = read_import_csv(path)
+    except ValueError as e:
+        raise click.ClickException(str(e))
 
+    for line, vin, message in invalid:
+        click.echo(f'line {line}: {vin or "(blank)"}: {message}', err=True)
 
+    counts = import_garage(user.id, rows, decode_missing)
+    click.echo(f'{counts["added"]} cars added, {counts["existing"]} already in the garage, '
+               f'{len(invalid)} rows skipped, {counts["queued"]} queued for decoding.')
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgresql:///car_lookup'))
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
 
-connect_db(app)
-with app.app_context():
-    db.create_all()
+@click.command('profile-token')
+@click.option('--minutes', default=15, show_default=True, help='How long the token stays valid.')
+@with_appcontext
+def profile_token_command(minutes):
+    """Print a token that profiles any request sending it in X-Profile-Token"""
+    secret = current_app.config['PROFILE_SECRET']
+    if not secret:
+        raise click.ClickException('Set PROFILE_SECRET to sign profiling tokens.')
+    click.echo(make_token(secret, minutes * 60))
 
 
+@route('/metrics')
+def metrics_page():
+    """Request, vPIC, cache, database and bcrypt metrics for Prometheus to scrape"""
+    if not current_app.config['METRICS_ENABLED']:
+        return 'Metrics are disabled.', 404
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
-@app.route('/')
+@route('/')
 def index():
     """Home page"""
     return render_template('index.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+def too_many_attempts(template, form):
+    """Throttle form posts per IP and email; returns a 429 response when over the limit"""
+    if request.method != 'POST':
+        return None
+
+    retry_after = rate_limiter.limit(request.remote_addr, request.form.get('email'))
+    if not retry_after:
+        return None
+
+    flash('Too many attempts. Please try again later.', 'danger')
+    return render_template(template, form=form), 429, {'Retry-After': str(math.ceil(retry_after))}
+
+@route('/register', methods=['GET', 'POST'])
 def register():
     """Register form for users"""
 
     form = RegistrationForm()
+    throttled = too_many_attempts('register.html', form)
+    if throttled:
+        return throttled
+
     if form.validate_on_submit():
         name = form.name.data
         email = form.email.data
@@ -55,10 +249,14 @@ def register():
 
     return render_template('register.html', form=form)
 
-@app.route('/login', methods=['GET', 'POST'])
+@route('/login', methods=['GET', 'POST'])
 def login():
     """Login form for users"""
     form = LoginForm()
+    throttled = too_many_attempts('login.html', form)
+    if throttled:
+        return throttled
+
     if form.validate_on_submit():
         email = form.email.data
         password = form.password.data
@@ -75,7 +273,7 @@ def login():
     
     return render_template('login.html', form=form)
 
-@app.route('/logout')
+@route('/logout')
 def logout():
     """Logs out the user"""
     session.pop('user_id')
@@ -83,18 +281,60 @@ def logout():
     flash('Logged out successfully', 'success')
     return redirect(url_for('index'))
 
-@app.route('/user/<int:user_id>')
+def is_conditional():
+    """Whether the request revalidates a cached copy; a flash waiting to be shown never matches"""
+    return bool(request.if_none_match or request.if_modified_since) and '_flashes' not in session
+
+def is_current(etag, last_modified):
+    """Whether the client's cached copy has this ETag, or is no older than last_modified"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= request.if_modified_since
+
+def with_validators(response, etag, last_modified):
+    """Let browsers and the CDN revalidate this per-user page instead of refetching it"""
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+def render_with_validators(etag, last_modified, template, **context):
+    """Render the page, with validators unless it shows a flash that a cached copy would keep"""
+    has_flashes = '_flashes' in session
+    response = make_response(render_template(template, **context))
+    if has_flashes:
+        return response
+    return with_validators(response, etag, last_modified)
+
+def garage_version(user_id, after, garage_updated_at):
+    return f'garage-{user_id}-{after}-{garage_updated_at:%Y%m%d%H%M%S%f}', garage_updated_at
+
+def car_version(car_id, car_updated_at, car_info_updated_at):
+    last_modified = max(car_updated_at, car_info_updated_at or datetime.min)
+    return f'car-{car_id}-{last_modified:%Y%m%d%H%M%S%f}', last_modified
+
+@route('/user/<int:user_id>')
 def user_profile(user_id):
     """Displays user profile and list of cars added"""
     if 'user_id' not in session or session['user_id'] != user_id:
         flash('You are not authorized to view this user info.', 'danger')
         return redirect(url_for('index'))
 
+    after = request.args.get('after', 0, type=int)
+    if is_conditional():
+        garage_updated_at = db.session.query(User.garage_updated_at).filter_by(id=user_id).scalar()
+        if garage_updated_at:
+            etag, last_modified = garage_version(user_id, after, garage_updated_at)
+            if is_current(etag, last_modified):
+                return with_validators(make_response('', 304), etag, last_modified)
+
     user = User.query.get_or_404(user_id)
-    cars = Car.query.filter_by(user_id=user.id).all()
-    return render_template('user_profile.html', user=user, cars=cars)
+    cars, next_after = Car.garage_page(user.id, after, current_app.config['GARAGE_PAGE_SIZE'])
+    return render_with_validators(*garage_version(user.id, after, user.garage_updated_at),
+                                  'user_profile.html', user=user, cars=cars, after=after, next_after=next_after)
 
-@app.route('/user/<int:user_id>/update', methods=['GET', 'POST'])
+@route('/user/<int:user_id>/update', methods=['GET', 'POST'])
 def update_user_profile(user_id):
     """Updating user profile info"""
     if 'user_id' not in session or session['user_id'] != user_id:
@@ -111,6 +351,7 @@ def update_user_profile(user_id):
             user.profile_pic = form.profile_pic.data
         else:
             user.profile_pic = User.profile_pic.default.arg
+        user.garage_updated_at = datetime.utcnow()
         try:    
             db.session.commit()
             flash('User info was updated successfully!', 'success')
@@ -123,32 +364,31 @@ def update_user_profile(user_id):
     return render_template('update_user_profile.html', form=form, user=user)
 
     
-@app.route('/get-car-info/', methods=['GET', 'POST'])
+@route('/get-car-info/', methods=['GET', 'POST'])
 def get_car_info():
     """Gets car info from API and displays on the page"""
-    vin = request.form.get('vin', '').upper()
+    vin = request.form.get('vin', '').strip().upper()
 
     if not vin:
         flash('VIN is required.', 'danger')
         return redirect(url_for('index'))
-    
-    car = Car.query.filter_by(vin=vin).first()
-
-    if not car:
-        car_info = fetch_car_data(vin)
 
-        if car_info:
-            return render_template('car_info.html', car_info=car_info, vin=vin)
-        else:
-            flash('Car info could not be retrieved.', 'danger')
-            return redirect(url_for('index'))
-        
+    error = validate_vin(vin)
+    if error:
+        flash(error, 'danger')
+        return redirect(url_for('index'))
+    if not check_digit_matches(vin):
+        flash('VIN check digit does not match. Please double-check the VIN.', 'danger')
+    
+    car_info = fetch_car_data(vin)
+    if not car_info:
+        flash('Car info could not be retrieved.', 'danger')
+        return redirect(url_for('index'))
 
-    car_info = CarInfo.query.filter_by(car_id=car.id).first()
     return render_template('car_info.html', car_info=car_info, vin=vin)
 
 
-@app.route('/show-car-info/<vin>', methods=['GET', 'POST'])
+@route('/show-car-info/<vin>', methods=['GET', 'POST'])
 def show_car_info(vin):
     """Displays car info when clicked on VIN"""
     user_id = session.get('user_id')
@@ -156,20 +396,32 @@ def show_car_info(vin):
         flash('User not logged in.', 'danger')
         return redirect(url_for('login'))
     
-    car = Car.query.filter_by(vin=vin, user_id=user_id).first()
+    if is_conditional():
+        version = db.session.query(Car.id, Car.updated_at, CarInfo.updated_at).outerjoin(Car.car_info) \
+            .filter(Car.vin == vin, Car.user_id == user_id).first()
+        if version:
+            etag, last_modified = car_version(*version)
+            if is_current(etag, last_modified):
+                return with_validators(make_response('', 304), etag, last_modified)
+
+    car = Car.find_for_user(vin, user_id)
     if not car:
         flash('Car not found.', 'danger')
         return redirect(url_for('user_profile', user_id=user_id))
     
-    car_info = CarInfo.query.filter_by(car_id=car.id).first()
+    car_info = car.details
     if not car_info:
-        flash('Car info could not be found.', 'danger')
+        if car.decode_status in ('pending', 'running'):
+            flash('Car info is still being retrieved.', 'danger')
+        else:
+            flash('Car info could not be found.', 'danger')
         return redirect(url_for('user_profile', user_id=user_id))
 
-    return render_template('show_car_info.html', car_info=car_info, vin=vin)
+    version = car_version(car.id, car.updated_at, car.car_info.updated_at if car.car_info else None)
+    return render_with_validators(*version, 'show_car_info.html', car_info=car_info, vin=vin)
 
 
-@app.route('/update-car-info/<vin>', methods=['GET', 'POST'])
+@route('/update-car-info/<vin>', methods=['GET', 'POST'])
 def update_car_info(vin):
     """Update car information for specific fields"""
     user_id = session.get('user_id')
@@ -177,12 +429,12 @@ def update_car_info(vin):
         flash('User not logged in.', 'danger')
         return redirect(url_for('login'))
     
-    car = Car.query.filter_by(vin=vin, user_id=user_id).first()
+    car = Car.find_for_user(vin, user_id)
     if not car:
         flash("Car not found.", "danger")
         return redirect(url_for('user_profile', user_id=user_id))
 
-    car_info = CarInfo.query.filter_by(car_id=car.id).first()
+    car_info = car.details
     if not car_info:
         flash("Car information not found.", "danger")
         return redirect(url_for('user_profile', user_id=user_id))
@@ -198,24 +450,27 @@ def update_car_info(vin):
             form.turbo.data = 'False'
 
     if form.validate_on_submit():
-        car_info.year = form.year.data or car_info.year
-        car_info.make = form.make.data or car_info.make
-        car_info.model = form.model.data or car_info.model
-        car_info.trim = form.trim.data or car_info.trim
-        car_info.top_speed = form.top_speed.data or car_info.top_speed
-        car_info.cylinders = form.cylinders.data or car_info.cylinders
-        car_info.horsepower = form.horsepower.data or car_info.horsepower
-        
         if form.turbo.data == 'True':
-            car_info.turbo = 'True'
+            turbo = 'True'
         elif form.turbo.data == 'False':
-            car_info.turbo = 'False'
+            turbo = 'False'
         else:
-            car_info.turbo = None
-
-        car_info.engine_model = form.engine_model.data or car_info.engine_model
-        car_info.transmission_style = form.transmission_style.data or car_info.transmission_style
-        car_info.drive_type = form.drive_type.data or car_info.drive_type
+            turbo = None
+
+        car.set_details({
+            'year': form.year.data or car_info.year,
+            'make': form.make.data or car_info.make,
+            'model': form.model.data or car_info.model,
+            'trim': form.trim.data or car_info.trim,
+            'top_speed': form.top_speed.data or car_info.top_speed,
+            'cylinders': form.cylinders.data or car_info.cylinders,
+            'horsepower': form.horsepower.data or car_info.horsepower,
+            'turbo': turbo,
+            'engine_model': form.engine_model.data or car_info.engine_model,
+            'transmission_style': form.transmission_style.data or car_info.transmission_style,
+            'drive_type': form.drive_type.data or car_info.drive_type,
+        })
+        touch_garage(user_id)
     
         try:
             db.session.commit()
@@ -228,31 +483,140 @@ def update_car_info(vin):
     
     return render_template('update_car_info.html', form=form, vin=vin)
 
-@app.route('/user/<int:user_id>/add', methods=['POST'])
+@route('/user/<int:user_id>/add', methods=['POST'])
 def add_car(user_id):
     if 'user_id' not in session or session['user_id'] != user_id:
         flash('You are not authorized to add a car for this user.', 'danger')
         return redirect(url_for('login'))
 
-    vin = request.form.get('vin', '').upper()
+    vin = request.form.get('vin', '').strip().upper()
     if not vin:
         flash('VIN is required.', 'danger')
         return redirect(url_for('user_profile', user_id=user_id))
 
-    car = Car.query.filter_by(vin=vin, user_id=user_id).first()
-    if not car:
-        car_info = fetch_car_data(vin)
-        if car_info:
-            save_car_data(vin, user_id, car_info)
+    error = validate_vin(vin)
+    if error:
+        flash(error, 'danger')
+        return redirect(url_for('user_profile', user_id=user_id))
+    if not check_digit_matches(vin):
+        flash('VIN check digit does not match. Please double-check the VIN.', 'danger')
+
+    car_info = cached_car_data(vin)
+    if car_info and has_required_fields(car_info):
+        if save_car_data(vin, user_id, car_info):
             flash('Car added successfully!', 'success')
-        else:
-            flash('Car info could not be retrieved.', 'danger')
+            return redirect(url_for('user_profile', user_id=user_id))
+    else:
+        job = save_pending_car(vin, user_id)
+        if job:
+            decode_worker.enqueue(job.id)
+            flash('Car added! Its info is being retrieved.', 'success')
+            return redirect(url_for('user_profile', user_id=user_id))
+
+    job = retry_failed_decode(vin, user_id)
+    if job:
+        decode_worker.enqueue(job.id)
+        flash('Car already exists. Its info is being retrieved again.', 'success')
     else:
         flash('Car already exists.', 'danger')
-
     return redirect(url_for('user_profile', user_id=user_id))
 
-@app.route('/remove-car/<int:car_id>', methods=['POST'])
+def parse_vins(text, is_csv=False):
+    """Pull upper-cased VINs out of pasted text or a CSV file, dropping repeats"""
+    if is_csv:
+        rows = [row for row in csv.reader(io.StringIO(text)) if row]
+        column = 0
+        if rows:
+            header = [cell.strip().lower() for cell in rows[0]]
+            if 'vin' in header:
+                column = header.index('vin')
+                rows = rows[1:]
+        values = [row[column] for row in rows if len(row) > column]
+    else:
+        values = re.split(r'[\s,;]+', text)
+
+    vins = []
+    for value in values:
+        vin = value.strip().upper()
+        if vin and vin not in vins:
+            vins.append(vin)
+    return vins
+
+@route('/user/<int:user_id>/add-bulk', methods=['GET', 'POST'])
+def add_cars_bulk(user_id):
+    """Adds many cars at once from a pasted list or an uploaded CSV of VINs"""
+    if 'user_id' not in session or session['user_id'] != user_id:
+        flash('You are not authorized to add a car for this user.', 'danger')
+        return redirect(url_for('login'))
+
+    form = BulkAddCarsForm()
+    if form.validate_on_submit():
+        vins = parse_vins(form.vins.data or '')
+        if form.vins_file.data:
+            text = form.vins_file.data.read().decode('utf-8-sig', errors='replace')
+            vins += [vin for vin in parse_vins(text, is_csv=True) if vin not in vins]
+
+        if not vins:
+            flash('VIN is required.', 'danger')
+            return redirect(url_for('add_cars_bulk', user_id=user_id))
+
+        max_vins = current_app.config['BULK_ADD_MAX_VINS']
+        if len(vins) > max_vins:
+            flash(f'Please add at most {max_vins} VINs at a time.', 'danger')
+            return redirect(url_for('add_cars_bulk', user_id=user_id))
+
+        checks = validate_vins(vins)
+        valid = [vin for vin, (error, _) in zip(vins, checks) if not error]
+        try:
+            saved = {vin: (vin, added, message) for vin, added, message in save_car_data_batch(user_id, valid)}
+        except:
+            db.session.rollback()
+            flash('Error adding cars. Please try again.', 'danger')
+            return redirect(url_for('add_cars_bulk', user_id=user_id))
+
+        results = [(saved.get(vin) or (vin, False, error)) + (error is None and check_digit_ok,)
+                   for vin, (error, check_digit_ok) in zip(vins, checks)]
+        added = sum(1 for _, ok, _, _ in results if ok)
+        flash(f'{added} of {len(results)} cars added.', 'success' if added else 'danger')
+        return render_template('bulk_add_results.html', results=results, user_id=user_id)
+
+    return render_template('add_cars_bulk.html', form=form, user_id=user_id)
+
+@route('/user/<int:user_id>/import', methods=['GET', 'POST'])
+def import_garage_file(user_id):
+    """Imports existing vehicle records, with whatever spec columns they have, from a CSV"""
+    if 'user_id' not in session or session['user_id'] != user_id:
+        flash('You are not authorized to add a car for this user.', 'danger')
+        return redirect(url_for('login'))
+
+    form = ImportGarageForm()
+    if form.validate_on_submit():
+        text = form.garage_file.data.read().decode('utf-8-sig', errors='replace')
+        try:
+            rows, invalid = read_import_csv(io.StringIO(text))
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('import_garage_file', user_id=user_id))
+
+        max_rows = current_app.config['IMPORT_MAX_ROWS']
+        if len(rows) > max_rows:
+            flash(f'Please import at most {max_rows} cars at a time.', 'danger')
+            return redirect(url_for('import_garage_file', user_id=user_id))
+
+        try:
+            counts = import_garage(user_id, rows, form.decode_missing.data)
+        except:
+            flash('Error importing cars. Please try again.', 'danger')
+            return redirect(url_for('import_garage_file', user_id=user_id))
+
+        flash(f'{counts["added"]} cars added, {counts["existing"]} already in your garage, '
+              f'{counts["queued"]} being decoded.', 'success' if counts['added'] else 'danger')
+        results = [(vin or f'Line {line}', False, message, None) for line, vin, message in invalid]
+        return render_template('bulk_add_results.html', results=results, user_id=user_id)
+
+    return render_template('import_garage.html', form=form, user_id=user_id)
+
+@route('/remove-car/<int:car_id>', methods=['POST'])
 def remove_car(car_id):
     """Removes a car from the user's profile"""
     user_id = session['user_id']
@@ -265,6 +629,7 @@ def remove_car(car_id):
     try:
     
         db.session.delete(car)
+        touch_garage(car.user_id)
         db.session.commit()
         flash('Car removed successfully!', 'success')
 
@@ -276,6 +641,8 @@ def remove_car(car_id):
 
 
 
+app = create_app()
+
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
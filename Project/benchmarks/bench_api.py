@@ -0,0 +1,91 @@
+"""p50/p99 of the JSON API against the HTML routes it replaces for integrations
+
+    DATABASE_URL=postgresql:///car_lookup_bench python -m benchmarks.bench_api --requests 2000
+
+Seeds a user whose garage has a page of decoded cars, then sends
+--requests requests to each route through the test client (no network),
+so the numbers are the app's own cost: queries, templates or
+serialization. VIN lookups decode through the local vPIC stub; only the
+first one reaches it, the rest are served from the VIN cache. Without
+DATABASE_URL a throwaway SQLite file is used; the
+tables are dropped afterwards.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+
+PAIRS = [
+    ('VIN lookup', ('post', '/get-car-info/', {'data': {'vin': '{vin}'}}), ('get', '/api/v1/vins/{vin}', {})),
+    ('car detail', ('get', '/show-car-info/{vin}', {}), ('get', '/api/v1/garage/{vin}', {})),
+    ('garage list', ('get', '/user/{user_id}', {}), ('get', '/api/v1/garage', {})),
+]
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def timed(client, method, url, kwargs, requests):
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = getattr(client, method)(url, **kwargs)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, (url, response.status_code)
+    return percentile(samples, 0.5), percentile(samples, 0.99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    from benchmarks.vpic_stub import StubVpicServer
+
+    with StubVpicServer() as stub:
+        directory = tempfile.mkdtemp()
+        os.environ.setdefault('DATABASE_URL', f'sqlite:///{directory}/bench.sqlite')
+        os.environ['VPIC_BASE_URL'] = stub.base_url
+        run(args.requests)
+
+
+def run(requests):
+    from app import app
+    from models import db, User, Car, VehicleSpec
+
+    with app.app_context():
+        db.create_all()
+        user = User(name='Bench', email='bench@example.com', password='x')
+        spec = VehicleSpec(spec_key='bench-api', year=2023, make='TOYOTA', model='RAV4', trim='XLE',
+                           cylinders='4', horsepower='203', fuel_type='Gasoline',
+                           drive_type='AWD/All-Wheel Drive')
+        db.session.add_all([user, spec])
+        db.session.flush()
+        db.session.add_all([Car(vin=f'2T3W1RFV3PW{n:06d}', user_id=user.id, spec_id=spec.id)
+                            for n in range(app.config['GARAGE_PAGE_SIZE'])])
+        db.session.commit()
+        user_id = user.id
+
+    values = {'vin': '2T3W1RFV3PW000001', 'user_id': user_id}
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['user_id'] = user_id
+            sess['user_name'] = 'Bench'
+
+        print(f'{"":<12} {"HTML p50":>10} {"p99":>8}   {"JSON p50":>10} {"p99":>8}')
+        for name, html, json in PAIRS:
+            row = []
+            for method, url, kwargs in (html, json):
+                kwargs = {key: {k: v.format(**values) for k, v in value.items()} for key, value in kwargs.items()}
+                row.extend(timed(client, method, url.format(**values), kwargs, requests))
+            print(f'{name:<12} {row[0]:8.2f}ms {row[1]:6.2f}ms   {row[2]:8.2f}ms {row[3]:6.2f}ms')
+
+    with app.app_context():
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Cold-start time of a worker: importing the app, with and without DDL at import
+
+    DATABASE_URL=postgresql:///car_lookup python -m benchmarks.bench_cold_start --runs 10
+
+Each run is a fresh interpreter, like a new gunicorn worker. "import +
+create_all" is what importing the app used to cost, when it created the
+tables; "import" is the cost now; "import + first query" adds the
+connection the first request opens. Without DATABASE_URL a throwaway
+SQLite file is used.
+
+--imports breaks "import" down with python -X importtime: the cumulative
+cost of each of the app's own modules and of the heavier libraries they
+pull in, whichever module imports them first.
+"""
+import argparse
+import glob
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+SCRIPTS = {
+    'import + create_all': 'import app\nwith app.app.app_context(): app.db.create_all()',
+    'import': 'import app',
+    'import + first query': 'import app\nfrom sqlalchemy import text\n'
+                            'with app.app.app_context(): app.db.session.execute(text("SELECT 1"))',
+}
+
+LIBRARIES = ('flask', 'flask_sqlalchemy', 'sqlalchemy', 'flask_wtf', 'wtforms', 'requests', 'urllib3',
+             'bcrypt', 'orjson', 'multiprocessing', 'sqlite3', 'cProfile')
+
+
+def import_times(env, runs):
+    """{module: median cumulative import ms} for the app's modules and LIBRARIES"""
+    project = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    wanted = set(LIBRARIES) | {os.path.basename(path)[:-3] for path in glob.glob(os.path.join(project, '*.py'))}
+    samples = {}
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], env=env, cwd=project,
+                                capture_output=True, text=True, check=True)
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if name.strip() in wanted:
+                samples.setdefault(name.strip(), []).append(int(cumulative) / 1000)
+    return {name: statistics.median(times) for name, times in samples.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--imports', action='store_true', help='break the import down by module')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', f'sqlite:///{directory}/bench.sqlite')
+
+    for name, script in SCRIPTS.items():
+        times = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', script], env=env, check=True)
+            times.append((time.perf_counter() - start) * 1000)
+        print(f'{name:<22} median {statistics.median(times):7.1f} ms  min {min(times):7.1f} ms')
+
+    if args.imports:
+        print('\ncumulative import time, median')
+        for name, ms in sorted(import_times(env, args.runs).items(), key=lambda item: -item[1]):
+            print(f'  {name:<20} {ms:7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
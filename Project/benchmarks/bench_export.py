@@ -0,0 +1,68 @@
+"""Peak memory of streaming the garage export for small and very large garages
+
+    DATABASE_URL=postgresql:///car_lookup_bench python -m benchmarks.bench_export --cars 10 100000
+
+Seeds one user per --cars value, then downloads /api/v1/garage/export in
+each format through the test client, consuming the body chunk by chunk
+the way a WSGI server does, and reports time, size and the tracemalloc
+peak. Without DATABASE_URL a throwaway SQLite file is used; the tables
+are dropped afterwards.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cars', type=int, nargs='+', default=[10, 100000])
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{directory}/bench.sqlite')
+
+    from app import app
+    from models import db, User, Car, VehicleSpec
+
+    users = {}
+    with app.app_context():
+        db.create_all()
+        spec = VehicleSpec(spec_key='bench-export', year=2023, make='TOYOTA', model='RAV4', trim='XLE',
+                           cylinders='4', horsepower='203', fuel_type='Gasoline',
+                           drive_type='AWD/All-Wheel Drive')
+        db.session.add(spec)
+        db.session.flush()
+        for count in args.cars:
+            user = User(name='Bench', email=f'bench{count}@example.com', password='x')
+            db.session.add(user)
+            db.session.flush()
+            db.session.execute(db.insert(Car), [
+                {'user_id': user.id, 'vin': f'2T3W1RFV{n:09d}', 'spec_id': spec.id}
+                for n in range(count)])
+            users[count] = user.id
+        db.session.commit()
+
+    with app.test_client() as client:
+        for count, user_id in users.items():
+            with client.session_transaction() as sess:
+                sess['user_id'] = user_id
+            for export_format in ('csv', 'ndjson'):
+                tracemalloc.start()
+                start = time.perf_counter()
+                response = client.get(f'/api/v1/garage/export?format={export_format}', buffered=False)
+                size = sum(len(chunk) for chunk in response.response)
+                response.close()
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f'{count:>7} cars  {export_format:<6} {elapsed * 1000:9.1f} ms  '
+                      f'{size / 1024 / 1024:7.2f} MB out  peak {peak / 1024 / 1024:6.2f} MB')
+
+    with app.app_context():
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
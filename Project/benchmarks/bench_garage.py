@@ -0,0 +1,91 @@
+"""Profile page time and memory for a fleet user: every car as entities vs one keyset page
+
+    DATABASE_URL=postgresql:///car_lookup_bench python -m benchmarks.bench_garage --cars 10000
+
+Seeds one user with --cars cars sharing a spec, then renders the garage
+list the old way (every Car entity, with its spec, CarInfo and decode
+job, rendered at once) and the new way (one GARAGE_PAGE_SIZE page of
+projected columns, the first page and one deep in the list). Without
+DATABASE_URL a throwaway SQLite file is used; the tables are dropped
+afterwards.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+
+def measure(function, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(times), peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cars', type=int, default=10000)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{directory}/bench.sqlite')
+
+    from flask import render_template
+    from app import app
+    from models import db, User, Car, VehicleSpec
+
+    with app.app_context():
+        db.create_all()
+        user = User(name='Fleet', email='fleet@example.com', password='x')
+        spec = VehicleSpec(spec_key='bench-garage', year=2022, make='FORD', model='Transit')
+        db.session.add_all([user, spec])
+        db.session.commit()
+        db.session.execute(db.insert(Car), [
+            {'user_id': user.id, 'vin': f'1FTBR1C8{n:09d}', 'spec_id': spec.id} for n in range(args.cars)])
+        db.session.commit()
+        user_id = user.id
+        middle = db.session.query(Car.id).filter_by(user_id=user_id).order_by(Car.id) \
+            .offset(args.cars // 2).limit(1).scalar()
+        page_size = app.config['GARAGE_PAGE_SIZE']
+
+    def old_page():
+        with app.test_request_context(f'/user/{user_id}'):
+            user = db.session.get(User, user_id)
+            cars = Car.query.options(db.joinedload(Car.decode_job), db.joinedload(Car.spec),
+                                     db.joinedload(Car.car_info)).filter_by(user_id=user_id).all()
+            render_template('user_profile.html', user=user, cars=[
+                dict(id=car.id, vin=car.vin, year=car.details.year, make=car.details.make,
+                     model=car.details.model, decode_status=car.decode_status) for car in cars])
+            db.session.remove()
+
+    def keyset_page(after):
+        def page():
+            with app.test_request_context(f'/user/{user_id}?after={after}'):
+                user = db.session.get(User, user_id)
+                cars, next_after = Car.garage_page(user_id, after, page_size)
+                render_template('user_profile.html', user=user, cars=cars, after=after, next_after=next_after)
+                db.session.remove()
+        return page
+
+    print(f'{args.cars} cars, page size {page_size}')
+    for name, function in [('all entities', old_page), ('keyset, first page', keyset_page(0)),
+                           ('keyset, middle page', keyset_page(middle))]:
+        ms, peak_mb = measure(function, args.runs)
+        print(f'{name:<20} {ms:9.1f} ms  peak {peak_mb:7.1f} MB')
+
+    with app.app_context():
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
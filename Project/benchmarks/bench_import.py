@@ -0,0 +1,72 @@
+"""Fleet onboarding: save_car_data per row vs the staged, set-based import
+
+    DATABASE_URL=postgresql:///car_lookup_bench python -m benchmarks.bench_import --cars 20000
+
+Builds a CSV of --cars vehicle records spread over a few dozen specs,
+with every tenth row missing its make, then imports it for one user row
+by row through save_car_data and for another through import_garage (COPY
+on PostgreSQL, executemany elsewhere). Without DATABASE_URL a throwaway
+SQLite file is used; the tables are dropped afterwards.
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+
+MODELS = ['Transit', 'F-150', 'Ranger', 'Escape', 'Explorer', 'Maverick']
+
+
+def fleet_csv(cars):
+    lines = ['vin,year,make,model,trim']
+    for n in range(cars):
+        make = '' if n % 10 == 0 else 'FORD'
+        lines.append(f'1FTBR1C8{n:09d},{2015 + n % 8},{make},{MODELS[n % len(MODELS)]},XL')
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cars', type=int, default=20000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{directory}/bench.sqlite')
+
+    from app import app
+    from garage_import import import_garage, read_import_csv
+    from models import db, User, has_required_fields, save_car_data
+
+    with app.app_context():
+        db.create_all()
+        row_user = User(name='Rows', email='rows@example.com', password='x')
+        import_user = User(name='Import', email='import@example.com', password='x')
+        db.session.add_all([row_user, import_user])
+        db.session.commit()
+
+        start = time.perf_counter()
+        rows, invalid = read_import_csv(io.StringIO(fleet_csv(args.cars)))
+        parsed = time.perf_counter() - start
+        assert not invalid
+
+        start = time.perf_counter()
+        for row in rows:
+            if has_required_fields(row):
+                save_car_data(row['vin'], row_user.id, row)
+        row_by_row = time.perf_counter() - start
+
+        start = time.perf_counter()
+        counts = import_garage(import_user.id, rows, decode_missing=False)
+        staged = time.perf_counter() - start
+
+        print(f'{args.cars} rows, parsed and validated in {parsed:.2f} s')
+        print(f'save_car_data per row  {row_by_row:8.2f} s  (complete rows only)')
+        print(f'import_garage          {staged:8.2f} s  ({counts["added"]} cars added)')
+
+        db.session.remove()
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
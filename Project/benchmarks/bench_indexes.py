@@ -0,0 +1,89 @@
+"""Query plans and latency for the route lookups, before and after the indexes
+
+    DATABASE_URL=postgresql:///car_lookup python -m benchmarks.bench_indexes --cars 1000000
+
+Seeds a scratch schema (bench_indexes, dropped afterwards) with --cars cars
+spread over --users users, each with a car_info row. Then it runs EXPLAIN
+ANALYZE on the queries the routes issue, without and then with the
+indexes from migrations/001_car_indexes.sql. Requires PostgreSQL.
+"""
+import argparse
+import json
+import os
+from sqlalchemy import create_engine, text
+
+
+QUERIES = {
+    'get_car_info: cars by vin': 'SELECT * FROM cars WHERE vin = :vin LIMIT 1',
+    'show_car_info: cars by vin, user_id': 'SELECT * FROM cars WHERE vin = :vin AND user_id = :user_id LIMIT 1',
+    'show_car_info: car_info by car_id': 'SELECT * FROM car_info WHERE car_id = :car_id LIMIT 1',
+    'user_profile: cars by user_id': 'SELECT * FROM cars WHERE user_id = :user_id',
+}
+
+INDEXES = [
+    'CREATE UNIQUE INDEX uq_cars_user_id_vin ON cars (user_id, vin)',
+    'CREATE INDEX ix_cars_vin ON cars (vin)',
+    'CREATE UNIQUE INDEX uq_car_info_car_id ON car_info (car_id)',
+]
+
+
+def seed(connection, cars, users):
+    connection.execute(text('DROP SCHEMA IF EXISTS bench_indexes CASCADE'))
+    connection.execute(text('CREATE SCHEMA bench_indexes'))
+    connection.execute(text('SET search_path TO bench_indexes'))
+    connection.execute(text('''
+        CREATE TABLE cars (id serial PRIMARY KEY, user_id integer NOT NULL, vin varchar NOT NULL);
+        CREATE TABLE car_info (id serial PRIMARY KEY, car_id integer NOT NULL REFERENCES cars (id),
+                               year integer NOT NULL, make varchar NOT NULL, model varchar NOT NULL);
+    '''))
+    connection.execute(text('''
+        INSERT INTO cars (user_id, vin)
+        SELECT n % :users + 1, upper(substr(md5(n::text), 1, 17)) FROM generate_series(1, :cars) AS n
+    '''), {'cars': cars, 'users': users})
+    connection.execute(text('''
+        INSERT INTO car_info (car_id, year, make, model) SELECT id, 2020, 'TOYOTA', 'RAV4' FROM cars
+    '''))
+    connection.execute(text('ANALYZE cars; ANALYZE car_info'))
+
+
+def explain(connection, params):
+    results = {}
+    for name, query in QUERIES.items():
+        plan = connection.execute(text(f'EXPLAIN (ANALYZE, FORMAT JSON) {query}'), params).scalar()
+        plan = plan[0] if isinstance(plan, list) else json.loads(plan)[0]
+        node = plan['Plan']
+        while node.get('Plans') and node['Node Type'] == 'Limit':
+            node = node['Plans'][0]
+        results[name] = (node['Node Type'], plan['Execution Time'])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cars', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=10000)
+    args = parser.parse_args()
+
+    engine = create_engine(os.environ.get('DATABASE_URL', 'postgresql:///car_lookup'))
+    with engine.begin() as connection:
+        seed(connection, args.cars, args.users)
+        params = connection.execute(text(
+            'SELECT vin, user_id, id AS car_id FROM cars ORDER BY id OFFSET :middle LIMIT 1'),
+            {'middle': args.cars // 2}).mappings().one()
+
+        before = explain(connection, params)
+        for statement in INDEXES:
+            connection.execute(text(statement))
+        connection.execute(text('ANALYZE cars; ANALYZE car_info'))
+        after = explain(connection, params)
+
+        connection.execute(text('DROP SCHEMA bench_indexes CASCADE'))
+
+    print(f'{args.cars} cars, {args.users} users')
+    for name in QUERIES:
+        (node_before, ms_before), (node_after, ms_after) = before[name], after[name]
+        print(f'{name:<40} {node_before:<16} {ms_before:9.3f} ms  ->  {node_after:<16} {ms_after:9.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
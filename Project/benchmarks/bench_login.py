@@ -0,0 +1,115 @@
+"""Latency of a cheap route while logins are hammered, hashing inline vs on the pool
+
+    python -m benchmarks.bench_login --logins 16 --seconds 5 --pool-size 2
+
+Serves the app on a local threaded server backed by a throwaway SQLite
+file. --logins threads post to /login in a loop while one thread times
+GET / (index). Run once hashing on the request threads, then once on a
+--pool-size process pool. With the pool, the index latency stays near its
+idle value because at most --pool-size CPUs are busy hashing.
+
+Login throttling is turned off, and only logins answered with a redirect
+(a real password check) count toward the logins/s figure; any other
+response is reported as an error.
+"""
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def run(base_url, logins, seconds):
+    import requests
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    counts = {'logins': 0, 'errors': 0}
+
+    def hammer():
+        session = requests.Session()
+        logins = errors = 0
+        while not stop.is_set():
+            response = session.post(f'{base_url}/login', data={'email': 'bench@example.com', 'password': 'password'},
+                                    allow_redirects=False)
+            if response.status_code == 302:
+                logins += 1
+            else:
+                errors += 1
+        with lock:
+            counts['logins'] += logins
+            counts['errors'] += errors
+
+    threads = [threading.Thread(target=hammer, daemon=True) for _ in range(logins)]
+    for thread in threads:
+        thread.start()
+
+    session = requests.Session()
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        session.get(f'{base_url}/')
+        latencies.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.01)
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies, counts['logins'] / seconds, counts['errors']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=16, help='concurrent login threads')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--pool-size', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--rounds', type=int, default=12)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{directory}/bench.sqlite')
+
+    from werkzeug.serving import make_server
+    from app import app
+    from models import db, User
+    from passwords import password_hasher
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATE_LIMIT_ENABLED'] = False
+    password_hasher.rounds = args.rounds
+    with app.app_context():
+        db.create_all()
+        db.session.add(User.register('Bench', 'bench@example.com', '', 'password'))
+        db.session.commit()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    idle, _, _ = run(base_url, 0, 1)
+    print(f'idle                  index p50 {statistics.median(idle):7.1f} ms  p95 {percentile(idle, 0.95):7.1f} ms')
+
+    for name, pool_size in [('inline', 0), (f'pool of {args.pool_size}', args.pool_size)]:
+        password_hasher.shutdown()
+        password_hasher.pool_size = pool_size
+        latencies, rate, errors = run(base_url, args.logins, args.seconds)
+        print(f'{name:<21} index p50 {statistics.median(latencies):7.1f} ms  '
+              f'p95 {percentile(latencies, 0.95):7.1f} ms  logins {rate:6.1f}/s  errors {errors}')
+
+    password_hasher.shutdown()
+    server.shutdown()
+    with app.app_context():
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Offline snapshot decode vs a vPIC API round trip
+
+    python -m benchmarks.bench_offline_decode --filler 500 --latency 0.3
+
+The snapshot is synthetic (see benchmarks.vpic_snapshot); --filler adds
+patterns per schema to approximate the size of a real schema.
+"""
+import argparse
+import os
+import tempfile
+import time
+from benchmarks.vpic_snapshot import build_snapshot
+from benchmarks.vpic_stub import StubVpicServer
+from offline_vpic import OfflineDecoder
+from vpic import VpicClient, parse_response
+
+
+VIN = '2T3W1RFV3PW284566'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--decodes', type=int, default=10000)
+    parser.add_argument('--filler', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0, help='stub response latency in seconds')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'vpic.sqlite')
+        build_snapshot(path, filler=args.filler)
+        decoder = OfflineDecoder(path)
+
+        start = time.perf_counter()
+        decoder.load()
+        print(f'snapshot load: {(time.perf_counter() - start) * 1000:.1f} ms')
+
+        start = time.perf_counter()
+        for _ in range(args.decodes):
+            decoder.decode(VIN)
+        print(f'offline decode: {(time.perf_counter() - start) / args.decodes * 1e6:.1f} us')
+
+    with StubVpicServer(latency=args.latency) as server:
+        client = VpicClient(base_url=server.base_url)
+        decodes = min(args.decodes, 200)
+        start = time.perf_counter()
+        for _ in range(decodes):
+            parse_response(client.get_json(f'decodevinvalues/{VIN}'))
+        print(f'API decode (local stub): {(time.perf_counter() - start) / decodes * 1e6:.1f} us')
+
+
+if __name__ == '__main__':
+    main()
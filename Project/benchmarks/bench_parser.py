@@ -0,0 +1,89 @@
+"""vPIC response parsing: old elif chain vs the table-driven parsers
+
+    python -m benchmarks.bench_parser --rounds 20000
+
+Times json.loads plus parsing, on the recorded decodevin (list) and
+decodevinvalues (flat) responses, and on a 10k-VIN batch response.
+"""
+import argparse
+import json
+import time
+from benchmarks.vpic_stub import load_fixture
+from vpic import parse_response, parse_values
+
+
+def old_parse(data):
+    """The parser fetch_car_data used before the lookup tables"""
+    car_info_data = {}
+    for item in data['Results']:
+        if item['Variable'] == 'Model Year':
+            car_info_data['year'] = int(item['Value']) if item['Value'] else None
+        elif item['Variable'] == 'Make':
+            car_info_data['make'] = item['Value']
+        elif item['Variable'] == 'Model':
+            car_info_data['model'] = item['Value']
+        elif item['Variable'] == 'Trim':
+            car_info_data['trim'] = item['Value']
+        elif item['Variable'] == 'Top Speed':
+            car_info_data['top_speed'] = int(item['Value']) if item['Value'] else None
+        elif item['Variable'] == 'Engine Number of Cylinders':
+            car_info_data['cylinders'] = item['Value']
+        elif item['Variable'] == 'Engine Brake (hp) From':
+            car_info_data['horsepower'] = item['Value']
+        elif item['Variable'] == 'Turbo':
+            car_info_data['turbo'] = item['Value']
+        elif item['Variable'] == 'Engine Model':
+            car_info_data['engine_model'] = item['Value']
+        elif item['Variable'] == 'Fuel Type - Primary':
+            car_info_data['fuel_type'] = item['Value']
+        elif item['Variable'] == 'Transmission Style':
+            car_info_data['transmission_style'] = item['Value']
+        elif item['Variable'] == 'Drive Type':
+            car_info_data['drive_type'] = item['Value']
+    return car_info_data
+
+
+def timed(name, func, rounds):
+    func()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    per_call = (time.perf_counter() - start) / rounds * 1e6
+    print(f'{name:<40} {per_call:9.2f} us')
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=10000)
+    args = parser.parse_args()
+
+    listed = json.dumps(load_fixture('decodevin.json'))
+    flat = json.dumps(load_fixture('decodevinvalues.json'))
+    listed_data = json.loads(listed)
+    flat_data = json.loads(flat)
+
+    print(f'decodevin payload {len(listed)} bytes, decodevinvalues payload {len(flat)} bytes')
+    old = timed('parse only: old, decodevin', lambda: old_parse(listed_data), args.rounds)
+    timed('parse only: table, decodevin', lambda: parse_response(listed_data), args.rounds)
+    new = timed('parse only: table, decodevinvalues', lambda: parse_response(flat_data), args.rounds)
+    print(f'  speedup {old / new:.1f}x')
+
+    old = timed('json + parse: old, decodevin', lambda: old_parse(json.loads(listed)), args.rounds)
+    timed('json + parse: table, decodevin', lambda: parse_response(json.loads(listed)), args.rounds)
+    new = timed('json + parse: table, decodevinvalues', lambda: parse_response(json.loads(flat)), args.rounds)
+    print(f'  speedup {old / new:.1f}x')
+
+    row = flat_data['Results'][0]
+    batch = json.dumps({'Results': [dict(row, VIN=f'{n:017d}') for n in range(args.batch)]})
+    start = time.perf_counter()
+    rows = json.loads(batch)['Results']
+    parsed = {row['VIN']: parse_values(row) for row in rows}
+    elapsed = time.perf_counter() - start
+    print(f'{args.batch}-VIN batch ({len(batch) // 1024} KiB): {elapsed * 1000:.1f} ms '
+          f'({elapsed / len(parsed) * 1e6:.2f} us per VIN)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""Throughput and p50/p95/p99 of every route, with vPIC served by the local stub
+
+    DATABASE_URL=postgresql:///car_lookup_bench python -m benchmarks.bench_routes \\
+        --users 50 --cars-per-user 200 --concurrency 8 --requests 500 --output results.json
+    python -m benchmarks.bench_routes --compare results.json
+
+Seeds --users users with --cars-per-user cars each, starts the vPIC stub
+with --vpic-latency seconds per response and serves the app on a local
+threaded server pointed at it. Each of --concurrency threads logs in as
+its own user, then every route gets --requests requests split between the
+threads. VIN lookups and car adds that must reach vPIC use a fresh VIN per
+request; the others use the user's saved cars. Routes that delete or are
+one-shot (logout, remove-car, bulk add, import) are left out.
+
+--output writes the results as JSON, with the commit they were measured
+at; --compare prints the change from such a file. Without DATABASE_URL a
+throwaway SQLite file is used; the tables are dropped afterwards.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+
+# name -> (method, url, form data, expected status); formatted with the worker's user and cars
+ROUTES = {
+    'index': ('get', '/', None, 200),
+    'login_form': ('get', '/login', None, 200),
+    'login': ('post', '/login', {'email': '{email}', 'password': 'password'}, 302),
+    'register_form': ('get', '/register', None, 200),
+    'user_profile': ('get', '/user/{user_id}', None, 200),
+    'user_profile_next_page': ('get', '/user/{user_id}?after={after}', None, 200),
+    'update_profile_form': ('get', '/user/{user_id}/update', None, 200),
+    'show_car_info': ('get', '/show-car-info/{vin}', None, 200),
+    'update_car_info_form': ('get', '/update-car-info/{vin}', None, 200),
+    'update_car_info': ('post', '/update-car-info/{vin}', {'trim': 'Bench {n}'}, 302),
+    'get_car_info_saved': ('post', '/get-car-info/', {'vin': '{vin}'}, 200),
+    'get_car_info_vpic': ('post', '/get-car-info/', {'vin': '{new_vin}'}, 200),
+    'add_car': ('post', '/user/{user_id}/add', {'vin': '{new_vin}'}, 302),
+    'api_vin': ('get', '/api/v1/vins/{vin}', None, 200),
+    'api_vin_vpic': ('get', '/api/v1/vins/{new_vin}', None, 200),
+    'api_garage': ('get', '/api/v1/garage', None, 200),
+    'api_garage_car': ('get', '/api/v1/garage/{vin}', None, 200),
+    'garage_export': ('get', '/api/v1/garage/export?format=csv', None, 200),
+    'metrics': ('get', '/metrics', None, 200),
+}
+
+SPECS = [
+    (2021, 'TOYOTA', 'Camry'), (2022, 'HONDA', 'Civic'), (2020, 'FORD', 'F-150'),
+    (2023, 'TESLA', 'Model 3'), (2019, 'SUBARU', 'Outback'),
+]
+
+
+def make_vin(prefix, n):
+    """The n-th VIN after an 8 character prefix, with a valid check digit"""
+    from vin import check_digit
+    vin = f'{prefix}0MA{n:06d}'
+    return vin[:8] + check_digit(vin) + vin[9:]
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def seed(app, users, cars_per_user):
+    """Users with cars spread over a few shared specs; returns [(user id, email, [(car id, vin)])]"""
+    from models import db, User, Car, VehicleSpec
+    from passwords import password_hasher
+
+    with app.app_context():
+        db.create_all()
+        password = password_hasher.hash('password')
+        specs = [VehicleSpec(spec_key=f'bench-routes-{n}', year=year, make=make, model=model)
+                 for n, (year, make, model) in enumerate(SPECS)]
+        db.session.add_all(specs)
+        db.session.add_all([User(name=f'Bench {n}', email=f'bench{n}@example.com', password=password)
+                            for n in range(users)])
+        db.session.commit()
+
+        seeded = []
+        for n, user in enumerate(User.query.filter(User.email.like('bench%@example.com')).order_by(User.id)):
+            db.session.execute(db.insert(Car), [
+                {'user_id': user.id, 'vin': make_vin('1BENCH00', n * cars_per_user + c),
+                 'spec_id': specs[c % len(specs)].id} for c in range(cars_per_user)])
+            db.session.commit()
+            cars = db.session.query(Car.id, Car.vin).filter_by(user_id=user.id).order_by(Car.id).all()
+            seeded.append((user.id, user.email, cars))
+        return seeded
+
+
+def run_route(base_url, sessions, name, requests_per_route, serials):
+    """Send requests_per_route requests to one route, split across the sessions; returns timings and wall time"""
+    method, url, data, status = ROUTES[name]
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+
+    def worker(session, user_id, email, cars):
+        values = {'user_id': user_id, 'email': email}
+        samples = []
+        failed = 0
+        while True:
+            n = next(counter)
+            if n >= requests_per_route:
+                break
+            _, vin = cars[n % len(cars)]
+            values.update(n=n, vin=vin, new_vin=make_vin('2NEWVEH0', next(serials)),
+                          after=cars[min(len(cars) - 1, len(cars) // 2)][0])
+            form = {key: value.format(**values) for key, value in data.items()} if data else None
+            start = time.perf_counter()
+            response = session.request(method, base_url + url.format(**values), data=form, allow_redirects=False)
+            response.content
+            samples.append((time.perf_counter() - start) * 1000)
+            if response.status_code != status:
+                failed += 1
+        with lock:
+            latencies.extend(samples)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=session) for session in sessions]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def summarize(latencies, errors, seconds):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 0.5), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    print(f'{"route":<24} {"req/s":>8} {"p50":>9} {"p95":>9} {"p99":>9} {"errors":>7}')
+    for name, result in results['routes'].items():
+        line = (f'{name:<24} {result["throughput_rps"]:8.1f} {result["p50_ms"]:7.2f}ms '
+                f'{result["p95_ms"]:7.2f}ms {result["p99_ms"]:7.2f}ms {result["errors"]:7d}')
+        before = (baseline or {}).get('routes', {}).get(name)
+        if before:
+            changes = [(result[key] - before[key]) / before[key] * 100 if before[key] else 0
+                       for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms')]
+            line += '   vs {}: {:+.0f}% req/s, p50 {:+.0f}%, p95 {:+.0f}%, p99 {:+.0f}%'.format(
+                baseline.get('commit') or 'baseline', *changes)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--cars-per-user', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads, each logged in as its own user')
+    parser.add_argument('--vpic-latency', type=float, default=0.05, help='stub response latency in seconds')
+    parser.add_argument('--bcrypt-rounds', type=int, default=4,
+                        help='cost of the seeded hashes and logins; 12 to match production')
+    parser.add_argument('--routes', help=f'comma-separated subset of: {", ".join(ROUTES)}')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    names = args.routes.split(',') if args.routes else list(ROUTES)
+    unknown = [name for name in names if name not in ROUTES]
+    if unknown:
+        parser.error(f'unknown routes: {", ".join(unknown)}')
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    from benchmarks.vpic_stub import StubVpicServer
+
+    with StubVpicServer(latency=args.vpic_latency) as stub:
+        directory = tempfile.mkdtemp()
+        os.environ.setdefault('DATABASE_URL', f'sqlite:///{directory}/bench.sqlite')
+        os.environ['VPIC_BASE_URL'] = stub.base_url
+        os.environ['RATE_LIMIT_ENABLED'] = '0'
+        os.environ['BCRYPT_LOG_ROUNDS'] = str(args.bcrypt_rounds)
+
+        import requests
+        from werkzeug.serving import make_server
+        from app import app
+        from models import db
+
+        app.config['WTF_CSRF_ENABLED'] = False
+        users = seed(app, args.users, args.cars_per_user)
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+        sessions = []
+        for user_id, email, cars in (users[n % len(users)] for n in range(args.concurrency)):
+            session = requests.Session()
+            session.post(f'{base_url}/login', data={'email': email, 'password': 'password'}, allow_redirects=False)
+            sessions.append((session, user_id, email, cars))
+
+        serials = itertools.count()
+        results = {
+            'commit': current_commit(),
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+            'routes': {},
+        }
+        for name in names:
+            latencies, errors, seconds = run_route(base_url, sessions, name, args.requests, serials)
+            results['routes'][name] = summarize(latencies, errors, seconds)
+
+        server.shutdown()
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    print(f'{args.users} users x {args.cars_per_user} cars, {args.concurrency} threads, '
+          f'vPIC latency {args.vpic_latency * 1000:.0f} ms')
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Adds per second: the old two-commit save_car_data vs the single transaction
+
+    DATABASE_URL=postgresql:///car_lookup_bench python -m benchmarks.bench_save_car_data --adds 2000
+
+Without DATABASE_URL a throwaway SQLite file is used. The tables are
+created, and dropped again afterwards, in whatever database is used.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+
+CAR_INFO_DATA = {
+    'year': 2023, 'make': 'TOYOTA', 'model': 'RAV4', 'trim': 'XLE', 'top_speed': None,
+    'cylinders': '4', 'horsepower': '203', 'turbo': None, 'engine_model': 'A25A-FKS',
+    'fuel_type': 'Gasoline', 'transmission_style': 'Automatic', 'drive_type': 'AWD/All-Wheel Drive',
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--adds', type=int, default=2000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{directory}/bench.sqlite')
+
+    from app import app
+    from models import db, User, Car, CarInfo, save_car_data
+
+    def old_save_car_data(vin, user_id, car_info_data):
+        car = Car(vin=vin, user_id=user_id)
+        db.session.add(car)
+        db.session.commit()
+        db.session.add(CarInfo(car_id=car.id, **car_info_data))
+        db.session.commit()
+
+    with app.app_context():
+        db.create_all()
+        user = User(name='Bench', email='bench@example.com', password='x')
+        db.session.add(user)
+        db.session.commit()
+
+        rates = {}
+        for name, save in [('two commits', old_save_car_data), ('one transaction', save_car_data)]:
+            start = time.perf_counter()
+            for n in range(args.adds):
+                save(f'{name[:3].upper()}{n:014d}', user.id, CAR_INFO_DATA)
+            rates[name] = args.adds / (time.perf_counter() - start)
+            print(f'{name:<16} {rates[name]:8.0f} adds/s')
+
+        print(f'speedup {rates["one transaction"] / rates["two commits"]:.2f}x')
+        db.session.remove()
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Per-decode latency: bare requests.get vs the pooled VpicClient
+
+    python -m benchmarks.bench_vpic_client --decodes 500 --latency 0.002
+
+Both run against the local vPIC stub. The stub is plain HTTP, so the gap
+shown is TCP setup only; against the real HTTPS API each new connection
+also pays a TLS handshake, which the pooled client avoids as well.
+"""
+import argparse
+import statistics
+import time
+import requests
+from benchmarks.vpic_stub import StubVpicServer
+from vpic import VpicClient
+
+
+VIN = '2T3W1RFV3PW284566'
+
+
+def bare_decode(base_url):
+    url = f'{base_url}/decodevin/{VIN}?format=json'
+    return requests.get(url).json()
+
+
+def run(name, decode, count):
+    decode()
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        decode()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+    p50 = statistics.median(timings)
+    p99 = timings[int(len(timings) * 0.99) - 1]
+    print(f'{name:<14} mean {statistics.mean(timings):7.3f} ms   p50 {p50:7.3f} ms   p99 {p99:7.3f} ms')
+    return p50
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--decodes', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0, help='stub response latency in seconds')
+    args = parser.parse_args()
+
+    with StubVpicServer(latency=args.latency) as server:
+        bare = run('requests.get', lambda: bare_decode(server.base_url), args.decodes)
+        bare_connections = server.connections
+
+        client = VpicClient(base_url=server.base_url)
+        pooled = run('VpicClient', lambda: client.get_json(f'decodevin/{VIN}'), args.decodes)
+        pooled_connections = server.connections - bare_connections
+
+    print(f'connections opened: requests.get {bare_connections}, VpicClient {pooled_connections}')
+    print(f'p50 speedup: {bare / pooled:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
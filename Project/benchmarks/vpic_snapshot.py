@@ -0,0 +1,55 @@
+"""Build a small synthetic vPIC snapshot for tests and benchmarks
+
+It has the tables offline_vpic reads, in the same shape as the vPIC
+standalone database, filled with RAV4 and Accord patterns plus `filler`
+extra patterns per schema to approximate a real schema's size.
+"""
+import sqlite3
+
+
+def build_snapshot(path, filler=0):
+    connection = sqlite3.connect(path)
+    connection.executescript('''
+        CREATE TABLE Element (Id INTEGER PRIMARY KEY, Name TEXT, LookupTable TEXT);
+        CREATE TABLE Make (Id INTEGER PRIMARY KEY, Name TEXT);
+        CREATE TABLE Model (Id INTEGER PRIMARY KEY, Name TEXT);
+        CREATE TABLE DriveType (Id INTEGER PRIMARY KEY, Name TEXT);
+        CREATE TABLE Wmi (Id INTEGER PRIMARY KEY, Wmi TEXT, MakeId INTEGER);
+        CREATE TABLE Wmi_VinSchema (Id INTEGER PRIMARY KEY, WmiId INTEGER, VinSchemaId INTEGER,
+                                    YearFrom INTEGER, YearTo INTEGER);
+        CREATE TABLE Pattern (Id INTEGER PRIMARY KEY, VinSchemaId INTEGER, Keys TEXT,
+                              ElementId INTEGER, AttributeId TEXT);
+    ''')
+    connection.executemany('INSERT INTO Element VALUES (?, ?, ?)', [
+        (26, 'Make', 'Make'),
+        (28, 'Model', 'Model'),
+        (38, 'Trim', None),
+        (9, 'Engine Number of Cylinders', None),
+        (15, 'Drive Type', 'DriveType'),
+        (18, 'Engine Model', None),
+        (34, 'Series', None),
+    ])
+    connection.executemany('INSERT INTO Make VALUES (?, ?)', [(448, 'TOYOTA'), (474, 'HONDA')])
+    connection.executemany('INSERT INTO Model VALUES (?, ?)', [(2025, 'RAV4'), (1861, 'Accord')])
+    connection.executemany('INSERT INTO DriveType VALUES (?, ?)', [(2, '4WD/4-Wheel Drive/4x4'), (3, 'AWD/All-Wheel Drive')])
+    connection.executemany('INSERT INTO Wmi VALUES (?, ?, ?)', [(1, '2T3', 448), (2, '1HG', 474)])
+    connection.executemany('INSERT INTO Wmi_VinSchema (WmiId, VinSchemaId, YearFrom, YearTo) VALUES (?, ?, ?, ?)', [
+        (1, 100, 2019, None),
+        (2, 200, 2003, 2007),
+    ])
+    patterns = [
+        (100, 'W1RF', 28, '2025'),
+        (100, '*1R', 38, 'LE'),
+        (100, 'W1RF', 38, 'XLE'),
+        (100, '*1RF', 9, '4'),
+        (100, '****V', 15, '3'),
+        (100, '*1RF', 18, 'A25A-FKS'),
+        (200, 'CM8', 28, '1861'),
+        (200, 'CM826', 38, 'EX'),
+        (200, 'CM8[2-3]', 9, '4'),
+    ]
+    for schema_id in (100, 200):
+        patterns += [(schema_id, f'ZZ{n:03d}', 38, f'Trim {n}') for n in range(filler)]
+    connection.executemany('INSERT INTO Pattern (VinSchemaId, Keys, ElementId, AttributeId) VALUES (?, ?, ?, ?)', patterns)
+    connection.commit()
+    connection.close()
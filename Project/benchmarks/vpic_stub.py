@@ -0,0 +1,125 @@
+"""Local stand-in for the NHTSA vPIC API
+
+Replays recorded decodevin, decodevinvalues and DecodeVINValuesBatch
+responses for any VIN, over HTTP/1.1 with keep-alive, so the app and the
+benchmarks can run without the network.
+
+    python -m benchmarks.vpic_stub --port 8765 --latency 0.3
+
+then start the app with VPIC_BASE_URL=http://127.0.0.1:8765/api/vehicles
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return json.load(f)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        self._reply()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        form = parse_qs(self.rfile.read(length).decode())
+        self._reply(form.get('data', [''])[0])
+
+    def _reply(self, batch=None):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            fail = server.failures_left > 0
+            if fail:
+                server.failures_left -= 1
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if fail:
+            body = b'{"Message": "Service Unavailable"}'
+            self.send_response(503)
+        elif batch is not None:
+            row = server.batch_response['Results'][0]
+            results = [dict(row, VIN=vin) for vin in batch.split(';') if vin]
+            data = dict(server.batch_response, Count=len(results), Results=results)
+            body = json.dumps(data).encode()
+            self.send_response(200)
+        else:
+            path = self.path.split('?')[0].rstrip('/').lower()
+            endpoint, vin = path.rsplit('/', 2)[-2:]
+            vin = vin.upper()
+            if endpoint == 'decodevinvalues':
+                row = dict(server.batch_response['Results'][0], VIN=vin)
+                data = dict(server.batch_response, SearchCriteria=f'VIN:{vin}', Results=[row])
+            else:
+                data = dict(server.response, SearchCriteria=f'VIN:{vin}')
+            body = json.dumps(data).encode()
+            self.send_response(200)
+
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubVpicServer(ThreadingHTTPServer):
+    """Threaded vPIC stub; use as a context manager to run it in the background"""
+
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, response=None, fail_first=0):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.latency = latency
+        self.response = response or load_fixture('decodevin.json')
+        self.batch_response = load_fixture('decodevinvalues.json')
+        self.failures_left = fail_first
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def handle_error(self, request, client_address):
+        pass
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/api/vehicles'
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    args = parser.parse_args()
+
+    server = StubVpicServer(port=args.port, latency=args.latency)
+    print(f'vPIC stub listening on {server.base_url}')
+    server.serve_forever()
@@ -0,0 +1,29 @@
+import os
+from contextlib import contextmanager
+import pytest
+from query_budget import query_budget
+
+
+# Tests run decode jobs themselves; a background sweeper would race them for the jobs they leave
+os.environ.setdefault('DECODE_JOB_SWEEP_INTERVAL', '0')
+
+
+@pytest.fixture
+def max_queries():
+    """Fail the test if a block runs more SQL statements than expected, or repeats one
+
+        with max_queries(2):
+            client.get(f'/user/{user.id}')
+    """
+    @contextmanager
+    def check(limit, repeat_limit=None):
+        with query_budget.record() as log:
+            yield log
+
+        if log.count > limit:
+            pytest.fail(f'{log.count} SQL statements, expected at most {limit}:\n' + '\n'.join(log.statements))
+        repeated = log.repeated(repeat_limit or query_budget.repeat_limit)
+        if repeated:
+            shape, times = repeated[0]
+            pytest.fail(f'The same SQL statement ran {times} times, likely an N+1 query:\n{shape}')
+    return check
@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from models import db, Car, DecodeJob, VehicleSpec, fetch_car_data, has_required_fields, touch_garage
+
+
+logger = logging.getLogger(__name__)
+
+
+class DecodeWorker:
+    """Background thread pool that decodes the spec of pending cars
+
+    Jobs live in the decode_jobs table, so a job is never lost when a
+    process restarts: resume_pending() picks up anything left behind. Each
+    job is claimed with a conditional UPDATE before it runs, so several
+    processes can share the table without decoding the same car twice.
+
+    A failed decode goes back to pending and is retried after
+    DECODE_JOB_RETRY_DELAY seconds, doubling each time, until it has been
+    tried DECODE_JOB_MAX_ATTEMPTS times; then it stays failed. Each process
+    starts a sweeper thread with its first request that runs
+    resume_pending() every DECODE_JOB_SWEEP_INTERVAL seconds, which is what
+    picks up both retries and jobs left by an earlier process.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._sweeper = None
+        self._pid = None
+        self._queued = set()
+        self._lock = threading.Lock()
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['decode_worker'] = self
+        app.before_request(self.start)
+
+    @property
+    def eager(self):
+        return self.app.config.get('DECODE_JOBS_EAGER', False)
+
+    def start(self):
+        """Start this process's sweeper, once; a forked worker starts its own"""
+        if self._pid == os.getpid():
+            return
+        interval = self.app.config.get('DECODE_JOB_SWEEP_INTERVAL', 60)
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # Threads don't survive a fork, so neither does a pool the parent made
+            self._executor = None
+            self._queued = set()
+            if self.eager or not interval:
+                return
+            self._sweeper = threading.Thread(target=self._sweep, args=(interval,), name='decode-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def _sweep(self, interval):
+        while True:
+            try:
+                self.resume_pending()
+            except Exception:
+                logger.exception('Resuming decode jobs failed')
+            time.sleep(interval)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.app.config.get('DECODE_WORKERS', 4),
+                    thread_name_prefix='decode-worker')
+            return self._executor
+
+    def enqueue(self, job_id):
+        """Run the job in the background, or right away in eager mode"""
+        if self.eager:
+            self.run_job(job_id)
+            return
+
+        with self._lock:
+            if job_id in self._queued:
+                return
+            self._queued.add(job_id)
+        self._get_executor().submit(self.run_job, job_id)
+
+    def retry_delay(self, attempts):
+        """Seconds to wait before trying a job again after attempts tries"""
+        if not attempts:
+            return 0
+        return self.app.config.get('DECODE_JOB_RETRY_DELAY', 30) * 2 ** (attempts - 1)
+
+    def resume_pending(self):
+        """Queue pending jobs whose retry is due, and jobs stuck running in an earlier process"""
+        with self.app.app_context():
+            now = datetime.utcnow()
+            stale = now - timedelta(seconds=self.app.config.get('DECODE_JOB_TIMEOUT', 300))
+            DecodeJob.query.filter(DecodeJob.status == 'running', DecodeJob.updated_at < stale) \
+                .update({'status': 'pending'}, synchronize_session=False)
+            db.session.commit()
+            pending = db.session.query(DecodeJob.id, DecodeJob.attempts, DecodeJob.updated_at) \
+                .filter_by(status='pending').all()
+
+        for job_id, attempts, updated_at in pending:
+            if updated_at + timedelta(seconds=self.retry_delay(attempts)) <= now:
+                self.enqueue(job_id)
+
+    def run_job(self, job_id):
+        """Decode one pending car and link it to its spec"""
+        try:
+            with self.app.app_context():
+                self._run_job(job_id)
+        finally:
+            with self._lock:
+                self._queued.discard(job_id)
+
+    def _run_job(self, job_id):
+        claimed = DecodeJob.query.filter_by(id=job_id, status='pending').update(
+            {'status': 'running', 'attempts': DecodeJob.attempts + 1}, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return
+
+        job = db.session.get(DecodeJob, job_id)
+        try:
+            car_info_data = fetch_car_data(job.vin)
+            car = db.session.get(Car, job.car_id)
+            if not has_required_fields(car_info_data):
+                self.fail(job, 'Car info could not be retrieved.')
+                return
+
+            car.spec_id = VehicleSpec.get_or_create_id(car_info_data)
+            db.session.delete(job)
+            touch_garage(car.user_id)
+            db.session.commit()
+        except Exception:
+            logger.exception('Decode job %s failed', job_id)
+            db.session.rollback()
+            job = db.session.get(DecodeJob, job_id)
+            if job:
+                self.fail(job, 'Error decoding car info.')
+
+    def fail(self, job, error):
+        """Put the job back to be retried later, or mark it failed once out of attempts"""
+        job.error = error
+        if job.attempts < self.app.config.get('DECODE_JOB_MAX_ATTEMPTS', 5):
+            job.status = 'pending'
+        else:
+            job.status = 'failed'
+            touch_garage(job.car.user_id)
+        db.session.commit()
+
+
+decode_worker = DecodeWorker()
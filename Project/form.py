@@ -1,5 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, IntegerField, SelectField
+from flask_wtf.file import FileField, FileAllowed, FileRequired
+from wtforms import BooleanField, StringField, PasswordField, IntegerField, SelectField, TextAreaField
 from wtforms.validators import DataRequired, Length, Email, Optional
 
 
@@ -43,4 +44,17 @@ class EditCarInfoForm(FlaskForm):
     engine_model = StringField('Engine Model', validators=[Optional()])
     transmission_style = StringField('Transmission Style', validators=[Optional()])
     drive_type = StringField('Drive Type', validators=[Optional()])
-    
\ No newline at end of file
+
+
+class BulkAddCarsForm(FlaskForm):
+    """Adding many cars at once from a pasted list or a CSV file"""
+
+    vins = TextAreaField('VINs', validators=[Optional()], render_kw={'placeholder': 'One VIN per line', 'rows': 10})
+    vins_file = FileField('CSV File', validators=[FileAllowed(['csv', 'txt'], 'CSV files only.')])
+
+
+class ImportGarageForm(FlaskForm):
+    """Importing existing vehicle records from a CSV file"""
+
+    garage_file = FileField('CSV File', validators=[FileRequired(), FileAllowed(['csv'], 'CSV files only.')])
+    decode_missing = BooleanField('Decode cars missing year, make or model', default=True)
@@ -0,0 +1,156 @@
+"""Bulk import of a fleet's existing vehicle records into a user's garage
+
+The CSV has a vin column plus any of the spec columns (year, make, model,
+trim, ...). VINs are checked locally with vin.validate_vins; nothing is
+decoded up front. Valid rows are loaded into a temporary staging table,
+with COPY on PostgreSQL and one executemany elsewhere, then merged into
+cars, car_info and decode_jobs by a handful of set-based statements in
+one transaction.
+
+Imported values are the importing user's own: they are kept as the car's
+car_info, never written to the shared vehicle_spec table, so no other
+user's lookups or garages see them. Rows missing year, make or model can
+be queued for decoding, which links the car to a decoded spec.
+"""
+import csv
+import io
+from datetime import datetime
+from sqlalchemy import text
+from decode_jobs import decode_worker
+from models import db, SPEC_FIELDS, has_required_fields, touch_garage
+from vin import validate_vins
+
+
+INT_FIELDS = ('year', 'top_speed')
+STAGING_COLUMNS = ('vin',) + SPEC_FIELDS + ('complete',)
+STAGING_TABLE = 'garage_import'
+
+
+def read_import_csv(stream):
+    """Parse an import CSV into (rows, invalid)
+
+    rows are dicts of vin and every spec column, keeping the first row of
+    a repeated VIN. invalid lists (line number, vin, message) for the rows
+    left out. Raises ValueError if there is no vin column.
+    """
+    reader = csv.DictReader(stream)
+    if reader.fieldnames is None or 'vin' not in [name.strip().lower() for name in reader.fieldnames]:
+        raise ValueError('The CSV needs a vin column.')
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+
+    parsed = []
+    invalid = []
+    for line, record in enumerate(reader, start=2):
+        row = {'vin': (record.get('vin') or '').strip().upper()}
+        for field in SPEC_FIELDS:
+            row[field] = (record.get(field) or '').strip() or None
+        try:
+            for field in INT_FIELDS:
+                if row[field] is not None:
+                    row[field] = int(row[field])
+        except ValueError:
+            invalid.append((line, row['vin'], f'{field} must be a whole number.'))
+            continue
+        parsed.append((line, row))
+
+    rows = []
+    seen = set()
+    for (line, row), (message, _) in zip(parsed, validate_vins([row['vin'] for _, row in parsed])):
+        if message:
+            invalid.append((line, row['vin'], message))
+        elif row['vin'] in seen:
+            invalid.append((line, row['vin'], 'VIN appears earlier in the file.'))
+        else:
+            seen.add(row['vin'])
+            rows.append(row)
+
+    invalid.sort()
+    return rows, invalid
+
+def copy_rows(connection, table, columns, rows):
+    """COPY rows into a table through the psycopg2 or psycopg 3 connection"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([row[column] for column in columns] for row in rows)
+    statement = f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)'
+
+    cursor = connection.connection.driver_connection.cursor()
+    if hasattr(cursor, 'copy_expert'):
+        buffer.seek(0)
+        cursor.copy_expert(statement, buffer)
+    else:
+        with cursor.copy(statement) as copy:
+            copy.write(buffer.getvalue())
+
+def stage_rows(connection, rows):
+    """Create the staging table for this transaction and load the rows into it"""
+    definitions = ['vin varchar NOT NULL']
+    definitions += [f'{field} {"integer" if field in INT_FIELDS else "varchar"}' for field in SPEC_FIELDS]
+    definitions += ['complete boolean NOT NULL']
+
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text(f'CREATE TEMPORARY TABLE {STAGING_TABLE} ({", ".join(definitions)}) ON COMMIT DROP'))
+        copy_rows(connection, STAGING_TABLE, STAGING_COLUMNS, rows)
+    else:
+        connection.execute(text(f'CREATE TEMPORARY TABLE {STAGING_TABLE} ({", ".join(definitions)})'))
+        connection.execute(text(
+            f'INSERT INTO {STAGING_TABLE} ({", ".join(STAGING_COLUMNS)}) '
+            f'VALUES ({", ".join(":" + column for column in STAGING_COLUMNS)})'), rows)
+
+def merge_staged(connection, user_id, decode_missing):
+    """Merge the staging table into the user's garage; returns (existing, added, job ids)"""
+    fields = ', '.join(SPEC_FIELDS)
+    staged_fields = ', '.join(f'g.{field}' for field in SPEC_FIELDS)
+    has_any_field = ' OR '.join(f'g.{field} IS NOT NULL' for field in SPEC_FIELDS)
+    params = {'user_id': user_id, 'now': datetime.utcnow()}
+
+    existing = connection.execute(text(
+        f'DELETE FROM {STAGING_TABLE} WHERE vin IN (SELECT vin FROM cars WHERE user_id = :user_id)'),
+        params).rowcount
+
+    added = connection.execute(text(
+        f'INSERT INTO cars (user_id, vin, updated_at) '
+        f'SELECT :user_id, vin, :now FROM {STAGING_TABLE} WHERE true '
+        f'ON CONFLICT (user_id, vin) DO NOTHING'), params).rowcount
+
+    imported = f'FROM {STAGING_TABLE} g JOIN cars c ON c.user_id = :user_id AND c.vin = g.vin'
+    connection.execute(text(
+        f'INSERT INTO car_info (car_id, {fields}, updated_at) '
+        f'SELECT c.id, {staged_fields}, :now {imported} WHERE {has_any_field}'), params)
+
+    job_ids = []
+    if decode_missing:
+        job_ids = connection.execute(text(
+            f'INSERT INTO decode_jobs (car_id, vin, status, attempts, updated_at) '
+            f"SELECT c.id, c.vin, 'pending', 0, :now {imported} WHERE NOT g.complete RETURNING id"),
+            params).scalars().all()
+
+    return existing, added, job_ids
+
+def import_garage(user_id, rows, decode_missing=True):
+    """Add rows from read_import_csv to the user's garage in one transaction
+
+    VINs the user already has are left alone. With decode_missing, cars
+    without year, make and model get a decode job. Returns a dict with the
+    number of cars added, VINs already in the garage and decodes queued.
+    """
+    if not rows:
+        return {'added': 0, 'existing': 0, 'queued': 0}
+
+    staged = [dict(row, complete=has_required_fields(row)) for row in rows]
+    try:
+        connection = db.session.connection()
+        stage_rows(connection, staged)
+        existing, added, job_ids = merge_staged(connection, user_id, decode_missing)
+        if connection.dialect.name != 'postgresql':
+            connection.execute(text(f'DROP TABLE {STAGING_TABLE}'))
+        if added:
+            touch_garage(user_id)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+    for job_id in job_ids:
+        decode_worker.enqueue(job_id)
+
+    return {'added': added, 'existing': existing, 'queued': len(job_ids)}
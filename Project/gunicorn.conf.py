@@ -0,0 +1,31 @@
+# gunicorn --config gunicorn.conf.py app:app
+#
+# APP_PRELOAD=1 imports the app once in the master and forks it into every
+# worker, instead of importing it again per worker.
+#
+# Each worker writes its metrics to METRICS_DIR so /metrics, whichever
+# worker serves it, reports the whole server. The directory is emptied
+# when the server starts.
+#
+# Behind nginx or a load balancer, set TRUSTED_PROXIES to the number of
+# proxies in front of gunicorn so login throttling sees client addresses
+# from X-Forwarded-For instead of the proxy's (see rate_limit.py).
+import glob
+import os
+import tempfile
+
+preload_app = os.environ.get('APP_PRELOAD', '') == '1'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+if 'METRICS_DIR' not in os.environ:
+    os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='car-lookup-metrics-')
+
+
+def on_starting(server):
+    for path in glob.glob(os.path.join(os.environ['METRICS_DIR'], '*.json')):
+        os.remove(path)
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from app import app, after_fork
+        after_fork(app)
@@ -0,0 +1,377 @@
+"""Counters and latency histograms, exposed at /metrics in the Prometheus text format
+
+Recording never takes a lock: each thread writes to its own shard of
+plain dicts, and a scrape adds the shards up. When a thread ends, its
+shard is folded into a single retired shard, so totals never go
+backwards and a server that starts a thread per request doesn't keep a
+shard for every thread it ever ran.
+
+Under gunicorn every worker has its own registry. With METRICS_DIR set,
+each worker writes its totals to a file there at most every
+METRICS_FLUSH_INTERVAL seconds, and a scrape, whichever worker serves it,
+adds up every file in the directory. gunicorn.conf.py sets METRICS_DIR to
+a fresh directory for each server.
+
+With SERVER_TIMING_ENABLED, each response also carries a Server-Timing
+header splitting the request into SQL, vPIC, bcrypt and template time,
+fed by the same recording calls. When it is off, those calls only find
+no timings on the thread and return.
+"""
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+import weakref
+from flask import before_render_template, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Counter:
+    """A monotonically increasing total per label values"""
+    kind = 'counter'
+
+    def __init__(self, registry, name, help, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def inc(self, *values, amount=1):
+        counters = self.registry._shard().counters
+        key = (self.name, values)
+        counters[key] = counters.get(key, 0) + amount
+
+
+class Histogram:
+    """Counts of observed values per bucket, and their sum, per label values
+
+    A histogram with a timing name also adds what it observes to that
+    entry of the current request's Server-Timing header.
+    """
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labels=(), buckets=LATENCY_BUCKETS, timing=None):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.timing = timing
+
+    def observe(self, value, *values):
+        if self.timing:
+            self.registry.timing(self.timing, value)
+        histograms = self.registry._shard().histograms
+        key = (self.name, values)
+        counts = histograms.get(key)
+        if counts is None:
+            # One count per bucket, one for +Inf, then the sum
+            counts = histograms[key] = [0] * (len(self.buckets) + 1) + [0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+
+class Shard:
+    """One thread's totals: {(name, labels): total} and {(name, labels): bucket counts + sum}"""
+    __slots__ = ('counters', 'histograms', '__weakref__')
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+
+class Metrics:
+    """Registry of every metric in the process, recorded per thread"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.enabled = True
+        self.server_timing = False
+        self.directory = None
+        self.flush_interval = 5
+        self._local = threading.local()
+        self._shards = []
+        self._retired = ({}, {})
+        self._collectors = []
+        self._statement_listeners = []
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+        self._flushed = 0
+
+        self.request_duration = self.histogram(
+            'http_request_duration_seconds', 'Time spent in a view, by endpoint, method and status.',
+            ('endpoint', 'method', 'status'))
+        self.request_queries = self.histogram(
+            'db_queries_per_request', 'SQL statements run by one request.', ('endpoint',), COUNT_BUCKETS)
+        self.request_db_time = self.histogram(
+            'db_seconds_per_request', 'Time one request spent waiting on SQL statements.', ('endpoint',))
+        self.render_duration = self.histogram(
+            'template_render_duration_seconds', 'Time spent rendering a template.', ('template',), timing='render')
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(self, name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS, timing=None):
+        return self._register(Histogram(self, name, help, labels, buckets, timing))
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def collector(self, function):
+        """Add a function returning [(counter, label values, total)] read at scrape time
+
+        For totals something else already keeps, such as the VIN cache's hit counts.
+        """
+        self._collectors.append(function)
+        return function
+
+    def statement_listener(self, function):
+        """Also call function(statement, seconds) for every SQL statement any engine runs
+
+        For the query budget, so both share the one pair of engine hooks.
+        """
+        listen_statements()
+        if function not in self._statement_listeners:
+            self._statement_listeners.append(function)
+        return function
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = Shard()
+            totals = (shard.counters, shard.histograms)
+            with self._lock:
+                self._shards.append(totals)
+            # The thread's locals, and so the Shard, go away when the thread ends
+            weakref.finalize(shard, self._retire, totals)
+            return shard
+
+    def _retire(self, totals):
+        """Fold an ended thread's totals into the retired shard"""
+        with self._lock:
+            self._shards = [shard for shard in self._shards if shard is not totals]
+            merge_totals(self._retired, totals)
+
+    def init_app(self, app):
+        """Time every request and the SQL statements and templates it runs"""
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.server_timing = app.config.get('SERVER_TIMING_ENABLED', False)
+        self.directory = app.config.get('METRICS_DIR') or None
+        self.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', 5)
+        app.extensions['metrics'] = self
+        if not self.enabled and not self.server_timing:
+            return
+
+        app.before_request(self._start_request)
+        app.after_request(self._add_headers)
+        app.teardown_request(self._finish_request)
+        before_render_template.connect(self._start_render, app)
+        template_rendered.connect(self._finish_render, app)
+        listen_statements()
+        if self.enabled and self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            atexit.register(self.flush)
+
+    def _start_request(self):
+        self._local.request = [time.perf_counter(), 0, 0.0]
+        self._local.status = None
+        self._local.timings = {} if self.server_timing else None
+
+    def _add_headers(self, response):
+        """Note the status for _finish_request, and send the Server-Timing header"""
+        self._local.status = response.status_code
+        started = getattr(self._local, 'request', None)
+        if started is not None and self.server_timing:
+            start, queries, db_time = started
+            response.headers['Server-Timing'] = server_timing_header(
+                time.perf_counter() - start, queries, db_time, self._local.timings)
+        return response
+
+    def _finish_request(self, exc):
+        # A teardown hook, so requests whose view raised are counted too; they
+        # never reach after_request, and are answered with a 500
+        started = getattr(self._local, 'request', None)
+        if started is None:
+            return
+        self._local.request = None
+        self._local.timings = None
+        status = 500 if exc is not None else self._local.status or 500
+        if not self.enabled:
+            return
+
+        start, queries, db_time = started
+        endpoint = request.endpoint or 'unmatched'
+        self.request_duration.observe(time.perf_counter() - start, endpoint, request.method, str(status))
+        self.request_queries.observe(queries, endpoint)
+        self.request_db_time.observe(db_time, endpoint)
+
+        if self.directory and time.monotonic() - self._flushed > self.flush_interval:
+            self.flush()
+
+    def _start_render(self, app, template, context):
+        self._local.render_start = time.perf_counter()
+
+    def _finish_render(self, app, template, context):
+        start = getattr(self._local, 'render_start', None)
+        if start is not None:
+            self._local.render_start = None
+            self.render_duration.observe(time.perf_counter() - start, template.name or 'string')
+
+    def record_query(self, seconds):
+        """Add one statement to the current request's totals, if there is one"""
+        current = getattr(self._local, 'request', None)
+        if current is not None:
+            current[1] += 1
+            current[2] += seconds
+
+    def timing(self, name, seconds=0.0, desc=None):
+        """Add to an entry of the current request's Server-Timing header, if it is being sent"""
+        timings = getattr(self._local, 'timings', None)
+        if timings is None:
+            return
+        entry = timings.get(name)
+        if entry is None:
+            timings[name] = [seconds, desc]
+        else:
+            entry[0] += seconds
+            if desc:
+                entry[1] = desc
+
+    def snapshot(self):
+        """This process's totals: ({(name, labels): total}, {(name, labels): bucket counts + sum})"""
+        totals = ({}, {})
+        with self._lock:
+            shards = list(self._shards)
+            merge_totals(totals, self._retired)
+        for shard in shards:
+            merge_totals(totals, (shard[0].copy(), shard[1].copy()))
+        counters, histograms = totals
+
+        for collect in self._collectors:
+            for metric, values, total in collect():
+                counters[(metric.name, values)] = total
+        return counters, histograms
+
+    def flush(self):
+        """Write this process's totals to METRICS_DIR for the other workers' scrapes"""
+        if self._pid != os.getpid():
+            # A worker forked from a preloaded app needs a file of its own
+            self._pid = os.getpid()
+            self._file = f'{self._pid}-{uuid.uuid4().hex}.json'
+
+        self._flushed = time.monotonic()
+        counters, histograms = self.snapshot()
+        data = {
+            'counters': [[name, list(values), total] for (name, values), total in counters.items()],
+            'histograms': [[name, list(values), counts] for (name, values), counts in histograms.items()],
+        }
+        path = os.path.join(self.directory, self._file)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        """Totals of every worker sharing METRICS_DIR, or of this process alone"""
+        if not self.directory:
+            return self.snapshot()
+
+        self.flush()
+        counters = {}
+        histograms = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, values, total in data['counters']:
+                key = (name, tuple(values))
+                counters[key] = counters.get(key, 0) + total
+            for name, values, counts in data['histograms']:
+                key = (name, tuple(values))
+                merged = histograms.get(key)
+                histograms[key] = counts if merged is None else [a + b for a, b in zip(merged, counts)]
+        return counters, histograms
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        counters, histograms = self.collect()
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            if metric.kind == 'counter':
+                for (name, values), total in sorted(counters.items()):
+                    if name == metric.name:
+                        lines.append(f'{name}{label_text(metric.labels, values)} {total}')
+                continue
+
+            for (name, values), counts in sorted(histograms.items()):
+                if name != metric.name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{label_text(metric.labels + ("le",), values + (str(bound),))} {cumulative}')
+                lines.append(f'{name}_sum{label_text(metric.labels, values)} {counts[-1]}')
+                lines.append(f'{name}_count{label_text(metric.labels, values)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def merge_totals(into, totals):
+    """Add (counters, histograms) totals into another such pair"""
+    counters, histograms = into
+    for key, value in totals[0].items():
+        counters[key] = counters.get(key, 0) + value
+    for key, counts in totals[1].items():
+        merged = histograms.get(key)
+        histograms[key] = list(counts) if merged is None else [a + b for a, b in zip(merged, counts)]
+
+def server_timing_header(duration, queries, db_time, timings):
+    """Server-Timing value: SQL time, then each recorded entry, then the whole request"""
+    parts = [f'db;dur={db_time * 1000:.1f};desc="{queries} queries"']
+    for name, (seconds, desc) in timings.items():
+        parts.append(f'{name};dur={seconds * 1000:.1f}' + (f';desc="{desc}"' if desc else ''))
+    parts.append(f'total;dur={duration * 1000:.1f}')
+    return ', '.join(parts)
+
+def label_text(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def listen_statements():
+    """Attach the statement hooks to every engine, once"""
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics._local.query_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - metrics._local.query_start
+    metrics.record_query(seconds)
+    for listener in metrics._statement_listeners:
+        listener(statement, seconds)
+
+
+metrics = Metrics()
@@ -0,0 +1,23 @@
+-- Tables added after the original schema: the shared VIN decode cache and
+-- the background decode job queue. Later migrations assume they exist.
+--
+-- New databases get these from `flask --app app init-db`. For an existing
+-- database, run this before the other migrations:
+--
+--     psql car_lookup -1 -f migrations/000_decode_tables.sql
+
+CREATE TABLE IF NOT EXISTS vin_decode_cache (
+    vin varchar PRIMARY KEY,
+    data json NOT NULL,
+    fetched_at timestamp NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS decode_jobs (
+    id serial PRIMARY KEY,
+    car_id integer NOT NULL UNIQUE REFERENCES cars (id),
+    vin varchar NOT NULL,
+    status varchar NOT NULL DEFAULT 'pending',
+    attempts integer NOT NULL DEFAULT 0,
+    error varchar,
+    updated_at timestamp NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
@@ -0,0 +1,23 @@
+-- Indexes and uniqueness constraints for cars and car_info.
+--
+-- New databases get these from db.create_all(). For an existing database,
+-- after migrations/000_decode_tables.sql:
+--
+--     psql car_lookup -f migrations/001_car_indexes.sql
+--
+-- psql runs each statement in its own transaction, which CREATE INDEX
+-- CONCURRENTLY requires; the indexes are built without locking out writes.
+
+-- Keep the oldest car when a user has the same VIN more than once
+DELETE FROM car_info WHERE car_id IN (
+    SELECT c.id FROM cars c JOIN cars d ON d.user_id = c.user_id AND d.vin = c.vin AND d.id < c.id);
+DELETE FROM decode_jobs WHERE car_id IN (
+    SELECT c.id FROM cars c JOIN cars d ON d.user_id = c.user_id AND d.vin = c.vin AND d.id < c.id);
+DELETE FROM cars c USING cars d WHERE d.user_id = c.user_id AND d.vin = c.vin AND d.id < c.id;
+
+-- Keep the oldest car_info row for each car
+DELETE FROM car_info a USING car_info b WHERE b.car_id = a.car_id AND b.id < a.id;
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_cars_user_id_vin ON cars (user_id, vin);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_cars_vin ON cars (vin);
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_car_info_car_id ON car_info (car_id);
@@ -0,0 +1,59 @@
+-- Shared vehicle_spec rows instead of a full car_info copy per car.
+--
+-- New databases get the table and columns from `flask --app app init-db`. For an
+-- existing database:
+--
+--     psql car_lookup -1 -f migrations/002_vehicle_spec.sql
+--
+-- Every car_info row becomes (or joins) a vehicle_spec row with the same
+-- values, its car points at that spec, and the now redundant car_info row
+-- is deleted. Afterwards car_info only holds an owner's edits from the
+-- update page. spec_key must match models.spec_key(): the md5 of the
+-- twelve spec columns joined with chr(31), NULL as ''.
+
+CREATE TABLE IF NOT EXISTS vehicle_spec (
+    id serial PRIMARY KEY,
+    spec_key varchar(32) NOT NULL UNIQUE,
+    year integer NOT NULL,
+    make varchar NOT NULL,
+    model varchar NOT NULL,
+    trim varchar,
+    top_speed integer,
+    cylinders varchar,
+    horsepower varchar,
+    turbo varchar,
+    engine_model varchar,
+    fuel_type varchar,
+    transmission_style varchar,
+    drive_type varchar
+);
+
+ALTER TABLE cars ADD COLUMN IF NOT EXISTS spec_id integer REFERENCES vehicle_spec (id);
+CREATE INDEX IF NOT EXISTS ix_cars_spec_id ON cars (spec_id);
+
+ALTER TABLE car_info ALTER COLUMN year DROP NOT NULL;
+ALTER TABLE car_info ALTER COLUMN make DROP NOT NULL;
+ALTER TABLE car_info ALTER COLUMN model DROP NOT NULL;
+
+CREATE TEMPORARY TABLE car_info_keys ON COMMIT DROP AS
+SELECT ci.*, md5(concat_ws(chr(31),
+    coalesce(ci.year::text, ''), coalesce(ci.make, ''), coalesce(ci.model, ''),
+    coalesce(ci.trim, ''), coalesce(ci.top_speed::text, ''), coalesce(ci.cylinders, ''),
+    coalesce(ci.horsepower, ''), coalesce(ci.turbo, ''), coalesce(ci.engine_model, ''),
+    coalesce(ci.fuel_type, ''), coalesce(ci.transmission_style, ''), coalesce(ci.drive_type, ''))) AS spec_key
+FROM car_info ci
+JOIN cars c ON c.id = ci.car_id
+WHERE c.spec_id IS NULL AND ci.year IS NOT NULL AND ci.make IS NOT NULL AND ci.model IS NOT NULL;
+
+INSERT INTO vehicle_spec (spec_key, year, make, model, trim, top_speed, cylinders, horsepower,
+                          turbo, engine_model, fuel_type, transmission_style, drive_type)
+SELECT DISTINCT ON (spec_key) spec_key, year, make, model, trim, top_speed, cylinders, horsepower,
+       turbo, engine_model, fuel_type, transmission_style, drive_type
+FROM car_info_keys
+ON CONFLICT (spec_key) DO NOTHING;
+
+UPDATE cars c SET spec_id = vs.id
+FROM car_info_keys k JOIN vehicle_spec vs ON vs.spec_key = k.spec_key
+WHERE k.car_id = c.id;
+
+DELETE FROM car_info ci USING car_info_keys k WHERE k.id = ci.id;
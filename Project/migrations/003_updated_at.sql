@@ -0,0 +1,14 @@
+-- Timestamps behind the ETag / Last-Modified headers of the car and
+-- profile pages.
+--
+-- New databases get these from `flask --app app init-db`. For an existing
+-- database:
+--
+--     psql car_lookup -1 -f migrations/003_updated_at.sql
+--
+-- Existing rows start at the migration time, so cached copies of these
+-- pages are refetched once.
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS garage_updated_at timestamp NOT NULL DEFAULT (now() AT TIME ZONE 'utc');
+ALTER TABLE cars ADD COLUMN IF NOT EXISTS updated_at timestamp NOT NULL DEFAULT (now() AT TIME ZONE 'utc');
+ALTER TABLE car_info ADD COLUMN IF NOT EXISTS updated_at timestamp NOT NULL DEFAULT (now() AT TIME ZONE 'utc');
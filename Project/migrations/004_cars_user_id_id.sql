@@ -0,0 +1,6 @@
+-- Index behind the keyset-paginated garage list: WHERE user_id = ? AND
+-- id > ? ORDER BY id LIMIT n reads one page straight off the index.
+--
+--     psql car_lookup -f migrations/004_cars_user_id_id.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_cars_user_id_id ON cars (user_id, id);
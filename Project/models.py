@@ -1,10 +1,19 @@
-from flask_bcrypt import Bcrypt
+import hashlib
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 import requests
+from metrics import metrics
+import offline_vpic
+from passwords import password_hasher
+import vpic
+from vin_cache import vin_cache
 
 
 db = SQLAlchemy()
-bcrypt = Bcrypt()
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -14,41 +23,149 @@ class User(db.Model):
     email = db.Column(db.String, unique=True, nullable=False)
     profile_pic = db.Column(db.Text, default='/static/lambo.png')
     password = db.Column(db.String, nullable=False)
+    garage_updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
     cars = db.relationship('Car', backref='owner')  
 
     @classmethod
     def register(cls, name, email, profile_pic, password):
         """Register user with hashed password"""
-        hashed = bcrypt.generate_password_hash(password)
-        hashed_utf8 = hashed.decode('utf8')
+        hashed_utf8 = password_hasher.hash(password)
         
         return cls(name=name, email=email, profile_pic=profile_pic, password=hashed_utf8)
     
     @classmethod
     def authenticate(cls, email, password):
-        """Validate that user exists and password is correct"""
+        """Validate that user exists and password is correct
+
+        Rehashes the password when it was hashed at a different cost than
+        BCRYPT_LOG_ROUNDS, so a cost change applies as users log in.
+        """
         user = User.query.filter_by(email=email).first()
 
-        if user and bcrypt.check_password_hash(user.password, password):
+        if user and password_hasher.check(user.password, password):
+            if password_hasher.needs_rehash(user.password):
+                user.password = password_hasher.hash(password)
+                try:
+                    db.session.commit()
+                except:
+                    db.session.rollback()
             return user
         else:
             return False  
 
+SPEC_FIELDS = ('year', 'make', 'model', 'trim', 'top_speed', 'cylinders', 'horsepower', 'turbo',
+               'engine_model', 'fuel_type', 'transmission_style', 'drive_type')
+
+def spec_key(car_info_data):
+    """Hash of the spec values; migrations/002_vehicle_spec.sql computes the same key in SQL"""
+    values = ('' if car_info_data.get(field) is None else str(car_info_data.get(field)) for field in SPEC_FIELDS)
+    return hashlib.md5('\x1f'.join(values).encode()).hexdigest()
+
 class Car(db.Model):
     __tablename__ = 'cars'
+    __table_args__ = (
+        db.Index('uq_cars_user_id_vin', 'user_id', 'vin', unique=True),
+        db.Index('ix_cars_vin', 'vin'),
+        db.Index('ix_cars_spec_id', 'spec_id'),
+        db.Index('ix_cars_user_id_id', 'user_id', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     vin = db.Column(db.String, nullable=False)
+    spec_id = db.Column(db.Integer, db.ForeignKey('vehicle_spec.id'))
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    car_info = db.relationship('CarInfo', backref='car', cascade='all, delete-orphan', single_parent=True)
+    spec = db.relationship('VehicleSpec')
+    car_info = db.relationship('CarInfo', backref='car', uselist=False, cascade='all, delete-orphan', single_parent=True)
+    decode_job = db.relationship('DecodeJob', backref='car', uselist=False, cascade='all, delete-orphan')
 
-class CarInfo(db.Model):
-    __tablename__ = 'car_info'
+    @classmethod
+    def find_for_user(cls, vin, user_id):
+        """The user's car with this VIN, with its spec, CarInfo and decode job, in one query"""
+        return cls.query.options(db.joinedload(cls.spec), db.joinedload(cls.car_info), db.joinedload(cls.decode_job)) \
+            .filter_by(vin=vin, user_id=user_id).first()
+
+    @classmethod
+    def garage_query(cls, user_id, fields):
+        """Query for the user's cars, in id order, as rows of id, vin, the given spec fields
+        with the owner's overrides applied, decode_status and decode_error"""
+        return db.session.query(
+            cls.id, cls.vin,
+            *(db.func.coalesce(getattr(CarInfo, field), getattr(VehicleSpec, field)).label(field) for field in fields),
+            db.func.coalesce(DecodeJob.status, 'ready').label('decode_status'),
+            DecodeJob.error.label('decode_error'),
+        ).outerjoin(VehicleSpec, VehicleSpec.id == cls.spec_id) \
+            .outerjoin(CarInfo, CarInfo.car_id == cls.id) \
+            .outerjoin(DecodeJob, DecodeJob.car_id == cls.id) \
+            .filter(cls.user_id == user_id).order_by(cls.id)
+
+    @classmethod
+    def garage_page(cls, user_id, after=0, page_size=50):
+        """One page of the user's cars after the given car id, as rows of only what the list shows
+
+        Returns (rows, next_after), where next_after is the cursor for the
+        following page or None on the last page. Rows have id, vin, year,
+        make, model, decode_status and decode_error.
+        """
+        rows = cls.garage_query(user_id, ('year', 'make', 'model')) \
+            .filter(cls.id > after).limit(page_size + 1).all()
+
+        if len(rows) > page_size:
+            return rows[:page_size], rows[page_size - 1].id
+        return rows, None
+
+    @classmethod
+    def garage_export(cls, user_id, batch_size=1000):
+        """Every car of the user with all its car info, fetched batch_size rows at a time
+
+        Yields lists of rows. The rows come from a server-side cursor where
+        the driver supports one, so memory use doesn't grow with the garage.
+        """
+        statement = cls.garage_query(user_id, SPEC_FIELDS).statement.execution_options(yield_per=batch_size)
+        yield from db.session.execute(statement).partitions()
+
+    @property
+    def decode_status(self):
+        """'pending', 'running' or 'failed' while a decode job exists, else 'ready'"""
+        return self.decode_job.status if self.decode_job else 'ready'
+
+    @property
+    def details(self):
+        """The shared spec with this owner's CarInfo overrides on top, or None"""
+        if self.spec is None and self.car_info is None:
+            return None
+
+        values = {}
+        for field in SPEC_FIELDS:
+            value = getattr(self.car_info, field) if self.car_info else None
+            if value is None and self.spec:
+                value = getattr(self.spec, field)
+            values[field] = value
+        return SimpleNamespace(**values)
+
+    def set_details(self, values):
+        """Keep the values that differ from the shared spec as this owner's overrides"""
+        if self.car_info is None:
+            self.car_info = CarInfo()
+
+        for field, value in values.items():
+            base = getattr(self.spec, field) if self.spec else None
+            if value is not None and base is not None and str(value) == str(base):
+                value = None
+            setattr(self.car_info, field, value)
+
+        if all(getattr(self.car_info, field) is None for field in SPEC_FIELDS):
+            self.car_info = None
+        self.updated_at = datetime.utcnow()
+
+class VehicleSpec(db.Model):
+    """Decoded car data shared by every car with the same spec"""
+    __tablename__ = 'vehicle_spec'
 
     id = db.Column(db.Integer, primary_key=True)
-    car_id = db.Column(db.Integer, db.ForeignKey('cars.id'), nullable=False)
+    spec_key = db.Column(db.String(32), unique=True, nullable=False)
     year = db.Column(db.Integer, nullable=False)
     make = db.Column(db.String, nullable=False)
     model = db.Column(db.String, nullable=False)
@@ -62,67 +179,370 @@ class CarInfo(db.Model):
     transmission_style = db.Column(db.String)
     drive_type = db.Column(db.String)
 
+    @classmethod
+    def get_or_create_id(cls, car_info_data):
+        """Id of the spec matching the car data, inserted in the current transaction if new"""
+        values = {field: car_info_data.get(field) for field in SPEC_FIELDS}
+        key = spec_key(values)
+
+        spec_id = db.session.query(cls.id).filter_by(spec_key=key).scalar()
+        if spec_id is not None:
+            return spec_id
+
+        insert = INSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+        if insert:
+            statement = insert(cls).values(spec_key=key, **values) \
+                .on_conflict_do_nothing(index_elements=['spec_key']).returning(cls.id)
+            spec_id = db.session.execute(statement).scalar()
+        else:
+            spec = cls(spec_key=key, **values)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(spec)
+                spec_id = spec.id
+            except IntegrityError:
+                pass
+
+        if spec_id is None:
+            spec_id = db.session.query(cls.id).filter_by(spec_key=key).scalar()
+        return spec_id
+
+class CarInfo(db.Model):
+    """One owner's edits to their car's spec; a None column falls back to the spec"""
+    __tablename__ = 'car_info'
+    __table_args__ = (
+        db.Index('uq_car_info_car_id', 'car_id', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    car_id = db.Column(db.Integer, db.ForeignKey('cars.id'), nullable=False)
+    year = db.Column(db.Integer)
+    make = db.Column(db.String)
+    model = db.Column(db.String)
+    trim = db.Column(db.String)
+    top_speed = db.Column(db.Integer)
+    cylinders = db.Column(db.String)
+    horsepower = db.Column(db.String)
+    turbo = db.Column(db.String)
+    engine_model = db.Column(db.String)
+    fuel_type = db.Column(db.String)
+    transmission_style = db.Column(db.String)
+    drive_type = db.Column(db.String)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class DecodeJob(db.Model):
+    """A car waiting for its CarInfo to be decoded in the background"""
+    __tablename__ = 'decode_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    car_id = db.Column(db.Integer, db.ForeignKey('cars.id'), unique=True, nullable=False)
+    vin = db.Column(db.String, nullable=False)
+    status = db.Column(db.String, nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class VinDecodeCache(db.Model):
+    """Parsed vPIC decode results shared by every user, keyed by VIN"""
+    __tablename__ = 'vin_decode_cache'
+
+    vin = db.Column(db.String, primary_key=True)
+    data = db.Column(db.JSON, nullable=False)
+    fetched_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @classmethod
+    def lookup(cls, vin):
+        """Return cached car data for the VIN, or None if missing, expired or incomplete"""
+        entry = db.session.get(cls, vin)
+        if not entry or not has_required_fields(entry.data):
+            return None
+
+        ttl = timedelta(seconds=current_app.config.get('VIN_DECODE_CACHE_TTL', 604800))
+        if entry.fetched_at + ttl < datetime.utcnow():
+            return None
+
+        return entry.data
+
+    @classmethod
+    def store(cls, vin, car_info_data):
+        """Insert or refresh the cached car data for the VIN"""
+        entry = db.session.get(cls, vin)
+        if entry:
+            entry.data = car_info_data
+            entry.fetched_at = datetime.utcnow()
+        else:
+            db.session.add(cls(vin=vin, data=car_info_data))
+
+        try:
+            db.session.commit()
+        except:
+            db.session.rollback()
+
+    @classmethod
+    def lookup_many(cls, vins):
+        """Return {vin: car data} for every VIN with a fresh, complete cache entry"""
+        ttl = timedelta(seconds=current_app.config.get('VIN_DECODE_CACHE_TTL', 604800))
+        entries = cls.query.filter(cls.vin.in_(vins), cls.fetched_at >= datetime.utcnow() - ttl).all()
+        return {entry.vin: entry.data for entry in entries if has_required_fields(entry.data)}
+
+    @classmethod
+    def store_many(cls, car_data_by_vin):
+        """Insert or refresh cached car data for several VINs in one commit"""
+        now = datetime.utcnow()
+        for vin, car_info_data in car_data_by_vin.items():
+            db.session.merge(cls(vin=vin, data=car_info_data, fetched_at=now))
+
+        try:
+            db.session.commit()
+        except:
+            db.session.rollback()
+
+
+decode_sources = metrics.counter(
+    'vin_decode_source_total', 'Where VINs missing from the in-process cache were decoded from.', ('source',))
+
+
+def cached_car_data(vin):
+    """Return car data from the in-process or shared cache without calling the API"""
+    car_info_data = vin_cache.get(vin)
+    if car_info_data is None:
+        car_info_data = VinDecodeCache.lookup(vin)
+        if car_info_data is not None:
+            vin_cache.set(vin, car_info_data)
+    return car_info_data
 
 def fetch_car_data(vin):
-    """Fetch car data from API"""
-    url = f'https://vpic.nhtsa.dot.gov/api/vehicles/decodevin/{vin}?format=json'
-    response = requests.get(url)
-    data = response.json()
-
-    car_info_data = {}
-    for item in data['Results']:
-        if item['Variable'] == 'Model Year':
-            car_info_data['year'] = int(item['Value']) if item['Value'] else None
-        elif item['Variable'] == 'Make':
-            car_info_data['make'] = item['Value']
-        elif item['Variable'] == 'Model':
-            car_info_data['model'] = item['Value']
-        elif item['Variable'] == 'Trim':
-            car_info_data['trim'] = item['Value']
-        elif item['Variable'] == 'Top Speed':
-            car_info_data['top_speed'] = int(item['Value']) if item['Value'] else None
-        elif item['Variable'] == 'Engine Number of Cylinders':
-            car_info_data['cylinders'] = item['Value']
-        elif item['Variable'] == 'Engine Brake (hp) From':
-            car_info_data['horsepower'] = item['Value']
-        elif item['Variable'] == 'Turbo':
-            car_info_data['turbo'] = item['Value']
-        elif item['Variable'] == 'Engine Model':
-            car_info_data['engine_model'] = item['Value']
-        elif item['Variable'] == 'Fuel Type - Primary':
-            car_info_data['fuel_type'] = item['Value']
-        elif item['Variable'] == 'Transmission Style':
-            car_info_data['transmission_style'] = item['Value']
-        elif item['Variable'] == 'Drive Type':
-            car_info_data['drive_type'] = item['Value']
+    """Fetch car data through the in-process cache, then the shared cache, then the API"""
+    metrics.timing('vpic', desc='memory cache')
+    return vin_cache.get_or_load(vin, load_car_data, cacheable=has_required_fields)
 
+def decoded_from(source):
+    """Count where a cache miss was decoded from, and note it in the Server-Timing header"""
+    decode_sources.inc(source)
+    metrics.timing('vpic', desc=source)
+
+def load_car_data(vin):
+    """Fetch car data from the offline snapshot, then the shared decode cache, then the API
+
+    The API is only called when the snapshot can't resolve the required
+    fields, and its result is completed with whatever the snapshot did resolve.
+    A decode without year, make and model counts as failed: {} is returned,
+    so neither cache keeps it and the next lookup tries again.
+    """
+    offline_data = offline_vpic.decode(vin)
+    if has_required_fields(offline_data):
+        decoded_from('offline')
+        return offline_data
+
+    car_info_data = VinDecodeCache.lookup(vin)
+    if car_info_data is not None:
+        decoded_from('shared_cache')
+        return car_info_data
+
+    car_info_data = decode_vin(vin)
+    for field, value in offline_data.items():
+        if car_info_data.get(field) is None:
+            car_info_data[field] = value
+    if not has_required_fields(car_info_data):
+        decoded_from('failed')
+        return {}
+
+    decoded_from('api')
+    VinDecodeCache.store(vin, car_info_data)
     return car_info_data
 
+def has_required_fields(car_info_data):
+    """Whether the car data has everything a CarInfo row can't be saved without"""
+    return all(car_info_data.get(field) for field in ('year', 'make', 'model'))
+
+def decode_vin(vin):
+    """Fetch car data from API"""
+    try:
+        data = vpic.client.get_json(f'decodevinvalues/{vin}')
+    except requests.RequestException:
+        return {}
+
+    return vpic.parse_response(data)
+
+def decode_vin_batch(vins):
+    """Fetch car data for many VINs from the API's batch endpoint
+
+    VINs are sent in chunks of VPIC_BATCH_SIZE. A chunk that fails leaves
+    its VINs out of the result.
+    """
+    batch_size = current_app.config.get('VPIC_BATCH_SIZE', 50)
+    car_data_by_vin = {}
+
+    for start in range(0, len(vins), batch_size):
+        chunk = vins[start:start + batch_size]
+        try:
+            data = vpic.client.post_json('DecodeVINValuesBatch/', {'data': ';'.join(chunk)})
+        except requests.RequestException:
+            continue
+
+        for row in data['Results']:
+            car_data_by_vin[row['VIN'].upper()] = vpic.parse_values(row)
+
+    return car_data_by_vin
+
+def fetch_car_data_batch(vins):
+    """Fetch car data for many VINs, decoding only the cache misses in batches"""
+    car_data_by_vin = {}
+    for vin in vins:
+        car_info_data = vin_cache.get(vin)
+        if car_info_data is not None:
+            car_data_by_vin[vin] = car_info_data
+
+    for vin in vins:
+        if vin not in car_data_by_vin:
+            car_info_data = offline_vpic.decode(vin)
+            if has_required_fields(car_info_data):
+                car_data_by_vin[vin] = car_info_data
+
+    missing = [vin for vin in vins if vin not in car_data_by_vin]
+    if missing:
+        stored = VinDecodeCache.lookup_many(missing)
+        car_data_by_vin.update(stored)
+
+        missing = [vin for vin in missing if vin not in stored]
+        decoded = {vin: data for vin, data in decode_vin_batch(missing).items() if has_required_fields(data)}
+        if decoded:
+            VinDecodeCache.store_many(decoded)
+        car_data_by_vin.update(decoded)
+
+    for vin, car_info_data in car_data_by_vin.items():
+        if has_required_fields(car_info_data):
+            vin_cache.set(vin, car_info_data)
+
+    return car_data_by_vin
+
+def touch_garage(user_id):
+    """Mark the user's profile page as changed, in the current transaction"""
+    db.session.execute(db.update(User).where(User.id == user_id).values(garage_updated_at=datetime.utcnow()))
+
+INSERT_DIALECTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+def insert_car(vin, user_id, spec_id=None):
+    """Insert a car unless the user already has this VIN, in the current transaction
+
+    Returns the new car's id, or None for a duplicate. The unique
+    (user_id, vin) index decides, so concurrent adds can't both succeed.
+    """
+    insert = INSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+    if insert:
+        statement = insert(Car).values(vin=vin, user_id=user_id, spec_id=spec_id) \
+            .on_conflict_do_nothing(index_elements=['user_id', 'vin']).returning(Car.id)
+        return db.session.execute(statement).scalar()
+
+    car = Car(vin=vin, user_id=user_id, spec_id=spec_id)
+    try:
+        with db.session.begin_nested():
+            db.session.add(car)
+    except IntegrityError:
+        return None
+    return car.id
+
 def save_car_data(vin, user_id, car_info_data):
-    """Save car data to the user's profile"""
-    car = Car(vin=vin, user_id=user_id)
-    db.session.add(car)
-    db.session.commit()
+    """Save car data to the user's profile in a single transaction
 
-    car_info = CarInfo(
-        car_id=car.id,
-        year=car_info_data.get('year'),
-        make=car_info_data.get('make'),
-        model=car_info_data.get('model'),
-        trim=car_info_data.get('trim'),
-        top_speed=car_info_data.get('top_speed'),
-        cylinders=car_info_data.get('cylinders'),
-        horsepower=car_info_data.get('horsepower'),
-        turbo=car_info_data.get('turbo'),
-        engine_model=car_info_data.get('engine_model'),
-        fuel_type=car_info_data.get('fuel_type'),
-        transmission_style=car_info_data.get('transmission_style'),
-        drive_type=car_info_data.get('drive_type')
-    )
-    db.session.add(car_info)
+    The car references the shared spec for its data, so no per-owner copy
+    is written. Returns the new car's id, or None if the user already has
+    this VIN.
+    """
+    try:
+        spec_id = VehicleSpec.get_or_create_id(car_info_data)
+        car_id = insert_car(vin, user_id, spec_id)
+        if car_id is None:
+            db.session.rollback()
+            return None
+
+        touch_garage(user_id)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+    return car_id
+
+def save_pending_car(vin, user_id):
+    """Add a car to the user's profile with a decode job for its car data
+
+    Returns the DecodeJob, or None if the user already has this VIN.
+    """
+    try:
+        car_id = insert_car(vin, user_id)
+        if car_id is None:
+            db.session.rollback()
+            return None
+
+        job = DecodeJob(car_id=car_id, vin=vin)
+        db.session.add(job)
+        touch_garage(user_id)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+    return job
+
+def retry_failed_decode(vin, user_id):
+    """Queue the user's car with this VIN for decoding again if its decode failed
+
+    Returns the DecodeJob, reset to pending with its attempts cleared, or
+    None if the user has no such car or its decode hasn't failed.
+    """
+    job = DecodeJob.query.join(Car).filter(Car.vin == vin, Car.user_id == user_id, DecodeJob.status == 'failed').first()
+    if job is None:
+        return None
+
+    try:
+        job.status = 'pending'
+        job.attempts = 0
+        job.error = None
+        touch_garage(user_id)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+    return job
+
+def save_car_data_batch(user_id, vins):
+    """Add many VINs to the user's profile in a single transaction
+
+    Returns a list of (vin, added, message) tuples in input order.
+    """
+    existing = {vin for vin, in db.session.query(Car.vin).filter(
+        Car.user_id == user_id, Car.vin.in_(vins))}
+    car_data_by_vin = fetch_car_data_batch([vin for vin in vins if vin not in existing])
+
+    results = []
+    spec_ids = {}
+    for vin in vins:
+        car_info_data = car_data_by_vin.get(vin) or {}
+        if vin in existing:
+            results.append((vin, False, 'Car already exists.'))
+        elif not has_required_fields(car_info_data):
+            results.append((vin, False, 'Car info could not be retrieved.'))
+        else:
+            key = spec_key(car_info_data)
+            if key not in spec_ids:
+                spec_ids[key] = VehicleSpec.get_or_create_id(car_info_data)
+            db.session.add(Car(vin=vin, user_id=user_id, spec_id=spec_ids[key]))
+            results.append((vin, True, 'Car added successfully!'))
+
+    if any(added for _, added, _ in results):
+        touch_garage(user_id)
     db.session.commit()
+    return results
 
 
 def connect_db(app):
     db.app = app
-    db.init_app(app)
\ No newline at end of file
+    db.init_app(app)
+    vin_cache.configure(
+        max_entries=app.config.get('VIN_MEMORY_CACHE_MAX_ENTRIES'),
+        max_bytes=app.config.get('VIN_MEMORY_CACHE_MAX_BYTES'),
+        ttl=app.config.get('VIN_MEMORY_CACHE_TTL'))
\ No newline at end of file
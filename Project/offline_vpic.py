@@ -0,0 +1,175 @@
+"""Offline VIN decoding from a local snapshot of the vPIC database
+
+NHTSA publishes the vPIC database as a standalone download. Export these
+tables from it into a SQLite file and point VPIC_OFFLINE_DB at it:
+
+    Wmi            (Id, Wmi, MakeId)
+    Make           (Id, Name)
+    Wmi_VinSchema  (WmiId, VinSchemaId, YearFrom, YearTo)
+    Pattern        (VinSchemaId, Keys, ElementId, AttributeId)
+    Element        (Id, Name, LookupTable)
+    plus every lookup table named in Element.LookupTable (Id, Name)
+
+The file is read once into in-memory indexes: WMI -> schemas, and schema ->
+first descriptor character -> compiled patterns for the elements CarInfo
+stores. A decode is then a few dict lookups plus matching the VIN
+descriptor against the patterns that can apply to it.
+"""
+import re
+import sqlite3
+import threading
+from vpic import RESULT_FIELDS
+
+
+YEAR_CODES = 'ABCDEFGHJKLMNPRSTVWXY123456789'
+
+
+def model_year(vin):
+    """Model year from the 10th character, using the 7th to pick the 30-year cycle"""
+    index = YEAR_CODES.find(vin[9])
+    if index < 0:
+        return None
+    year = 1980 + index
+    if vin[6].isalpha():
+        year += 30
+    return year
+
+def wmi_code(vin):
+    """World manufacturer identifier; 6 characters for small manufacturers"""
+    if vin[2] == '9':
+        return vin[:3] + vin[11:14]
+    return vin[:3]
+
+def descriptor(vin):
+    """The part of the VIN vPIC patterns are matched against"""
+    return vin[3:8] + '|' + vin[9:]
+
+def compile_keys(keys):
+    """Compile a vPIC pattern key ('*' is any character) into a prefix regex"""
+    return re.compile(re.escape(keys).replace(r'\*', '.').replace(r'\[', '[').replace(r'\]', ']').replace(r'\-', '-'))
+
+
+class OfflineDecoder:
+    """In-memory indexes over a vPIC snapshot, loaded on first use"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.wmi_schemas = {}
+        self.wmi_makes = {}
+        self.schema_patterns = {}
+
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            connection = sqlite3.connect(self.path)
+            try:
+                self._load(connection)
+            finally:
+                connection.close()
+            self._loaded = True
+
+    def _load(self, connection):
+        elements = {}
+        for element_id, name, lookup_table in connection.execute(
+                'SELECT Id, Name, LookupTable FROM Element'):
+            if name in RESULT_FIELDS:
+                column, convert = RESULT_FIELDS[name]
+                elements[element_id] = (column, convert, self._lookup(connection, lookup_table))
+
+        makes = dict(connection.execute('SELECT Id, Name FROM Make'))
+        wmi_ids = {}
+        for wmi_id, wmi, make_id in connection.execute('SELECT Id, Wmi, MakeId FROM Wmi'):
+            wmi_ids[wmi_id] = wmi
+            if make_id in makes:
+                self.wmi_makes[wmi] = makes[make_id]
+
+        for wmi_id, schema_id, year_from, year_to in connection.execute(
+                'SELECT WmiId, VinSchemaId, YearFrom, YearTo FROM Wmi_VinSchema'):
+            if wmi_id in wmi_ids:
+                self.wmi_schemas.setdefault(wmi_ids[wmi_id], []).append((schema_id, year_from, year_to))
+
+        for schema_id, keys, element_id, attribute_id in connection.execute(
+                'SELECT VinSchemaId, Keys, ElementId, AttributeId FROM Pattern ORDER BY Id'):
+            if element_id not in elements:
+                continue
+            column, convert, lookup = elements[element_id]
+            value = lookup.get(str(attribute_id), attribute_id) if lookup else attribute_id
+            try:
+                value = convert(str(value))
+            except ValueError:
+                continue
+            specificity = sum(1 for char in keys if char not in '*[]-')
+            self.schema_patterns.setdefault(schema_id, []).append(
+                (compile_keys(keys).match, specificity, column, value, keys[:1]))
+
+        # Bucket each schema's patterns by the descriptor character they
+        # start with, keeping wildcard-led patterns in every bucket, and put
+        # the most specific patterns first so the first match per column wins
+        for schema_id, patterns in self.schema_patterns.items():
+            buckets = {}
+            wildcard = []
+            for pattern in patterns:
+                first = pattern[4]
+                if first in '*[':
+                    wildcard.append(pattern)
+                else:
+                    buckets.setdefault(first, []).append(pattern)
+
+            by_char = {char: sorted(bucket + wildcard, key=lambda pattern: -pattern[1])
+                       for char, bucket in buckets.items()}
+            by_char[None] = sorted(wildcard, key=lambda pattern: -pattern[1])
+            self.schema_patterns[schema_id] = by_char
+
+    def _lookup(self, connection, table):
+        if not table or not re.fullmatch(r'\w+', table):
+            return None
+        try:
+            return {str(row_id): name for row_id, name in connection.execute(f'SELECT Id, Name FROM "{table}"')}
+        except sqlite3.Error:
+            return None
+
+    def decode(self, vin):
+        """Return the car data the snapshot can resolve for the VIN, possibly partial"""
+        if not self._loaded:
+            self.load()
+
+        wmi = wmi_code(vin)
+        year = model_year(vin)
+        car_info_data = {}
+        if year:
+            car_info_data['year'] = year
+        if wmi in self.wmi_makes:
+            car_info_data['make'] = self.wmi_makes[wmi]
+
+        text = descriptor(vin)
+        for schema_id, year_from, year_to in self.wmi_schemas.get(wmi, ()):
+            if year and (year < (year_from or 0) or (year_to and year > year_to)):
+                continue
+            by_char = self.schema_patterns.get(schema_id)
+            if not by_char:
+                continue
+            patterns = by_char.get(text[0]) or by_char[None]
+            for match, _, column, value, _ in patterns:
+                if column not in car_info_data and match(text):
+                    car_info_data[column] = value
+
+        return car_info_data
+
+
+decoder = None
+
+
+def connect_offline_vpic(app):
+    """Use the snapshot at VPIC_OFFLINE_DB, if one is configured"""
+    global decoder
+    path = app.config.get('VPIC_OFFLINE_DB')
+    decoder = OfflineDecoder(path) if path else None
+
+def decode(vin):
+    """Decode the VIN from the snapshot, or return {} when there is none"""
+    if decoder is None:
+        return {}
+    return decoder.decode(vin)
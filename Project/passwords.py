@@ -0,0 +1,90 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from metrics import metrics
+
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('utf8'), bcrypt.gensalt(rounds)).decode('utf8')
+
+def check_password(hashed, password):
+    try:
+        return bcrypt.checkpw(password.encode('utf8'), hashed.encode('utf8'))
+    except ValueError:
+        return False
+
+def hash_rounds(hashed):
+    """The cost a bcrypt hash was made with, or None if it isn't a bcrypt hash"""
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+hash_duration = metrics.histogram(
+    'bcrypt_duration_seconds', 'Time to hash or check a password, waiting for the pool included.', ('operation',),
+    timing='bcrypt')
+
+
+class PasswordHasher:
+    """bcrypt hashing on a bounded process pool instead of the request threads
+
+    BCRYPT_LOG_ROUNDS sets the cost of new hashes. BCRYPT_POOL_SIZE caps
+    how many hashes run at once, so a burst of logins can only occupy that
+    many CPUs while every other route keeps the rest; excess logins wait
+    their turn in the pool's queue. A pool size of 0 hashes inline. The
+    pool is started on first use, so it is never forked into app workers.
+    """
+
+    def __init__(self, app=None):
+        self.rounds = 12
+        self.pool_size = 0
+        self._executor = None
+        self._lock = threading.Lock()
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', 12)
+        self.pool_size = app.config.get('BCRYPT_POOL_SIZE', 0)
+        self.shutdown()
+        app.extensions['password_hasher'] = self
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.pool_size, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _run(self, operation, function, *args):
+        start = time.perf_counter()
+        try:
+            if not self.pool_size:
+                return function(*args)
+            return self._get_executor().submit(function, *args).result()
+        finally:
+            hash_duration.observe(time.perf_counter() - start, operation)
+
+    def hash(self, password):
+        """Hash the password at the configured cost"""
+        return self._run('hash', hash_password, password, self.rounds)
+
+    def check(self, hashed, password):
+        """Whether the password matches the hash; False for a malformed hash"""
+        return self._run('check', check_password, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Whether the hash was made with a different cost than the configured one"""
+        return hash_rounds(hashed) != self.rounds
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,190 @@
+"""Opt-in CPU profiles of single requests
+
+A request is profiled when it carries a valid token, in the X-Profile-Token
+header or the _profile query argument, or when it is one of every
+PROFILE_SAMPLE_RATE requests. Tokens are signed with PROFILE_SECRET and
+expire; `flask --app app profile-token` makes one.
+
+PROFILE_MODE picks the profiler:
+
+    sample    a thread samples the request's stack every PROFILE_INTERVAL
+              seconds and writes folded stacks (.folded), ready for
+              flamegraph.pl or speedscope
+    cprofile  cProfile traces every call and writes pstats (.prof), for
+              snakeviz or python -m pstats
+
+Profiles are written to PROFILE_DIR (instance/profiles by default), oldest
+deleted first once there are more than PROFILE_MAX_FILES or they take more
+than PROFILE_MAX_BYTES. The response names its profile in X-Profile.
+Without a secret or a sample rate no hooks are installed at all.
+"""
+import cProfile
+import hashlib
+import hmac
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from flask import g, request
+
+
+def make_token(secret, seconds=900):
+    """A profiling token valid for the next seconds"""
+    expires = int(time.time()) + seconds
+    signature = hmac.new(secret.encode(), str(expires).encode(), hashlib.sha256).hexdigest()
+    return f'{expires}.{signature}'
+
+def check_token(secret, token):
+    """Whether the token was signed with secret and hasn't expired"""
+    expires, _, signature = (token or '').partition('.')
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    expected = hmac.new(secret.encode(), expires.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature, expected)
+
+
+class StackSampler:
+    """Counts the stacks of one thread, sampled from another every interval seconds"""
+    extension = 'folded'
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.stacks[folded_stack(frame)] += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            f.writelines(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class TracingProfiler:
+    """cProfile around the request"""
+    extension = 'prof'
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def write(self, path):
+        self._profile.dump_stats(path)
+
+
+def folded_stack(frame):
+    """The frame's stack, outermost first, as one line of folded stacks"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class RequestProfiler:
+    """Profiles signed or sampled requests into a size-capped directory"""
+
+    def __init__(self, app=None):
+        self.secret = None
+        self.sample_rate = 0
+        self._requests = itertools.count(1)
+        self._lock = threading.Lock()
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.secret = app.config.get('PROFILE_SECRET') or None
+        self.sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0)
+        self.mode = app.config.get('PROFILE_MODE', 'sample')
+        self.interval = app.config.get('PROFILE_INTERVAL', 0.005)
+        self.directory = app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+        self.max_files = app.config.get('PROFILE_MAX_FILES', 200)
+        self.max_bytes = app.config.get('PROFILE_MAX_BYTES', 100 * 1024 * 1024)
+        app.extensions['request_profiler'] = self
+        if not self.secret and not self.sample_rate:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self._start_request)
+        app.after_request(self._name_profile)
+        app.teardown_request(self._finish_request)
+
+    def wanted(self):
+        """Whether this request asked for a profile or was sampled"""
+        if self.secret:
+            token = request.headers.get('X-Profile-Token') or request.args.get('_profile')
+            if token and check_token(self.secret, token):
+                return True
+        return bool(self.sample_rate) and next(self._requests) % self.sample_rate == 0
+
+    def _start_request(self):
+        if not self.wanted():
+            return
+
+        profiler = StackSampler(self.interval) if self.mode == 'sample' else TracingProfiler()
+        try:
+            profiler.start()
+        except ValueError:
+            # cProfile refuses to run while another profiler is active
+            return
+
+        g.profiler = profiler
+        endpoint = request.endpoint or 'unmatched'
+        g.profile_name = f'{datetime.utcnow():%Y%m%dT%H%M%S%f}-{os.getpid()}-{endpoint}.{profiler.extension}'
+
+    def _name_profile(self, response):
+        if 'profiler' in g:
+            response.headers['X-Profile'] = g.profile_name
+        return response
+
+    def _finish_request(self, exc):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return
+
+        profiler.stop()
+        profiler.write(os.path.join(self.directory, g.profile_name))
+        self.rotate()
+
+    def rotate(self):
+        """Delete the oldest profiles until the directory is within its limits"""
+        with self._lock:
+            profiles = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file():
+                    stat = entry.stat()
+                    profiles.append((stat.st_mtime, entry.name, stat.st_size))
+            profiles.sort()
+
+            total = sum(size for _, _, size in profiles)
+            while profiles and (len(profiles) > self.max_files or total > self.max_bytes):
+                _, name, size = profiles.pop(0)
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+request_profiler = RequestProfiler()
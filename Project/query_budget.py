@@ -0,0 +1,136 @@
+"""Per-request SQL statement budget and repeated-statement (N+1) warnings
+
+Every statement a request sends to the database is logged against that
+request. When the request ends, a warning is logged if it ran more than
+QUERY_BUDGET statements, or the same statement shape (the SQL with
+literals and IN lists collapsed) at least QUERY_REPEAT_LIMIT times, which
+is what a lazy relationship loaded once per row in a template looks like.
+
+Statements reach the budget through the same engine hooks as the metrics
+in metrics.py. A request's log keeps a count and the total time, plus how
+often each distinct statement ran for the repeat check, which an N+1
+collapses to one entry; with QUERY_REPEAT_LIMIT 0 it keeps no SQL at all.
+Only the max_queries fixture in conftest.py keeps every statement in
+order, to show them when a test fails.
+"""
+import logging
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from flask import request
+from metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER = r'(?:\?|%s|%\(\w+\)s|:\w+|\$\d+)'
+PLACEHOLDER_LIST = re.compile(rf'\(\s*{PLACEHOLDER}(?:\s*,\s*{PLACEHOLDER})*\s*\)')
+NUMBER = re.compile(r'\b\d+\b')
+
+
+def statement_shape(statement):
+    """The statement with numbers and IN lists collapsed, so runs of one query compare equal"""
+    shape = PLACEHOLDER_LIST.sub('(?)', statement)
+    shape = NUMBER.sub('?', shape)
+    return ' '.join(shape.split())
+
+
+class QueryLog:
+    """Count and time of the statements run on one thread while the log is recording
+
+    With shapes, also how many times each distinct statement ran, for
+    repeated(); with keep_statements, also every statement in order.
+    """
+
+    def __init__(self, shapes=True, keep_statements=False):
+        self.count = 0
+        self.seconds = 0.0
+        self.times = Counter() if shapes else None
+        self.statements = [] if keep_statements else None
+
+    def add(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        if self.times is not None:
+            self.times[statement] += 1
+        if self.statements is not None:
+            self.statements.append(statement)
+
+    def repeated(self, limit):
+        """[(shape, times)] for each statement shape run at least limit times, most first"""
+        if not self.times or not limit:
+            return []
+        shapes = Counter()
+        for statement, times in self.times.items():
+            shapes[statement_shape(statement)] += times
+        return [(shape, times) for shape, times in shapes.most_common() if times >= limit]
+
+
+class QueryBudget:
+    """Logs the statements of each request and warns about requests that run too many"""
+
+    def __init__(self, app=None):
+        self.budget = 30
+        self.repeat_limit = 5
+        self._local = threading.local()
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.budget = app.config.get('QUERY_BUDGET', 30)
+        self.repeat_limit = app.config.get('QUERY_REPEAT_LIMIT', 5)
+        app.extensions['query_budget'] = self
+        if not app.config.get('QUERY_BUDGET_ENABLED', True):
+            return
+
+        metrics.statement_listener(self.statement_done)
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+
+    def _logs(self):
+        try:
+            return self._local.logs
+        except AttributeError:
+            logs = self._local.logs = []
+            return logs
+
+    def _start_request(self):
+        log = QueryLog(shapes=bool(self.repeat_limit))
+        self._logs().append(log)
+        self._local.request_log = log
+
+    def _finish_request(self, exc):
+        log = getattr(self._local, 'request_log', None)
+        if log is None:
+            return
+        self._local.request_log = None
+        self._logs().remove(log)
+        self.check(log, f'{request.method} {request.path} ({request.endpoint})')
+
+    def check(self, log, label):
+        """Log a warning if the statements in log are over budget or repeat"""
+        if log.count > self.budget:
+            logger.warning('%s ran %d SQL statements in %.1f ms, over the budget of %d',
+                           label, log.count, log.seconds * 1000, self.budget)
+        for shape, times in log.repeated(self.repeat_limit):
+            logger.warning('%s ran the same SQL statement %d times, likely an N+1 query: %s',
+                           label, times, shape)
+
+    @contextmanager
+    def record(self):
+        """Log every statement this thread runs inside the block, in order"""
+        metrics.statement_listener(self.statement_done)
+        log = QueryLog(keep_statements=True)
+        self._logs().append(log)
+        try:
+            yield log
+        finally:
+            self._logs().remove(log)
+
+    def statement_done(self, statement, seconds):
+        for log in getattr(self._local, 'logs', ()):
+            log.add(statement, seconds)
+
+
+query_budget = QueryBudget()
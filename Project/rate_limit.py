@@ -0,0 +1,139 @@
+"""Token-bucket throttling for the login and registration forms
+
+Each key (an IP address or an email) has a bucket of RATE_LIMIT_*_BURST
+tokens that refills at RATE_LIMIT_*_PER_MINUTE. An attempt takes a token
+from the IP's bucket and then the email's; when either is empty the
+attempt is refused before any password is hashed.
+
+Buckets live in process memory by default. Set RATE_LIMIT_STORAGE_URL to
+a redis:// URL to share them between app workers and hosts.
+
+The IP is request.remote_addr. Behind a reverse proxy or load balancer
+that is the proxy's address, so every client would share one bucket: set
+TRUSTED_PROXIES to the number of proxies in front of the app and the
+client address is taken from X-Forwarded-For instead, counting that many
+entries from the right. Only count proxies you run; anything further left
+in the header is whatever the client sent. Leave it at 0 when clients
+connect directly, or X-Forwarded-For could be forged to dodge the limit.
+"""
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class MemoryBackend:
+    """Buckets in a dict, least recently used evicted past max_keys"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, burst, per_second):
+        """Take a token; return 0 if one was available, else seconds until one is"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = burst
+            else:
+                tokens, updated = bucket
+                tokens = min(burst, tokens + (now - updated) * per_second)
+                self._buckets.move_to_end(key)
+
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                retry_after = 0
+            else:
+                self._buckets[key] = (tokens, now)
+                retry_after = (1 - tokens) / per_second
+
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return retry_after
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# The same bucket update as MemoryBackend.take, done atomically in Redis.
+# The result is returned as a string because Redis truncates Lua numbers.
+TAKE_SCRIPT = '''
+local burst = tonumber(ARGV[1])
+local per_second = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1])
+if tokens == nil then
+    tokens = burst
+else
+    tokens = math.min(burst, tokens + (now - tonumber(bucket[2])) * per_second)
+end
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / per_second
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / per_second) + 1)
+return tostring(retry_after)
+'''
+
+class RedisBackend:
+    """Buckets in Redis hashes, shared by every process using the same server"""
+
+    def __init__(self, url, prefix='rate_limit:'):
+        if redis is None:
+            raise RuntimeError('RATE_LIMIT_STORAGE_URL needs the redis package installed.')
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(TAKE_SCRIPT)
+
+    def take(self, key, burst, per_second):
+        """Take a token; return 0 if one was available, else seconds until one is"""
+        return float(self._take(keys=[self.prefix + key], args=[burst, per_second, time.time()]))
+
+    def clear(self):
+        for key in self._client.scan_iter(self.prefix + '*'):
+            self._client.delete(key)
+
+
+class RateLimiter:
+    """Per-IP and per-email token buckets in front of password hashing"""
+
+    def __init__(self, app=None):
+        self.backend = MemoryBackend()
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        url = app.config.get('RATE_LIMIT_STORAGE_URL')
+        self.backend = RedisBackend(url) if url else MemoryBackend()
+        app.extensions['rate_limiter'] = self
+
+    def limit(self, ip, email):
+        """Count an attempt; return 0 if allowed, else seconds to wait before retrying"""
+        config = current_app.config
+        if not config.get('RATE_LIMIT_ENABLED', True):
+            return 0
+
+        retry_after = self.backend.take(
+            f'ip:{ip}', config.get('RATE_LIMIT_IP_BURST', 20), config.get('RATE_LIMIT_IP_PER_MINUTE', 20) / 60)
+        if retry_after or not email:
+            return retry_after
+
+        return self.backend.take(
+            f'email:{email.strip().lower()}', config.get('RATE_LIMIT_EMAIL_BURST', 5),
+            config.get('RATE_LIMIT_EMAIL_PER_MINUTE', 5) / 60)
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,142 @@
+import json
+import pytest
+from unittest.mock import patch
+from api import OrjsonProvider
+from app import app, db
+from models import User, Car, VehicleSpec, VinDecodeCache
+from vin_cache import vin_cache
+
+
+@pytest.fixture(scope='module')
+def client():
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+            user = User(name='ApiUser', email='api@email.com', password='password')
+            spec = VehicleSpec(spec_key='test-api-spec', year=2020, make='Subaru', model='Outback')
+            db.session.add_all([user, spec])
+            db.session.flush()
+            db.session.add_all([Car(vin=f'4S4BTANC0L300000{n}', user_id=user.id, spec_id=spec.id) for n in range(3)])
+            db.session.commit()
+            with client.session_transaction() as sess:
+                sess['user_id'] = user.id
+            yield client
+            vin_cache.clear()
+            db.session.remove()
+            db.drop_all()
+
+def test_json_serialized_with_orjson(client):
+    """Test the app's JSON, API responses included, goes through orjson"""
+    assert isinstance(app.json, OrjsonProvider)
+
+def test_decode_vin_saved_car(client):
+    """Test a VIN is answered from the shared decode cache, not from a garage's car"""
+    VinDecodeCache.store('4S4BTANC0L3000000', {'year': 2020, 'make': 'SUBARU', 'model': 'Outback'})
+
+    with patch('models.decode_vin') as mock_decode_vin:
+        response = client.get('/api/v1/vins/4s4btanc0l3000000')
+
+    assert response.status_code == 200
+    assert response.content_type == 'application/json'
+    data = response.get_json()
+    assert data['vin'] == '4S4BTANC0L3000000'
+    assert data['car_info']['make'] == 'SUBARU'
+    mock_decode_vin.assert_not_called()
+
+@patch('api.fetch_car_data')
+def test_decode_vin_errors(mock_fetch_car_data, client):
+    """Test malformed and undecodable VINs get JSON errors"""
+    mock_fetch_car_data.return_value = {}
+
+    response = client.get('/api/v1/vins/2T3W1RFV3PW28456O')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+    mock_fetch_car_data.assert_not_called()
+
+    response = client.get('/api/v1/vins/2T3W1RFV3PW284566')
+    assert response.status_code == 404
+
+@patch('models.decode_vin_batch')
+def test_decode_vin_batch(mock_decode_vin_batch, client):
+    """Test a batch decodes the valid VINs together and reports each VIN in order"""
+    mock_decode_vin_batch.return_value = {'1HGCM82633A004352': {'year': 2003, 'make': 'HONDA', 'model': 'Accord'}}
+
+    response = client.post('/api/v1/vins/batch', json={'vins': ['1hgcm82633a004352', 'bad', '1HGCM82633A004352']})
+
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [result['vin'] for result in results] == ['1HGCM82633A004352', 'BAD', '1HGCM82633A004352']
+    assert results[0]['car_info']['make'] == 'HONDA'
+    assert results[1]['car_info'] is None and results[1]['error']
+    mock_decode_vin_batch.assert_called_once_with(['1HGCM82633A004352'])
+
+    assert client.post('/api/v1/vins/batch', json={'vin': 'x'}).status_code == 400
+
+def test_decode_vin_batch_requires_login(client):
+    """Test an anonymous client can't send batches to vPIC"""
+    with app.test_client() as anonymous:
+        with patch('models.decode_vin_batch') as mock_decode_vin_batch:
+            response = anonymous.post('/api/v1/vins/batch', json={'vins': ['1HGCM82633A004352']})
+
+    assert response.status_code == 401
+    mock_decode_vin_batch.assert_not_called()
+
+def test_garage_pages(client):
+    """Test the garage list is paged by cursor"""
+    app.config['GARAGE_PAGE_SIZE'] = 2
+    try:
+        data = client.get('/api/v1/garage').get_json()
+        assert [car['vin'] for car in data['cars']] == ['4S4BTANC0L3000000', '4S4BTANC0L3000001']
+        assert data['cars'][0]['make'] == 'Subaru'
+
+        data = client.get(f'/api/v1/garage?after={data["next_after"]}').get_json()
+        assert [car['vin'] for car in data['cars']] == ['4S4BTANC0L3000002']
+        assert data['next_after'] is None
+    finally:
+        app.config['GARAGE_PAGE_SIZE'] = 50
+
+def test_garage_car(client):
+    """Test one car's detail, and the errors for unknown cars and anonymous users"""
+    data = client.get('/api/v1/garage/4S4BTANC0L3000001').get_json()
+    assert data['car_info']['model'] == 'Outback'
+    assert data['decode_status'] == 'ready'
+
+    assert client.get('/api/v1/garage/4S4BTANC0L3000009').status_code == 404
+    with client.session_transaction() as sess:
+        user_id = sess.pop('user_id')
+    try:
+        assert client.get('/api/v1/garage').status_code == 401
+    finally:
+        with client.session_transaction() as sess:
+            sess['user_id'] = user_id
+
+def test_garage_export_csv(client):
+    """Test the export streams every car with its car info as CSV"""
+    app.config['EXPORT_BATCH_SIZE'] = 2
+    try:
+        response = client.get('/api/v1/garage/export?format=csv')
+    finally:
+        app.config['EXPORT_BATCH_SIZE'] = 1000
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0].startswith('vin,year,make,model,trim')
+    assert lines[1].startswith('4S4BTANC0L3000000,2020,Subaru,Outback,')
+    assert len(lines) == 4
+
+def test_garage_export_ndjson(client):
+    """Test the NDJSON export has one JSON object per car"""
+    response = client.get('/api/v1/garage/export?format=ndjson')
+
+    lines = response.get_data(as_text=True).splitlines()
+    assert len(lines) == 3
+    car = json.loads(lines[2])
+    assert car['vin'] == '4S4BTANC0L3000002'
+    assert car['make'] == 'Subaru'
+    assert car['decode_status'] == 'ready'
+    assert client.get('/api/v1/garage/export?format=xml').status_code == 400
@@ -1,6 +1,12 @@
+import os
+import sqlite3
+import subprocess
+import sys
 import pytest
+from contextlib import contextmanager
+from sqlalchemy import event
 from app import app, db
-from models import User, Car, CarInfo
+from models import User, Car, CarInfo, VehicleSpec
 from flask import session
 from werkzeug.security import check_password_hash
 from unittest.mock import patch
@@ -10,6 +16,7 @@ def client():
     app.config['TESTING'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///car_lookup'
     app.config['WTF_CSRF_ENABLED'] = False  
+    app.config['RATE_LIMIT_ENABLED'] = False
 
     with app.test_client() as client:
         with app.app_context():
@@ -18,6 +25,22 @@ def client():
             db.drop_all()
 
 
+@contextmanager
+def count_selects():
+    """Collect the SELECT statements sent to the database inside the block"""
+    selects = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            selects.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield selects
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
 @pytest.fixture(scope='module')
 def init_database():
     db.create_all()
@@ -139,45 +162,23 @@ def test_get_car_info_vin_provided_car_not_in_db(mock_fetch_car_data, client, in
     assert b'Rav4' in response.data
     assert b'XLE' in response.data
 
-def test_get_car_info_vin_provided_car_in_db(client, init_database):
-    """Test if VIN is provided and car already exists in the database."""
+@patch('app.fetch_car_data')
+def test_get_car_info_vin_provided_car_in_db(mock_fetch_car_data, client, init_database):
+    """Test a VIN already in someone's garage is still decoded, not answered from that owner's edits."""
+    mock_fetch_car_data.return_value = {'year': 2023, 'make': 'Toyota', 'model': 'Rav4', 'trim': 'XLE'}
     user = User.query.filter_by(email='test@email.com').first()
-    car = Car(vin='2T3W1RFV3PW284566', user_id=user.id)
+    car = Car(vin='2T3W1RFV3PW284566', user_id=user.id, car_info=CarInfo(
+        year=2023, make='Toyota', model='Rav4', trim='My Custom Trim'))
     db.session.add(car)
     db.session.commit()
 
-    car_info = CarInfo(
-        car_id=car.id,
-        year='2023',
-        make='Toyota',
-        model='Rav4',
-        trim='XLE',
-        top_speed=120,
-        cylinders=4,
-        horsepower=280,
-        turbo=False,
-        engine_model='K2-JZ',
-        transmission_style='Automatic',
-        drive_type='2x4'
-    )
-
-    db.session.add(car_info)
-    db.session.commit()
-
     response = client.post('/get-car-info/', data=dict(
         vin='2T3W1RFV3PW284566'
     ), follow_redirects=True)
     assert response.status_code == 200
-    assert b'2023' in response.data
-    assert b'Toyota' in response.data
-    assert b'Rav4' in response.data
     assert b'XLE' in response.data
-    assert b'120' in response.data
-    assert b'4' in response.data
-    assert b'280' in response.data
-    assert b'K2-JZ' in response.data
-    assert b'Automatic' in response.data
-    assert b'2x4' in response.data
+    assert b'My Custom Trim' not in response.data
+    mock_fetch_car_data.assert_called_once_with('2T3W1RFV3PW284566')
 
 def test_show_car_info(client, init_database):
     """Testing if car info shows up when user is logged in"""
@@ -189,7 +190,7 @@ def test_show_car_info(client, init_database):
     assert response.status_code == 200
 
     user = User.query.filter_by(email='test@email.com').first()
-    car = Car(vin='2T3W1RFV3PW284566', user_id=user.id)
+    car = Car(vin='2T3W1RFV3PW284567', user_id=user.id)
     db.session.add(car)
     db.session.commit()
 
@@ -243,7 +244,7 @@ def test_show_car_info_car_not_found(client, init_database):
 
     assert response.status_code == 200
 
-    response = client('/show-car-info/2T3W1RFV3PW284566', follow_redirects=True)
+    response = client('/show-car-info/2T3W1RFV3PW284599', follow_redirects=True)
     assert response.status_code == 200
     assert b'Car not found.' in response.data
 
@@ -257,11 +258,11 @@ def test_show_car_info_car_info_not_found(client, init_database):
     assert response.status_code == 200
 
     user = User.query.filter_by(email='test@email.com').first()
-    car = Car(vin='2T3W1RFV3PW284566', user_id=user.id)
+    car = Car(vin='2T3W1RFV3PW284568', user_id=user.id)
     db.session.add(car)
     db.session.commit()
 
-    response = client.get('/show-car-info/2T3W1RFV3PW284566', follow_redirects=True)
+    response = client.get('/show-car-info/2T3W1RFV3PW284568', follow_redirects=True)
     assert response.status_code == 200
     assert b'Car info could not be found.' in response.data
 
@@ -278,25 +279,25 @@ def test_update_car_info_car_not_found(client, init_database):
         password='password'
     ), follow_redirects=True)
 
-    response = client.get('/update-car-info/2T3W1RFV3PW284566', follow_redirects=True)
+    response = client.get('/update-car-info/2T3W1RFV3PW284599', follow_redirects=True)
     assert response.status_code == 200
     assert b'Car not found.' in response.data
 
 def test_update_car_info_car_info_not_found(client, init_database):
     """Test if car info is not found for the car."""
     user = User.query.filter_by(email='test@email.com').first()
-    car = Car(vin='2T3W1RFV3PW284566', user_id=user.id)
+    car = Car(vin='2T3W1RFV3PW284569', user_id=user.id)
     db.session.add(car)
     db.session.commit()
 
-    response = client.get('/update-car-info/2T3W1RFV3PW284566', follow_redirects=True)
+    response = client.get('/update-car-info/2T3W1RFV3PW284569', follow_redirects=True)
     assert response.status_code == 200
     assert b'Car information not found.' in response.data
 
 def test_update_car_info_successful(client, init_database):
     """Test successful update of car information."""
     user = User.query.filter_by(email='test@email.com').first()
-    car = Car(vin='2T3W1RFV3PW284566', user_id=user.id)
+    car = Car(vin='2T3W1RFV3PW284570', user_id=user.id)
     db.session.add(car)
     db.session.commit()
 
@@ -347,7 +348,7 @@ def test_update_car_info_failed_update(mock_db_commit, client, init_database):
     mock_db_commit.side_effect = Exception('Database commit failed')
 
     user = User.query.filter_by(email='test@email.com').first()
-    car = Car(vin='2T3W1RFV3PW284566', user_id=user.id)
+    car = Car(vin='2T3W1RFV3PW284571', user_id=user.id)
     db.session.add(car)
     db.session.commit()
 
@@ -403,7 +404,7 @@ def test_remove_car_not_authorized(client, init_database):
     db.session.add(other_user)
     db.session.commit()
 
-    car = Car(vin='2T3W1RFV3PW284566', user_id=other_user.id)
+    car = Car(vin='2T3W1RFV3PW284572', user_id=other_user.id)
     db.session.add(car)
     db.session.commit()
 
@@ -429,7 +430,7 @@ def test_remove_car_successful(client, init_database):
     ), follow_redirects=True)
 
     user = User.query.filter_by(email='test@email.com').first()
-    car = Car(vin='2T3W1RFV3PW284566', user_id=user.id)
+    car = Car(vin='2T3W1RFV3PW284573', user_id=user.id)
     db.session.add(car)
     db.session.commit()
 
@@ -449,11 +450,277 @@ def test_remove_car_failed(mock_db_commit, client, init_database):
     ), follow_redirects=True)
 
     user = User.query.filter_by(email='test@email.com').first()
-    car = Car(vin='2T3W1RFV3PW284566', user_id=user.id)
+    car = Car(vin='2T3W1RFV3PW284574', user_id=user.id)
     db.session.add(car)
     db.session.commit()
 
     response = client.post(f'/remove-car/{car.id}', follow_redirects=True)
     assert response.status_code == 200
     assert b'Error removing car. Please try again.' in response.data
-    assert Car.query.get(car.id) is not None
\ No newline at end of file
+    assert Car.query.get(car.id) is not None
+
+@patch('models.decode_vin_batch')
+def test_add_cars_bulk(mock_decode_vin_batch, client, init_database):
+    """Test adding several cars at once reports each VIN"""
+    mock_decode_vin_batch.return_value = {
+        '1HGCM82633A004352': {'year': 2003, 'make': 'Honda', 'model': 'Accord'},
+        '5YJ3E1EA7KF317000': {},
+    }
+    user = User.query.filter_by(email='test@email.com').first()
+    db.session.add(Car(vin='2T3W1RFV3PW284500', user_id=user.id))
+    db.session.commit()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+
+    response = client.post(f'/user/{user.id}/add-bulk', data=dict(
+        vins='1hgcm82633a004352\n2T3W1RFV3PW284500, 5YJ3E1EA7KF317000\n1HGCM82633A004352'
+    ), follow_redirects=True)
+
+    assert response.status_code == 200
+    assert b'1 of 3 cars added.' in response.data
+    assert b'Car already exists.' in response.data
+    assert b'Car info could not be retrieved.' in response.data
+    assert response.data.count(b'check digit does not match') == 2
+    mock_decode_vin_batch.assert_called_once_with(['1HGCM82633A004352', '5YJ3E1EA7KF317000'])
+    car = Car.query.filter_by(vin='1HGCM82633A004352', user_id=user.id).first()
+    assert car.details.make == 'Honda'
+
+@patch('app.decode_worker.enqueue')
+def test_add_car_flags_check_digit(mock_enqueue, client, init_database):
+    """Test a VIN with a wrong check digit is still added, with a warning"""
+    user = User.query.filter_by(email='test@email.com').first()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+        sess['user_name'] = user.name
+
+    response = client.post(f'/user/{user.id}/add', data=dict(
+        vin='3VWFE21C04M000009'
+    ), follow_redirects=True)
+
+    assert b'VIN check digit does not match. Please double-check the VIN.' in response.data
+    assert b'Car added! Its info is being retrieved.' in response.data
+
+@patch('app.decode_worker.enqueue')
+def test_add_car_queues_decode(mock_enqueue, client, init_database):
+    """Test adding an uncached VIN returns right away with a pending car"""
+    user = User.query.filter_by(email='test@email.com').first()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+        sess['user_name'] = user.name
+
+    response = client.post(f'/user/{user.id}/add', data=dict(
+        vin='3VWFE21C04M000001'
+    ), follow_redirects=True)
+
+    assert response.status_code == 200
+    assert b'Car added! Its info is being retrieved.' in response.data
+    assert b'VIN check digit does not match.' not in response.data
+    assert b'(retrieving info...)' in response.data
+    car = Car.query.filter_by(vin='3VWFE21C04M000001', user_id=user.id).first()
+    assert car.decode_status == 'pending'
+    mock_enqueue.assert_called_once_with(car.decode_job.id)
+
+@patch('app.fetch_car_data')
+def test_get_car_info_invalid_vin(mock_fetch_car_data, client, init_database):
+    """Test a malformed VIN is rejected without calling the API"""
+    response = client.post('/get-car-info/', data=dict(
+        vin='2T3W1RFV3PW28456O'
+    ), follow_redirects=True)
+
+    assert response.status_code == 200
+    assert b'VIN may only contain letters and digits, except I, O and Q.' in response.data
+    mock_fetch_car_data.assert_not_called()
+
+def test_car_detail_routes_issue_one_select(client, init_database):
+    """Test each car detail route loads the car and its info in a single query"""
+    user = User.query.filter_by(email='test@email.com').first()
+    car = Car(vin='1HGCM82633A004399', user_id=user.id, car_info=CarInfo(
+        year=2003, make='Honda', model='Accord', trim='EX'))
+    db.session.add(car)
+    db.session.commit()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+        sess['user_name'] = user.name
+    db.session.expunge_all()
+
+    for url in ['/show-car-info/1HGCM82633A004399', '/update-car-info/1HGCM82633A004399']:
+        with count_selects() as selects:
+            response = client.get(url)
+
+        assert response.status_code == 200
+        assert b'Accord' in response.data
+        assert len(selects) == 1, url
+
+
+def test_update_car_info_keeps_spec_shared(client, init_database):
+    """Test editing a car stores an override instead of changing the shared spec"""
+    user = User.query.filter_by(email='test@email.com').first()
+    spec = VehicleSpec(spec_key='test-update-spec', year=2019, make='Mazda', model='CX-5', trim='Touring')
+    other = User(name='SpecOwner', email='spec-owner@email.com', password='password')
+    db.session.add_all([spec, other])
+    db.session.flush()
+    db.session.add_all([
+        Car(vin='JM3KFBCM1K0000001', user_id=user.id, spec_id=spec.id),
+        Car(vin='JM3KFBCM1K0000001', user_id=other.id, spec_id=spec.id),
+    ])
+    db.session.commit()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+        sess['user_name'] = user.name
+
+    response = client.post('/update-car-info/JM3KFBCM1K0000001', data=dict(
+        trim='Grand Touring', turbo='False'
+    ), follow_redirects=True)
+
+    assert response.status_code == 200
+    assert b'Grand Touring' in response.data
+    car = Car.query.filter_by(vin='JM3KFBCM1K0000001', user_id=user.id).first()
+    other_car = Car.query.filter_by(vin='JM3KFBCM1K0000001', user_id=other.id).first()
+    assert car.car_info.trim == 'Grand Touring'
+    assert car.car_info.make is None
+    assert other_car.details.trim == 'Touring'
+    assert db.session.get(VehicleSpec, spec.id).trim == 'Touring'
+
+def test_import_does_not_touch_database(tmp_path):
+    """Test importing the app opens no connection until init-db creates the tables"""
+    database = tmp_path / 'cold.sqlite'
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database}')
+
+    subprocess.run([sys.executable, '-c', 'import app'], env=env, check=True)
+    assert not database.exists()
+
+    result = subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'init-db'],
+                            env=env, check=True, capture_output=True, text=True)
+    assert 'Initialized the database.' in result.stdout
+    assert 'cars' in sqlite3.connect(database).execute(
+        "SELECT group_concat(name) FROM sqlite_master WHERE type = 'table'").fetchone()[0]
+
+def test_user_profile_not_modified(client, init_database):
+    """Test a revalidated profile page is answered with 304 until the garage changes"""
+    user = User.query.filter_by(email='test@email.com').first()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+        sess['user_name'] = user.name
+        sess.pop('_flashes', None)
+
+    response = client.get(f'/user/{user.id}')
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+    db.session.expunge_all()
+    with count_selects() as selects:
+        response = client.get(f'/user/{user.id}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert len(selects) == 1
+
+    with patch('app.decode_worker.enqueue'):
+        client.post(f'/user/{user.id}/add', data=dict(vin='3VWFE21C04M000002'))
+    response = client.get(f'/user/{user.id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'Car added! Its info is being retrieved.' in response.data
+    assert 'ETag' not in response.headers
+
+    response = client.get(f'/user/{user.id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'3VWFE21C04M000002' in response.data
+    assert response.headers['ETag'] != etag
+
+def test_user_profile_flash_not_cached(client, init_database):
+    """Test a page with a pending flash is rendered in full and gets no validators"""
+    user = User.query.filter_by(email='test@email.com').first()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+        sess['user_name'] = user.name
+        sess.pop('_flashes', None)
+    etag = client.get(f'/user/{user.id}').headers['ETag']
+    with client.session_transaction() as sess:
+        sess['_flashes'] = [('success', 'Car removed successfully!')]
+
+    response = client.get(f'/user/{user.id}', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert b'Car removed successfully!' in response.data
+    assert 'ETag' not in response.headers
+
+def test_show_car_info_not_modified(client, init_database):
+    """Test the car page revalidates by ETag or date and changes when its info is edited"""
+    user = User.query.filter_by(email='test@email.com').first()
+    spec = VehicleSpec(spec_key='test-not-modified-spec', year=2019, make='Mazda', model='CX-5', trim='Touring')
+    db.session.add(spec)
+    db.session.flush()
+    db.session.add(Car(vin='JM3KFBCM1K0000002', user_id=user.id, spec_id=spec.id))
+    db.session.commit()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+        sess['user_name'] = user.name
+        sess.pop('_flashes', None)
+
+    response = client.get('/show-car-info/JM3KFBCM1K0000002')
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+    assert client.get('/show-car-info/JM3KFBCM1K0000002',
+                      headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/show-car-info/JM3KFBCM1K0000002',
+                      headers={'If-Modified-Since': last_modified}).status_code == 304
+
+    client.post('/update-car-info/JM3KFBCM1K0000002', data=dict(trim='Signature', turbo='False'))
+    response = client.get('/show-car-info/JM3KFBCM1K0000002', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'Signature' in response.data
+
+def test_user_profile_pages_by_cursor(client, init_database):
+    """Test the garage is listed a page at a time with a next-page cursor"""
+    user = User(name='Fleet', email='fleet@email.com', password='password')
+    spec = VehicleSpec(spec_key='test-fleet-spec', year=2022, make='Ford', model='Transit')
+    db.session.add_all([user, spec])
+    db.session.flush()
+    cars = [Car(vin=f'1FTBR1C80MKA0000{n}', user_id=user.id, spec_id=spec.id) for n in range(5)]
+    db.session.add_all(cars)
+    db.session.commit()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+        sess['user_name'] = user.name
+        sess.pop('_flashes', None)
+    app.config['GARAGE_PAGE_SIZE'] = 2
+
+    try:
+        response = client.get(f'/user/{user.id}')
+        assert b'1FTBR1C80MKA00000' in response.data
+        assert b'1FTBR1C80MKA00001' in response.data
+        assert b'1FTBR1C80MKA00002' not in response.data
+        assert b'2022 Ford Transit' in response.data
+        assert f'after={cars[1].id}'.encode() in response.data
+
+        response = client.get(f'/user/{user.id}?after={cars[3].id}')
+        assert b'1FTBR1C80MKA00004' in response.data
+        assert b'1FTBR1C80MKA00003' not in response.data
+        assert b'Next Page' not in response.data
+        assert b'First Page' in response.data
+    finally:
+        app.config['GARAGE_PAGE_SIZE'] = 50
+
+def test_garage_pages_query_count(client, init_database, max_queries):
+    """Test the profile and car pages run a fixed number of statements however many cars there are"""
+    user = User(name='Counted', email='counted@email.com', password='password')
+    spec = VehicleSpec(spec_key='test-counted-spec', year=2021, make='Kia', model='Soul')
+    db.session.add_all([user, spec])
+    db.session.flush()
+    cars = [Car(vin=f'KNDJ23AU0M70000{n:02d}', user_id=user.id, spec_id=spec.id) for n in range(12)]
+    db.session.add_all(cars)
+    db.session.flush()
+    db.session.add_all([CarInfo(car_id=car.id, trim='GT-Line') for car in cars[::2]])
+    db.session.commit()
+    user_id, vin = user.id, cars[0].vin
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['user_name'] = user.name
+        sess.pop('_flashes', None)
+
+    db.session.expunge_all()
+    with max_queries(2):
+        response = client.get(f'/user/{user_id}')
+    assert response.status_code == 200
+
+    with max_queries(1):
+        response = client.get(f'/show-car-info/{vin}')
+    assert b'GT-Line' in response.data
@@ -0,0 +1,121 @@
+import pytest
+from unittest.mock import patch
+from app import app, db
+from models import User, Car, DecodeJob, save_pending_car
+from decode_jobs import decode_worker
+
+
+@pytest.fixture(scope='module')
+def client():
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+            user = User(name='TestUser', email='jobs@email.com', password='password')
+            db.session.add(user)
+            db.session.commit()
+            yield client
+            db.session.remove()
+            db.drop_all()
+
+
+@patch('decode_jobs.fetch_car_data')
+def test_run_job_saves_car_info(mock_fetch_car_data, client):
+    """Test a decode job fills in CarInfo and is removed"""
+    mock_fetch_car_data.return_value = {'year': 2020, 'make': 'Toyota', 'model': 'Corolla'}
+    user = User.query.filter_by(email='jobs@email.com').first()
+    job = save_pending_car('1HGCM82633A004352', user.id)
+    job_id, car_id = job.id, job.car_id
+
+    decode_worker.run_job(job_id)
+
+    db.session.expire_all()
+    car = db.session.get(Car, car_id)
+    assert car.decode_status == 'ready'
+    assert car.details.make == 'Toyota'
+    assert db.session.get(DecodeJob, job_id) is None
+
+@patch('decode_jobs.fetch_car_data')
+def test_run_job_retries_then_fails(mock_fetch_car_data, client, monkeypatch):
+    """Test a decode that returns nothing is retried until it runs out of attempts"""
+    monkeypatch.setitem(app.config, 'DECODE_JOB_MAX_ATTEMPTS', 2)
+    mock_fetch_car_data.return_value = {}
+    user = User.query.filter_by(email='jobs@email.com').first()
+    job = save_pending_car('1HGCM82633A004353', user.id)
+    job_id, car_id = job.id, job.car_id
+
+    decode_worker.run_job(job_id)
+
+    db.session.expire_all()
+    car = db.session.get(Car, car_id)
+    assert car.decode_status == 'pending'
+    assert car.decode_job.attempts == 1
+    assert car.decode_job.error == 'Car info could not be retrieved.'
+
+    decode_worker.run_job(job_id)
+
+    db.session.expire_all()
+    car = db.session.get(Car, car_id)
+    assert car.decode_status == 'failed'
+    assert car.decode_job.attempts == 2
+    assert car.details is None
+
+@patch.object(decode_worker, 'enqueue')
+def test_resume_pending_waits_for_retry_delay(mock_enqueue, client, monkeypatch):
+    """Test a job that already failed once is only queued again after its retry delay"""
+    user = User.query.filter_by(email='jobs@email.com').first()
+    job = save_pending_car('1HGCM82633A004356', user.id)
+    job.attempts = 1
+    db.session.commit()
+
+    monkeypatch.setitem(app.config, 'DECODE_JOB_RETRY_DELAY', 3600)
+    decode_worker.resume_pending()
+    assert job.id not in [call.args[0] for call in mock_enqueue.call_args_list]
+
+    monkeypatch.setitem(app.config, 'DECODE_JOB_RETRY_DELAY', 0)
+    decode_worker.resume_pending()
+    assert job.id in [call.args[0] for call in mock_enqueue.call_args_list]
+
+@patch.object(decode_worker, 'enqueue')
+def test_add_car_retries_failed_decode(mock_enqueue, client):
+    """Test adding a car again whose decode failed queues it with fresh attempts"""
+    user = User.query.filter_by(email='jobs@email.com').first()
+    job = save_pending_car('1HGCM82633A004357', user.id)
+    job.status, job.attempts, job.error = 'failed', 5, 'Car info could not be retrieved.'
+    db.session.commit()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+        sess['user_name'] = user.name
+
+    response = client.post(f'/user/{user.id}/add', data={'vin': '1HGCM82633A004357'}, follow_redirects=True)
+
+    assert b'Its info is being retrieved again.' in response.data
+    db.session.expire_all()
+    job = db.session.get(DecodeJob, job.id)
+    assert (job.status, job.attempts, job.error) == ('pending', 0, None)
+    mock_enqueue.assert_called_once_with(job.id)
+
+@patch('decode_jobs.fetch_car_data')
+def test_run_job_is_claimed_once(mock_fetch_car_data, client):
+    """Test a job already taken by another worker is skipped"""
+    user = User.query.filter_by(email='jobs@email.com').first()
+    job = save_pending_car('1HGCM82633A004354', user.id)
+    job.status = 'running'
+    db.session.commit()
+
+    decode_worker.run_job(job.id)
+
+    mock_fetch_car_data.assert_not_called()
+
+@patch.object(decode_worker, 'enqueue')
+def test_resume_pending(mock_enqueue, client):
+    """Test pending jobs left by an earlier process are queued again"""
+    user = User.query.filter_by(email='jobs@email.com').first()
+    job = save_pending_car('1HGCM82633A004355', user.id)
+
+    decode_worker.resume_pending()
+
+    queued = [call.args[0] for call in mock_enqueue.call_args_list]
+    assert job.id in queued
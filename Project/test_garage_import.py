@@ -0,0 +1,113 @@
+import io
+import pytest
+from app import app, db
+from decode_jobs import decode_worker
+from garage_import import import_garage, read_import_csv
+from models import User, Car, DecodeJob, VehicleSpec
+
+
+CSV = '''VIN,Year,Make,Model,Trim
+1ftbr1c8000000001,2022,FORD,Transit,Cargo
+1FTBR1C8000000002,2022,FORD,Transit,Cargo
+1FTBR1C8000000003,,FORD,,
+1FTBR1C8000000001,2021,FORD,Transit,
+1FTBR1C80000000O4,2022,FORD,Transit,Cargo
+1FTBR1C8000000005,twenty,FORD,Transit,
+'''
+
+
+@pytest.fixture(scope='module')
+def client():
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+            user = User(name='Importer', email='import@email.com', password='password')
+            db.session.add(user)
+            db.session.commit()
+            with client.session_transaction() as sess:
+                sess['user_id'] = user.id
+                sess['user_name'] = user.name
+            yield client
+            db.session.remove()
+            db.drop_all()
+
+@pytest.fixture
+def eager_jobs(monkeypatch):
+    monkeypatch.setitem(app.config, 'DECODE_JOBS_EAGER', True)
+    monkeypatch.setattr(decode_worker, 'run_job', lambda job_id: None)
+
+def user_id():
+    return User.query.filter_by(email='import@email.com').one().id
+
+def test_read_import_csv():
+    """Test rows are validated offline, repeats and bad values skipped with their line numbers"""
+    rows, invalid = read_import_csv(io.StringIO(CSV))
+
+    assert [row['vin'] for row in rows] == ['1FTBR1C8000000001', '1FTBR1C8000000002', '1FTBR1C8000000003']
+    assert rows[0]['year'] == 2022 and rows[0]['trim'] == 'Cargo' and rows[0]['turbo'] is None
+    assert rows[2]['year'] is None and rows[2]['make'] == 'FORD'
+    assert [(line, vin) for line, vin, _ in invalid] == [
+        (5, '1FTBR1C8000000001'), (6, '1FTBR1C80000000O4'), (7, '1FTBR1C8000000005')]
+
+    with pytest.raises(ValueError):
+        read_import_csv(io.StringIO('year,make\n2022,FORD\n'))
+
+def test_import_garage(client, eager_jobs):
+    """Test imported values stay the owner's car_info, and only partial rows are queued"""
+    rows, _ = read_import_csv(io.StringIO(CSV))
+    counts = import_garage(user_id(), rows)
+
+    assert counts == {'added': 3, 'existing': 0, 'queued': 1}
+    cars = {car.vin: car for car in Car.query.filter_by(user_id=user_id())}
+    assert cars['1FTBR1C8000000001'].spec_id is None
+    assert cars['1FTBR1C8000000001'].car_info.trim == 'Cargo'
+    assert cars['1FTBR1C8000000001'].decode_status == 'ready'
+    partial = cars['1FTBR1C8000000003']
+    assert partial.spec_id is None
+    assert partial.car_info.make == 'FORD'
+    assert partial.decode_status == 'pending'
+    assert db.session.get(User, user_id()).garage_updated_at is not None
+
+    counts = import_garage(user_id(), rows, decode_missing=False)
+    assert counts == {'added': 0, 'existing': 3, 'queued': 0}
+    assert Car.query.filter_by(user_id=user_id()).count() == 3
+    assert VehicleSpec.query.filter_by(make='FORD', model='Transit').count() == 0
+
+def test_import_garage_route(client, eager_jobs):
+    """Test uploading a CSV adds the new cars and lists the skipped rows"""
+    data = 'vin,year,make,model\n1FTBR1C8000000002,2022,FORD,Transit\n1FTBR1C8000000006,,,\nnot-a-vin,,,\n'
+    response = client.post(f'/user/{user_id()}/import', data={
+        'garage_file': (io.BytesIO(data.encode()), 'fleet.csv'), 'decode_missing': ''},
+        content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert '1 cars added, 1 already in your garage, 0 being decoded.' in html
+    assert 'NOT-A-VIN' in html
+    car = Car.query.filter_by(vin='1FTBR1C8000000006').one()
+    assert car.car_info is None
+    assert DecodeJob.query.filter_by(car_id=car.id).count() == 0
+
+def test_import_garage_route_unauthorized(client):
+    """Test another user's garage can't be imported into"""
+    response = client.get(f'/user/{user_id() + 1}/import')
+
+    assert response.status_code == 302
+    assert '/login' in response.location
+
+def test_import_garage_command(client, eager_jobs, tmp_path):
+    """Test the import-garage command reports what it added and skipped"""
+    path = tmp_path / 'fleet.csv'
+    path.write_text('vin,year,make,model\n1FTBR1C8000000007,2023,FORD,Transit\nshort,,,\n')
+
+    result = app.test_cli_runner().invoke(args=['import-garage', 'import@email.com', str(path)])
+
+    assert result.exit_code == 0, result.output
+    assert '1 cars added, 0 already in the garage, 1 rows skipped, 0 queued for decoding.' in result.output
+    assert Car.query.filter_by(vin='1FTBR1C8000000007').one().car_info.model == 'Transit'
+
+    result = app.test_cli_runner().invoke(args=['import-garage', 'nobody@email.com', str(path)])
+    assert result.exit_code != 0
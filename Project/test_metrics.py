@@ -0,0 +1,140 @@
+import threading
+import pytest
+from flask import Flask
+from unittest.mock import Mock, patch
+from app import app, db
+from metrics import Metrics, metrics
+from models import User, VinDecodeCache
+from passwords import password_hasher
+import vpic
+from vin_cache import vin_cache
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', False)
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_ENABLED', False)
+
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+        yield client
+
+def test_counters_add_up_across_threads():
+    """Test every thread's shard counts toward the total, and is folded away once the thread is gone"""
+    registry = Metrics()
+    requests = registry.counter('test_requests_total', 'Test requests.', ('route',))
+    latency = registry.histogram('test_seconds', 'Test latency.', buckets=(1,))
+
+    def work():
+        for _ in range(1000):
+            requests.inc('home')
+        latency.observe(0.5)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert registry._shards == []
+    requests.inc('home', amount=5)
+    assert len(registry._shards) == 1
+
+    counters, histograms = registry.snapshot()
+    assert counters[('test_requests_total', ('home',))] == 4005
+    assert histograms[('test_seconds', ())] == [4, 0, 2.0]
+
+def test_histogram_render():
+    """Test histograms render cumulative buckets, sum and count"""
+    registry = Metrics()
+    latency = registry.histogram('test_seconds', 'Test latency.', ('route',), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 3):
+        latency.observe(value, 'home')
+
+    text = registry.render()
+    assert '# TYPE test_seconds histogram' in text
+    assert 'test_seconds_bucket{route="home",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{route="home",le="1"} 3' in text
+    assert 'test_seconds_bucket{route="home",le="+Inf"} 4' in text
+    assert 'test_seconds_sum{route="home"} 4.05' in text
+    assert 'test_seconds_count{route="home"} 4' in text
+
+def test_workers_share_metrics_dir(tmp_path):
+    """Test a scrape adds up the totals every worker wrote to METRICS_DIR"""
+    workers = [Metrics(), Metrics()]
+    for n, registry in enumerate(workers, start=1):
+        registry.directory = str(tmp_path)
+        registry.counter('test_requests_total', 'Test requests.').inc(amount=n)
+        registry.histogram('test_seconds', 'Test latency.').observe(0.2)
+    workers[1].flush()
+
+    counters, histograms = workers[0].collect()
+    assert counters[('test_requests_total', ())] == 3
+    assert histograms[('test_seconds', ())][-1] == pytest.approx(0.4)
+
+def test_errored_requests_counted():
+    """Test a request whose view raises is counted with status 500"""
+    registry = Metrics()
+    errored = Flask(__name__)
+    registry.init_app(errored)
+
+    @errored.route('/boom')
+    def boom():
+        raise RuntimeError('boom')
+
+    errored.test_client().get('/boom')
+
+    _, histograms = registry.snapshot()
+    assert sum(histograms[('http_request_duration_seconds', ('boom', 'GET', '500'))][:-1]) == 1
+
+def test_metrics_endpoint(client):
+    """Test /metrics reports route latency, SQL statements per request and bcrypt time"""
+    client.get('/login')
+    client.post('/login', data={'email': 'nobody@email.com', 'password': 'password'})
+    password_hasher.check(password_hasher.hash('password'), 'password')
+
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    text = response.get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{endpoint="login",method="GET",status="200"}' in text
+    assert 'db_queries_per_request_count{endpoint="login"}' in text
+    assert 'bcrypt_duration_seconds_count{operation="hash"}' in text
+    assert '# TYPE vin_memory_cache_hits_total counter' in text
+
+    counters, histograms = metrics.snapshot()
+    queries = histograms[('db_queries_per_request', ('login',))]
+    assert sum(queries[:-1]) >= 2 and queries[-1] >= 1
+
+def test_server_timing(client, monkeypatch):
+    """Test responses break down SQL, vPIC, bcrypt and template time when Server-Timing is on"""
+    response = client.get('/')
+    assert 'Server-Timing' not in response.headers
+
+    monkeypatch.setattr(metrics, 'server_timing', True)
+    vpic_response = Mock(status_code=200)
+    vpic_response.json.return_value = {'Results': [{'ModelYear': '2010', 'Make': 'TOYOTA', 'Model': 'Prius'}]}
+    try:
+        with patch.object(vpic.client.session, 'request', return_value=vpic_response):
+            timing = client.post('/get-car-info/', data={'vin': 'JTDKN3DU8A0123457'}).headers['Server-Timing']
+            assert timing.startswith('db;dur=')
+            assert 'vpic;dur=' in timing and 'desc="api"' in timing
+            assert 'render;dur=' in timing
+            assert timing.split(', ')[-1].startswith('total;dur=')
+
+            timing = client.post('/get-car-info/', data={'vin': 'JTDKN3DU8A0123457'}).headers['Server-Timing']
+            assert 'vpic;dur=0.0;desc="memory cache"' in timing
+    finally:
+        vin_cache.clear()
+        with app.app_context():
+            db.session.execute(db.delete(VinDecodeCache).filter_by(vin='JTDKN3DU8A0123457'))
+            db.session.commit()
+
+    try:
+        response = client.post('/register', data={'name': 'Timing', 'email': 'timing@email.com', 'password': 'password'})
+        assert 'bcrypt;dur=' in response.headers['Server-Timing']
+    finally:
+        with app.app_context():
+            db.session.execute(db.delete(User).filter_by(email='timing@email.com'))
+            db.session.commit()
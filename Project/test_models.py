@@ -1,8 +1,12 @@
-import os
 import pytest
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
 from app import app, db
-from models import User, Car, CarInfo, fetch_car_data, save_car_data
-import requests 
+from models import User, Car, CarInfo, VehicleSpec, VinDecodeCache, fetch_car_data, save_car_data
+import models
+import vpic
+from benchmarks.vpic_stub import StubVpicServer
+from vin_cache import vin_cache
 
 
 @pytest.fixture(scope='module')
@@ -53,7 +57,7 @@ def test_user_authentication(init_database):
         assert invalid_password is False
 
 
-def test_fetch_car_data(monkeypatch):
+def test_fetch_car_data(client, monkeypatch):
     """Test Car data fetching"""
     sample_vin_data = {
         "Results": [
@@ -63,7 +67,7 @@ def test_fetch_car_data(monkeypatch):
             {"Variable": "Trim", "Value": "LE"},
             {"Variable": "Top Speed", "Value": "120"},
             {"Variable": "Engine Number of Cylinders", "Value": "4"},
-            {"Variable": "Engine HP", "Value": "130"},
+            {"Variable": "Engine Brake (hp) From", "Value": "130"},
             {"Variable": "Turbo", "Value": "No"},
             {"Variable": "Engine Model", "Value": "1.8L"},
             {"Variable": "Fuel Type - Primary", "Value": "Gasoline"},
@@ -72,15 +76,22 @@ def test_fetch_car_data(monkeypatch):
         ]
     }
 
-    def mock_requests_get(*args, **kwargs):
+    def mock_request(*args, **kwargs):
         class MockResponse:
+            status_code = 200
+            def raise_for_status(self):
+                pass
             def json(self):
                 return sample_vin_data
         return MockResponse()
 
-    monkeypatch.setattr(requests, 'get', mock_requests_get)
-    vin = "1HGCM82633A123456"
-    car_info_data = fetch_car_data(vin)
+    monkeypatch.setattr(vpic.client.session, 'request', mock_request)
+    vin_cache.clear()
+    with app.app_context():
+        vin = "1HGCM82633A654321"
+        car_info_data = fetch_car_data(vin)
+        db.session.delete(db.session.get(VinDecodeCache, vin))
+        db.session.commit()
 
     assert car_info_data['year'] == 2020
     assert car_info_data['make'] == "Toyota"
@@ -122,7 +133,8 @@ def test_save_car_data(init_database):
         assert car.vin == vin
         assert car.owner.id == user.id
 
-        car_info = CarInfo.query.filter_by(car_id=car.id).first()
+        assert CarInfo.query.filter_by(car_id=car.id).first() is None
+        car_info = car.details
         assert car_info is not None
         assert car_info.year == 2020
         assert car_info.make == "Toyota"
@@ -136,3 +148,179 @@ def test_save_car_data(init_database):
         assert car_info.fuel_type == "Gasoline"
         assert car_info.transmission_style == "Automatic"
         assert car_info.drive_type == "FWD"
+
+
+def test_fetch_car_data_uses_decode_cache(client, monkeypatch):
+    """Test a cached VIN is served without calling the API"""
+    calls = []
+
+    def mock_decode_vin(vin):
+        calls.append(vin)
+        return {"year": 2020, "make": "Toyota", "model": "Corolla"}
+
+    monkeypatch.setattr(models, 'decode_vin', mock_decode_vin)
+    vin_cache.clear()
+    with app.app_context():
+        vin = "1HGCM82633A654321"
+        assert fetch_car_data(vin)['make'] == "Toyota"
+        assert fetch_car_data(vin)['make'] == "Toyota"
+        assert calls == [vin]
+        assert db.session.get(VinDecodeCache, vin).data['model'] == "Corolla"
+
+def test_fetch_car_data_expired_cache(client, monkeypatch):
+    """Test an expired cache entry is fetched again and refreshed"""
+    monkeypatch.setattr(models, 'decode_vin', lambda vin: {"year": 2021, "make": "Honda", "model": "Civic"})
+    vin_cache.clear()
+    with app.app_context():
+        vin = "1HGCM82633A111111"
+        db.session.add(VinDecodeCache(vin=vin, data={"make": "Stale"},
+                                      fetched_at=datetime.utcnow() - timedelta(days=30)))
+        db.session.commit()
+
+        assert fetch_car_data(vin)['make'] == "Honda"
+        assert VinDecodeCache.lookup(vin)['make'] == "Honda"
+
+def test_fetch_car_data_incomplete_decode_not_cached(client, monkeypatch):
+    """Test a decode without year, make and model is treated as failed and not cached anywhere"""
+    calls = []
+
+    def mock_decode_vin(vin):
+        calls.append(vin)
+        return dict.fromkeys(['year', 'make', 'model', 'trim'])
+
+    monkeypatch.setattr(models, 'decode_vin', mock_decode_vin)
+    vin_cache.clear()
+    with app.app_context():
+        vin = "1HGCM82633A222222"
+        assert fetch_car_data(vin) == {}
+        assert fetch_car_data(vin) == {}
+        assert calls == [vin, vin]
+        assert db.session.get(VinDecodeCache, vin) is None
+        assert vin_cache.get(vin) is None
+
+def test_decode_vin_batch(client, monkeypatch):
+    """Test VINs are decoded in chunks through the batch endpoint"""
+    vins = ["1HGCM82633A00000%d" % i for i in range(5)]
+    with StubVpicServer() as server:
+        monkeypatch.setattr(vpic, 'client', vpic.VpicClient(base_url=server.base_url))
+        monkeypatch.setitem(app.config, 'VPIC_BATCH_SIZE', 2)
+        with app.app_context():
+            car_data_by_vin = models.decode_vin_batch(vins)
+
+        assert server.requests == 3
+
+    assert sorted(car_data_by_vin) == vins
+    assert car_data_by_vin[vins[0]]['year'] == 2023
+    assert car_data_by_vin[vins[0]]['make'] == "TOYOTA"
+    assert car_data_by_vin[vins[0]]['horsepower'] == "203"
+    assert car_data_by_vin[vins[0]]['top_speed'] is None
+
+def test_load_car_data_prefers_offline_decode(client, monkeypatch):
+    """Test the API is skipped when the offline snapshot resolves the car"""
+    monkeypatch.setattr(models.offline_vpic, 'decode', lambda vin: {"year": 2023, "make": "TOYOTA", "model": "RAV4"})
+    monkeypatch.setattr(models, 'decode_vin', lambda vin: pytest.fail('API should not be called'))
+    with app.app_context():
+        assert models.load_car_data("2T3W1RFV3PW284566")['model'] == "RAV4"
+
+def test_load_car_data_fills_gaps_from_offline_decode(client, monkeypatch):
+    """Test the API result is completed with fields only the snapshot resolved"""
+    monkeypatch.setattr(models.offline_vpic, 'decode', lambda vin: {"year": 2023, "make": "TOYOTA", "trim": "XLE"})
+    monkeypatch.setattr(models, 'decode_vin', lambda vin: {"year": 2023, "make": "TOYOTA", "model": "RAV4", "trim": None})
+    with app.app_context():
+        car_info_data = models.load_car_data("2T3W1RFV3PW284599")
+
+    assert car_info_data['model'] == "RAV4"
+    assert car_info_data['trim'] == "XLE"
+
+def test_car_vin_unique_per_user(init_database):
+    """Test a user can't own the same VIN twice, while other users can"""
+    with app.app_context():
+        user = User.query.filter_by(email="test@example.com").first()
+        other = User(name="Other", email="other@example.com", password="password")
+        db.session.add_all([other, Car(vin="5YJ3E1EA7KF317001", user_id=user.id)])
+        db.session.commit()
+
+        db.session.add(Car(vin="5YJ3E1EA7KF317001", user_id=other.id))
+        db.session.commit()
+
+        db.session.add(Car(vin="5YJ3E1EA7KF317001", user_id=user.id))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+def test_car_info_unique_per_car(init_database):
+    """Test a car can't have two CarInfo rows"""
+    with app.app_context():
+        user = User.query.filter_by(email="test@example.com").first()
+        car = Car(vin="5YJ3E1EA7KF317002", user_id=user.id)
+        db.session.add(car)
+        db.session.commit()
+
+        db.session.add_all([
+            CarInfo(car_id=car.id, year=2019, make="TESLA", model="Model 3"),
+            CarInfo(car_id=car.id, year=2019, make="TESLA", model="Model 3"),
+        ])
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+def test_save_car_data_rejects_duplicate(init_database):
+    """Test saving a VIN the user already has is rejected by the database"""
+    with app.app_context():
+        user = User.query.filter_by(email="test@example.com").first()
+        car_info_data = {"year": 2019, "make": "TESLA", "model": "Model 3"}
+
+        assert save_car_data("5YJ3E1EA7KF317003", user.id, car_info_data) is not None
+        assert save_car_data("5YJ3E1EA7KF317003", user.id, car_info_data) is None
+        assert Car.query.filter_by(vin="5YJ3E1EA7KF317003").count() == 1
+
+def test_save_car_data_leaves_no_orphan_car(init_database):
+    """Test a failed CarInfo insert rolls back the Car as well"""
+    with app.app_context():
+        user = User.query.filter_by(email="test@example.com").first()
+
+        with pytest.raises(IntegrityError):
+            save_car_data("5YJ3E1EA7KF317004", user.id, {"year": 2019})
+
+        assert Car.query.filter_by(vin="5YJ3E1EA7KF317004").first() is None
+
+
+def test_owners_share_one_spec(init_database):
+    """Test cars with the same decoded data reference one vehicle_spec row"""
+    with app.app_context():
+        user = User.query.filter_by(email="test@example.com").first()
+        other = User(name="SpecOwner", email="spec@example.com", password="password")
+        db.session.add(other)
+        db.session.commit()
+        car_info_data = {"year": 2021, "make": "FORD", "model": "F-150", "trim": "XLT"}
+
+        save_car_data("1FTFW1E50MFA00001", user.id, car_info_data)
+        save_car_data("1FTFW1E50MFA00001", other.id, dict(car_info_data))
+        save_car_data("1FTFW1E50MFA00002", user.id, {**car_info_data, "trim": "Lariat"})
+
+        cars = Car.query.filter(Car.vin.in_(["1FTFW1E50MFA00001", "1FTFW1E50MFA00002"])).order_by(Car.id).all()
+        assert cars[0].spec_id == cars[1].spec_id
+        assert cars[2].spec_id != cars[0].spec_id
+        assert VehicleSpec.query.filter_by(make="FORD").count() == 2
+
+def test_set_details_overrides_only_this_owner(init_database):
+    """Test an owner's edits are stored as overrides and leave the shared spec alone"""
+    with app.app_context():
+        user = User.query.filter_by(email="test@example.com").first()
+        other = User.query.filter_by(email="spec@example.com").first()
+        car = Car.query.filter_by(vin="1FTFW1E50MFA00001", user_id=user.id).first()
+        other_car = Car.query.filter_by(vin="1FTFW1E50MFA00001", user_id=other.id).first()
+
+        car.set_details({"trim": "Platinum", "make": "FORD"})
+        db.session.commit()
+
+        assert car.details.trim == "Platinum"
+        assert car.details.model == "F-150"
+        assert car.car_info.trim == "Platinum"
+        assert car.car_info.make is None
+        assert other_car.details.trim == "XLT"
+        assert car.spec.trim == "XLT"
+
+        car.set_details({"trim": "XLT"})
+        db.session.commit()
+        assert car.car_info is None
@@ -0,0 +1,41 @@
+import pytest
+from benchmarks.vpic_snapshot import build_snapshot
+from offline_vpic import OfflineDecoder, model_year, wmi_code
+
+
+@pytest.fixture(scope='module')
+def decoder(tmp_path_factory):
+    path = tmp_path_factory.mktemp('vpic') / 'vpic.sqlite'
+    build_snapshot(str(path))
+    return OfflineDecoder(str(path))
+
+
+def test_model_year_and_wmi():
+    """Test model year and WMI come straight from the VIN"""
+    assert model_year('2T3W1RFV3PW284566') == 2023
+    assert model_year('1HGCM82633A004352') == 2003
+    assert wmi_code('2T3W1RFV3PW284566') == '2T3'
+    assert wmi_code('1G9AB12345A123456') == '1G9123'
+
+def test_decode_from_snapshot(decoder):
+    """Test a VIN is decoded from the snapshot's patterns and lookup tables"""
+    car_info_data = decoder.decode('2T3W1RFV3PW284566')
+
+    assert car_info_data == {
+        'year': 2023,
+        'make': 'TOYOTA',
+        'model': 'RAV4',
+        'trim': 'XLE',
+        'cylinders': '4',
+        'drive_type': 'AWD/All-Wheel Drive',
+        'engine_model': 'A25A-FKS',
+    }
+
+def test_decode_respects_schema_years(decoder):
+    """Test schemas outside the model year range are skipped"""
+    assert decoder.decode('1HGCM82633A004352')['model'] == 'Accord'
+    assert 'model' not in decoder.decode('1HGCM82639A004352')
+
+def test_decode_unknown_wmi(decoder):
+    """Test an unknown manufacturer only resolves the model year"""
+    assert decoder.decode('5YJ3E1EA7KF317000') == {'year': 2019}
@@ -0,0 +1,60 @@
+import pytest
+from app import app, db
+from models import User
+from passwords import PasswordHasher, hash_rounds, password_hasher
+
+
+@pytest.fixture
+def rounds():
+    """Fast bcrypt costs for the tests, restored afterwards"""
+    saved = password_hasher.rounds
+    yield
+    password_hasher.rounds = saved
+
+def test_hash_and_check_inline():
+    """Test a password hashed without a pool checks only against itself"""
+    hasher = PasswordHasher()
+    hasher.rounds = 4
+    hashed = hasher.hash('password')
+
+    assert hash_rounds(hashed) == 4
+    assert hasher.check(hashed, 'password')
+    assert not hasher.check(hashed, 'wrongpassword')
+
+def test_check_malformed_hash():
+    """Test a stored value that isn't a bcrypt hash never matches"""
+    assert not PasswordHasher().check('password', 'password')
+
+def test_hash_on_process_pool():
+    """Test hashing and checking through the worker processes"""
+    hasher = PasswordHasher()
+    hasher.rounds = 4
+    hasher.pool_size = 1
+    try:
+        hashed = hasher.hash('password')
+        assert hasher.check(hashed, 'password')
+        assert not hasher.check(hashed, 'wrongpassword')
+    finally:
+        hasher.shutdown()
+
+def test_authenticate_rehashes_on_cost_change(rounds):
+    """Test logging in upgrades a hash made at an old cost"""
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///car_lookup'
+    with app.app_context():
+        db.create_all()
+        password_hasher.rounds = 4
+        user = User.register(name='Rehash', email='rehash@example.com', profile_pic='', password='password')
+        db.session.add(user)
+        db.session.commit()
+        old_hash = user.password
+
+        password_hasher.rounds = 5
+        assert User.authenticate('rehash@example.com', 'password')
+        assert hash_rounds(user.password) == 5
+        assert user.password != old_hash
+
+        assert User.authenticate('rehash@example.com', 'password').password == user.password
+        assert not User.authenticate('rehash@example.com', 'wrongpassword')
+
+        db.session.delete(user)
+        db.session.commit()
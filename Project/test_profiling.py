@@ -0,0 +1,73 @@
+import os
+import pstats
+import time
+from flask import Flask
+from profiling import RequestProfiler, check_token, make_token
+
+
+def make_client(tmp_path, **config):
+    app = Flask(__name__)
+    app.config.update(PROFILE_DIR=str(tmp_path), PROFILE_INTERVAL=0.001, **config)
+    RequestProfiler(app)
+
+    @app.route('/slow')
+    def slow():
+        deadline = time.perf_counter() + 0.03
+        while time.perf_counter() < deadline:
+            pass
+        return 'ok'
+
+    return app.test_client()
+
+def test_tokens():
+    """Test tokens only check against their own secret, and only until they expire"""
+    token = make_token('secret')
+
+    assert check_token('secret', token)
+    assert not check_token('other', token)
+    assert not check_token('secret', make_token('secret', -1))
+    assert not check_token('secret', 'garbage')
+
+def test_signed_request_is_profiled(tmp_path):
+    """Test a request with a valid token writes folded stacks that include the view"""
+    client = make_client(tmp_path, PROFILE_SECRET='secret')
+
+    response = client.get('/slow')
+    assert 'X-Profile' not in response.headers
+    response = client.get('/slow', headers={'X-Profile-Token': make_token('other')})
+    assert 'X-Profile' not in response.headers
+
+    response = client.get('/slow', headers={'X-Profile-Token': make_token('secret')})
+    name = response.headers['X-Profile']
+    assert name.endswith('-slow.folded')
+    with open(tmp_path / name) as f:
+        lines = f.read().splitlines()
+    assert any('slow (test_profiling.py:' in line for line in lines)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+
+def test_sampled_requests_with_cprofile(tmp_path):
+    """Test one in PROFILE_SAMPLE_RATE requests is profiled, to pstats in cprofile mode"""
+    client = make_client(tmp_path, PROFILE_SAMPLE_RATE=3, PROFILE_MODE='cprofile')
+
+    names = [client.get('/slow?_profile=x').headers.get('X-Profile') for _ in range(6)]
+
+    assert [name is not None for name in names] == [False, False, True, False, False, True]
+    stats = pstats.Stats(str(tmp_path / names[2]))
+    assert any(function == 'slow' for _, _, function in stats.stats)
+
+def test_old_profiles_rotated(tmp_path):
+    """Test the oldest profiles are deleted past PROFILE_MAX_FILES"""
+    client = make_client(tmp_path, PROFILE_SAMPLE_RATE=1, PROFILE_MAX_FILES=2)
+
+    names = [client.get('/slow').headers['X-Profile'] for _ in range(4)]
+
+    assert sorted(os.listdir(tmp_path)) == sorted(names[2:])
+
+def test_no_hooks_without_secret_or_sampling(tmp_path):
+    """Test profiling installs nothing unless a secret or sample rate is configured"""
+    app = Flask(__name__)
+    app.config['PROFILE_DIR'] = str(tmp_path / 'profiles')
+    RequestProfiler(app)
+
+    assert not app.before_request_funcs
+    assert not os.path.exists(tmp_path / 'profiles')
@@ -0,0 +1,75 @@
+import logging
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, text
+from query_budget import QueryLog, query_budget, statement_shape
+
+
+@pytest.fixture
+def client(monkeypatch):
+    app = Flask(__name__)
+    query_budget.init_app(app)
+    monkeypatch.setattr(query_budget, 'budget', 3)
+    monkeypatch.setattr(query_budget, 'repeat_limit', 4)
+    engine = create_engine('sqlite://')
+
+    @app.route('/lazy')
+    def lazy_view():
+        with engine.connect() as connection:
+            for n in range(4):
+                connection.execute(text(f'SELECT {n}'))
+        return 'ok'
+
+    @app.route('/')
+    def index():
+        return 'ok'
+
+    with app.test_client() as client:
+        yield client
+
+def test_statement_shape():
+    """Test literals and IN lists of any length give the same shape"""
+    assert statement_shape('SELECT * FROM cars WHERE vin IN (?, ?, ?) LIMIT 10') == \
+        statement_shape('SELECT * FROM cars\n WHERE vin IN (?) LIMIT 50')
+    assert statement_shape('SELECT * FROM cars WHERE id IN (%(id_1_1)s, %(id_1_2)s)') == \
+        'SELECT * FROM cars WHERE id IN (?)'
+    assert statement_shape('SELECT anon_1.id FROM anon_1') == 'SELECT anon_1.id FROM anon_1'
+
+def test_repeated_statements():
+    """Test statement shapes run at least the limit are reported, most repeated first"""
+    log = QueryLog()
+    for n in range(6):
+        log.add(f'SELECT * FROM car_info WHERE car_id = {n}', 0.001)
+    log.add('SELECT * FROM users WHERE id = ?', 0.001)
+
+    assert log.count == 7
+    assert log.repeated(5) == [('SELECT * FROM car_info WHERE car_id = ?', 6)]
+    assert log.repeated(7) == []
+    assert log.statements is None
+
+def test_log_keeps_only_what_is_checked():
+    """Test a log without shapes keeps no SQL, and repeats of a statement are kept once"""
+    log = QueryLog(shapes=False)
+    for _ in range(3):
+        log.add('SELECT * FROM users WHERE id = ?', 0.001)
+    assert (log.count, log.times, log.statements, log.repeated(2)) == (3, None, None, [])
+
+    log = QueryLog(keep_statements=True)
+    for _ in range(3):
+        log.add('SELECT * FROM users WHERE id = ?', 0.001)
+    assert len(log.times) == 1
+    assert log.statements == ['SELECT * FROM users WHERE id = ?'] * 3
+
+def test_request_over_budget_warns(client, caplog):
+    """Test a request over the budget or repeating a statement logs a warning"""
+    with caplog.at_level(logging.WARNING, logger='query_budget'):
+        client.get('/lazy')
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert any('GET /lazy (lazy_view) ran 4 SQL statements' in message for message in messages)
+    assert any('ran the same SQL statement 4 times, likely an N+1 query: SELECT ?' in message for message in messages)
+
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger='query_budget'):
+        client.get('/')
+    assert not caplog.records
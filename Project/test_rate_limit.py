@@ -0,0 +1,94 @@
+import time
+import pytest
+from unittest.mock import patch
+from app import app, db, trust_proxies
+from rate_limit import MemoryBackend, rate_limiter
+
+
+@pytest.fixture
+def client():
+    saved = dict(app.config)
+    app.config.update(WTF_CSRF_ENABLED=False, RATE_LIMIT_ENABLED=True, RATE_LIMIT_IP_BURST=3,
+                      RATE_LIMIT_IP_PER_MINUTE=60, RATE_LIMIT_EMAIL_BURST=2, RATE_LIMIT_EMAIL_PER_MINUTE=60)
+    rate_limiter.backend.clear()
+
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+        yield client
+
+    rate_limiter.backend.clear()
+    app.config.clear()
+    app.config.update(saved)
+
+def test_bucket_allows_burst_then_refills(monkeypatch):
+    """Test a bucket allows its burst, then one attempt per refilled token"""
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    backend = MemoryBackend()
+
+    assert [backend.take('ip:1.2.3.4', 3, 1) for _ in range(3)] == [0, 0, 0]
+    assert backend.take('ip:1.2.3.4', 3, 1) == pytest.approx(1)
+
+    now[0] += 1
+    assert backend.take('ip:1.2.3.4', 3, 1) == 0
+    assert backend.take('ip:1.2.3.4', 3, 1) > 0
+
+def test_bucket_eviction():
+    """Test the least recently used keys are dropped past max_keys"""
+    backend = MemoryBackend(max_keys=2)
+    backend.take('a', 1, 1)
+    backend.take('b', 1, 1)
+    backend.take('a', 1, 1)
+    backend.take('c', 1, 1)
+
+    assert list(backend._buckets) == ['a', 'c']
+
+def test_decisions_are_fast():
+    """Test a limiter decision takes well under a millisecond"""
+    backend = MemoryBackend()
+    start = time.perf_counter()
+    for n in range(10000):
+        backend.take(f'ip:{n % 500}', 20, 1)
+
+    assert (time.perf_counter() - start) / 10000 < 0.0001
+
+@patch('app.User.authenticate')
+def test_login_throttled_per_email(mock_authenticate, client):
+    """Test one email is throttled across IPs before its password is checked"""
+    mock_authenticate.return_value = False
+    for n in range(3):
+        response = client.post('/login', data=dict(email='victim@email.com', password='guess'),
+                               environ_base={'REMOTE_ADDR': f'10.0.0.{n}'})
+
+    assert response.status_code == 429
+    assert b'Too many attempts. Please try again later.' in response.data
+    assert int(response.headers['Retry-After']) >= 1
+    assert mock_authenticate.call_count == 2
+
+@patch('app.User.register')
+def test_register_throttled_per_ip(mock_register, client):
+    """Test one IP is throttled across emails once its burst is used up"""
+    for n in range(4):
+        response = client.post('/register', data=dict(
+            name='Bot', email=f'bot{n}@email.com', password='password', confirm='password'))
+
+    assert response.status_code == 429
+    assert mock_register.call_count == 3
+
+@patch('app.User.register')
+def test_throttled_per_client_behind_proxy(mock_register, client, monkeypatch):
+    """Test clients behind a trusted proxy get their own buckets, whatever they put in X-Forwarded-For"""
+    monkeypatch.setattr(app, 'wsgi_app', app.wsgi_app)
+    monkeypatch.setitem(app.config, 'TRUSTED_PROXIES', 1)
+    trust_proxies(app)
+
+    def register(n, forwarded_for):
+        return client.post('/register', data=dict(
+            name='Bot', email=f'proxied{n}@email.com', password='password', confirm='password'),
+            environ_base={'REMOTE_ADDR': '10.0.0.1'}, headers={'X-Forwarded-For': forwarded_for})
+
+    assert 429 not in [register(n, f'203.0.113.{n}').status_code for n in range(4)]
+    statuses = [register(n, f'198.51.100.{n}, 203.0.113.9').status_code for n in range(4, 8)]
+
+    assert 429 not in statuses[:3] and statuses[3] == 429
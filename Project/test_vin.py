@@ -0,0 +1,25 @@
+from vin import validate_vin, check_digit, check_digit_matches, validate_vins
+
+
+def test_validate_vin():
+    """Test length and character set checks"""
+    assert validate_vin('2T3W1RFV3PW284566') is None
+    assert validate_vin('2T3W1RFV3PW28456') == 'VIN must be 17 characters.'
+    assert validate_vin('2T3W1RFV3PW2845667') == 'VIN must be 17 characters.'
+    assert validate_vin('2T3W1RFV3PW28456O') == 'VIN may only contain letters and digits, except I, O and Q.'
+    assert validate_vin('2T3W1RFV3PW28456-') == 'VIN may only contain letters and digits, except I, O and Q.'
+
+def test_check_digit():
+    """Test the ISO 3779 check digit, including the X remainder"""
+    assert check_digit('2T3W1RFV3PW284566') == '3'
+    assert check_digit('1M8GDM9AXKP042788') == 'X'
+    assert check_digit_matches('1HGCM82633A004352')
+    assert not check_digit_matches('1HGCM82693A004352')
+
+def test_validate_vins():
+    """Test the batch check matches the single-VIN checks"""
+    assert validate_vins(['2T3W1RFV3PW284566', '1HGCM82693A004352', 'SHORT']) == [
+        (None, True),
+        (None, False),
+        ('VIN must be 17 characters.', False),
+    ]
@@ -0,0 +1,85 @@
+import threading
+import time
+from vin_cache import DecodeCache
+
+
+def test_get_or_load_counts_hits_and_misses():
+    """Test a loaded value is served from the cache afterwards"""
+    cache = DecodeCache()
+    calls = []
+
+    def loader(vin):
+        calls.append(vin)
+        return {'make': 'Toyota'}
+
+    assert cache.get_or_load('VIN1', loader) == {'make': 'Toyota'}
+    assert cache.get_or_load('VIN1', loader) == {'make': 'Toyota'}
+    assert calls == ['VIN1']
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+def test_empty_results_are_not_cached():
+    """Test failed decodes are retried instead of cached"""
+    cache = DecodeCache()
+    calls = []
+
+    def loader(vin):
+        calls.append(vin)
+        return {}
+
+    cache.get_or_load('VIN1', loader)
+    cache.get_or_load('VIN1', loader)
+    assert calls == ['VIN1', 'VIN1']
+
+def test_lru_eviction_by_entries_and_bytes():
+    """Test least recently used entries are evicted past the limits"""
+    cache = DecodeCache(max_entries=2)
+    cache.get_or_load('A', lambda vin: {'make': 'A'})
+    cache.get_or_load('B', lambda vin: {'make': 'B'})
+    cache.get('A')
+    cache.get_or_load('C', lambda vin: {'make': 'C'})
+
+    assert cache.get('A') is not None
+    assert cache.get('B') is None
+    assert cache.get('C') is not None
+
+    cache.configure(max_bytes=cache.stats()['bytes'] // 2)
+    assert cache.stats()['entries'] == 1
+    assert cache.get('C') is not None
+
+def test_entries_expire_after_ttl():
+    """Test entries older than the TTL are dropped"""
+    cache = DecodeCache(ttl=0.01)
+    cache.get_or_load('A', lambda vin: {'make': 'A'})
+    time.sleep(0.02)
+    assert cache.get('A') is None
+
+def test_concurrent_loads_are_coalesced():
+    """Test concurrent misses for one key share a single loader call"""
+    cache = DecodeCache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def loader(vin):
+        calls.append(vin)
+        started.set()
+        release.wait(5)
+        return {'make': 'Toyota'}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('VIN1', loader)))
+               for _ in range(10)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    while cache.stats()['coalesced'] < 9:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ['VIN1']
+    assert results == [{'make': 'Toyota'}] * 10
+    assert cache.stats()['coalesced'] == 9
@@ -0,0 +1,79 @@
+import pytest
+import requests
+from benchmarks.vpic_stub import StubVpicServer, load_fixture
+from vpic import VpicClient, parse_response, parse_results, parse_values
+
+
+def test_client_reuses_connection():
+    """Test consecutive decodes share one keep-alive connection"""
+    with StubVpicServer() as server:
+        client = VpicClient(base_url=server.base_url)
+        for _ in range(3):
+            data = client.get_json('decodevin/2T3W1RFV3PW284566')
+            assert data['SearchCriteria'] == 'VIN:2T3W1RFV3PW284566'
+
+        assert server.requests == 3
+        assert server.connections == 1
+
+def test_client_retries_server_errors():
+    """Test 5xx responses are retried until the API answers"""
+    with StubVpicServer(fail_first=2) as server:
+        client = VpicClient(base_url=server.base_url, max_retries=2, backoff_factor=0)
+        data = client.get_json('decodevin/2T3W1RFV3PW284566')
+
+        assert data['Results']
+        assert server.requests == 3
+
+def test_client_gives_up_after_max_retries():
+    """Test retries are bounded"""
+    with StubVpicServer(fail_first=5) as server:
+        client = VpicClient(base_url=server.base_url, max_retries=1, backoff_factor=0)
+        with pytest.raises(requests.HTTPError):
+            client.get_json('decodevin/2T3W1RFV3PW284566')
+
+        assert server.requests == 2
+
+def test_client_read_timeout():
+    """Test a stalled API raises instead of blocking the worker"""
+    with StubVpicServer(latency=0.5) as server:
+        client = VpicClient(base_url=server.base_url, read_timeout=0.05, max_retries=0)
+        with pytest.raises(requests.RequestException):
+            client.get_json('decodevin/2T3W1RFV3PW284566')
+
+def test_parse_list_response():
+    """Test the decodevin Variable/Value list is parsed into CarInfo columns"""
+    car_info_data = parse_response(load_fixture('decodevin.json'))
+
+    assert car_info_data['year'] == 2023
+    assert car_info_data['make'] == 'TOYOTA'
+    assert car_info_data['model'] == 'RAV4'
+    assert car_info_data['trim'] == 'XLE'
+    assert car_info_data['cylinders'] == '4'
+    assert car_info_data['horsepower'] == '203'
+    assert car_info_data['top_speed'] is None
+    assert car_info_data['turbo'] is None
+    assert car_info_data['drive_type'] == 'AWD/All-Wheel Drive'
+
+def test_parse_flat_response_matches_list_response():
+    """Test both response formats give the same car data"""
+    assert parse_response(load_fixture('decodevinvalues.json')) == parse_response(load_fixture('decodevin.json'))
+
+def test_parse_results_stops_early():
+    """Test the parser stops once every column has been found"""
+    results = [{'Variable': variable, 'Value': '1'} for variable in (
+        'Model Year', 'Make', 'Model', 'Trim', 'Top Speed (MPH)', 'Engine Number of Cylinders',
+        'Engine Brake (hp) From', 'Turbo', 'Engine Model', 'Fuel Type - Primary',
+        'Transmission Style', 'Drive Type')]
+    results.append({'Variable': 'Make', 'Value': 'Ignored'})
+
+    assert parse_results(results)['make'] == '1'
+
+def test_parse_values_blank_fields():
+    """Test blank flat values become None"""
+    car_info_data = parse_values({'ModelYear': '', 'Make': 'HONDA', 'TopSpeedMPH': '120'})
+
+    assert car_info_data['year'] is None
+    assert car_info_data['make'] == 'HONDA'
+    assert car_info_data['top_speed'] == 120
+    assert car_info_data['model'] is None
+
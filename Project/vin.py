@@ -0,0 +1,54 @@
+import re
+
+
+VIN_LENGTH = 17
+VIN_PATTERN = re.compile(r'[A-HJ-NPR-Z0-9]{17}')
+
+TRANSLITERATION = dict(zip('0123456789', range(10)))
+TRANSLITERATION.update(zip('ABCDEFGH', range(1, 9)))
+TRANSLITERATION.update(zip('JKLMN', range(1, 6)))
+TRANSLITERATION.update({'P': 7, 'R': 9})
+TRANSLITERATION.update(zip('STUVWXYZ', range(2, 10)))
+
+WEIGHTS = (8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2)
+
+# One {character: transliterated value * weight} table per VIN position
+POSITION_VALUES = tuple({char: value * weight for char, value in TRANSLITERATION.items()} for weight in WEIGHTS)
+
+
+def validate_vin(vin):
+    """Return an error message if the VIN can't be valid, else None
+
+    Checks the length and the character set (no I, O or Q) only; a wrong
+    check digit is reported separately by check_digit_matches, since VINs
+    from outside North America don't have to use one.
+    """
+    if len(vin) != VIN_LENGTH:
+        return f'VIN must be {VIN_LENGTH} characters.'
+    if not VIN_PATTERN.fullmatch(vin):
+        return 'VIN may only contain letters and digits, except I, O and Q.'
+    return None
+
+def check_digit(vin):
+    """The ISO 3779 check digit for a well-formed VIN, '0'-'9' or 'X'"""
+    remainder = sum([table[char] for table, char in zip(POSITION_VALUES, vin)]) % 11
+    return 'X' if remainder == 10 else str(remainder)
+
+def check_digit_matches(vin):
+    """Whether the 9th character of a well-formed VIN is its check digit"""
+    return vin[8] == check_digit(vin)
+
+def validate_vins(vins):
+    """Validate many VINs at once for bulk imports
+
+    Returns a list of (error, check_digit_ok) tuples in input order, where
+    error is None for VINs that passed validate_vin.
+    """
+    fullmatch = VIN_PATTERN.fullmatch
+    results = []
+    for vin in vins:
+        if len(vin) != VIN_LENGTH or not fullmatch(vin):
+            results.append((validate_vin(vin), False))
+        else:
+            results.append((None, vin[8] == check_digit(vin)))
+    return results
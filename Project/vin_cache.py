@@ -0,0 +1,169 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from metrics import metrics
+
+
+def _entry_size(value):
+    """Rough size in bytes of a cached car data dict"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += sys.getsizeof(key) + sys.getsizeof(item)
+    return size
+
+
+class _InFlight:
+    """A load in progress that other threads can wait on"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class DecodeCache:
+    """Bounded in-process LRU with TTL and single-flight loads
+
+    Entries are evicted least-recently-used first once either max_entries
+    or max_bytes is exceeded. Concurrent get_or_load calls for the same key
+    share one loader call instead of each running their own.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=4 * 1024 * 1024, ttl=3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def configure(self, max_entries=None, max_bytes=None, ttl=None):
+        """Change the limits, evicting entries that no longer fit"""
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if ttl is not None:
+                self.ttl = ttl
+            self._evict()
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired"""
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key, value):
+        """Store a value loaded elsewhere, such as by a batch decode"""
+        with self._lock:
+            self._set(key, value)
+
+    def get_or_load(self, key, loader, cacheable=bool):
+        """Return the cached value for key, calling loader(key) on a miss
+
+        Results cacheable() rejects (by default, falsy ones) are returned
+        but not cached, so failed decodes are retried on the next request.
+        """
+        with self._lock:
+            value = self._get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                self.misses += 1
+                in_flight = self._in_flight[key] = _InFlight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            in_flight.event.wait()
+            if in_flight.error:
+                raise in_flight.error
+            return in_flight.value
+
+        try:
+            in_flight.value = loader(key)
+        except Exception as error:
+            in_flight.error = error
+            raise
+        finally:
+            with self._lock:
+                if in_flight.value and cacheable(in_flight.value):
+                    self._set(key, in_flight.value)
+                del self._in_flight[key]
+            in_flight.event.set()
+
+        return in_flight.value
+
+    def clear(self):
+        """Drop every entry and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.coalesced = 0
+
+    def stats(self):
+        """Counters and current size, for sizing the cache"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+            }
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        value, size, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self._bytes -= size
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key, value):
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+
+        size = _entry_size(value)
+        self._entries[key] = (value, size, time.monotonic() + self.ttl)
+        self._bytes += size
+        self._evict()
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self._bytes -= size
+
+
+vin_cache = DecodeCache()
+
+cache_hits = metrics.counter('vin_memory_cache_hits_total', 'fetch_car_data lookups answered by the in-process cache.')
+cache_misses = metrics.counter('vin_memory_cache_misses_total', 'fetch_car_data lookups that loaded the VIN.')
+cache_coalesced = metrics.counter(
+    'vin_memory_cache_coalesced_total', 'fetch_car_data lookups that waited on a load already in flight.')
+
+@metrics.collector
+def cache_totals():
+    stats = vin_cache.stats()
+    return [(cache_hits, (), stats['hits']), (cache_misses, (), stats['misses']),
+            (cache_coalesced, (), stats['coalesced'])]
@@ -0,0 +1,161 @@
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from metrics import metrics
+
+
+VPIC_BASE_URL = 'https://vpic.nhtsa.dot.gov/api/vehicles'
+
+
+def _to_int(value):
+    return int(value) if value else None
+
+def _to_str(value):
+    return value or None
+
+# Variable name in decodevin results -> (CarInfo column, converter)
+RESULT_FIELDS = {
+    'Model Year': ('year', _to_int),
+    'Make': ('make', _to_str),
+    'Model': ('model', _to_str),
+    'Trim': ('trim', _to_str),
+    'Top Speed': ('top_speed', _to_int),
+    'Top Speed (MPH)': ('top_speed', _to_int),
+    'Engine Number of Cylinders': ('cylinders', _to_str),
+    'Engine Brake (hp) From': ('horsepower', _to_str),
+    'Turbo': ('turbo', _to_str),
+    'Engine Model': ('engine_model', _to_str),
+    'Fuel Type - Primary': ('fuel_type', _to_str),
+    'Transmission Style': ('transmission_style', _to_str),
+    'Drive Type': ('drive_type', _to_str),
+}
+
+# Key in flat decodevinvalues rows -> (CarInfo column, converter)
+VALUE_FIELDS = {
+    'ModelYear': ('year', _to_int),
+    'Make': ('make', _to_str),
+    'Model': ('model', _to_str),
+    'Trim': ('trim', _to_str),
+    'TopSpeedMPH': ('top_speed', _to_int),
+    'EngineCylinders': ('cylinders', _to_str),
+    'EngineHP': ('horsepower', _to_str),
+    'Turbo': ('turbo', _to_str),
+    'EngineModel': ('engine_model', _to_str),
+    'FuelTypePrimary': ('fuel_type', _to_str),
+    'TransmissionStyle': ('transmission_style', _to_str),
+    'DriveType': ('drive_type', _to_str),
+}
+
+FIELD_COUNT = len(VALUE_FIELDS)
+
+request_duration = metrics.histogram(
+    'vpic_request_duration_seconds', 'Time spent calling the vPIC API, retries included.', ('endpoint',),
+    timing='vpic')
+requests_total = metrics.counter(
+    'vpic_requests_total', 'vPIC API calls by endpoint and HTTP status, or error when no response came back.',
+    ('endpoint', 'status'))
+
+
+def parse_results(results):
+    """Parse the Variable/Value list of a decodevin response
+
+    Stops walking the list as soon as every CarInfo column has been seen.
+    """
+    car_info_data = {}
+    lookup = RESULT_FIELDS.get
+    for item in results:
+        field = lookup(item['Variable'])
+        if field is None:
+            continue
+        column, convert = field
+        car_info_data[column] = convert(item['Value'])
+        if len(car_info_data) == FIELD_COUNT:
+            break
+    return car_info_data
+
+def parse_values(row):
+    """Parse one flat decodevinvalues / DecodeVINValuesBatch row"""
+    return {column: convert(row.get(key)) for key, (column, convert) in VALUE_FIELDS.items()}
+
+def parse_response(data):
+    """Parse a single-VIN response in either the list or the flat format"""
+    results = data['Results']
+    if not results:
+        return {}
+    if 'Variable' in results[0]:
+        return parse_results(results)
+    return parse_values(results[0])
+
+
+class VpicClient:
+    """Pooled keep-alive HTTP client for the NHTSA vPIC API
+
+    One requests.Session is shared by every request thread, so connections
+    (and their TLS sessions) to the vPIC host are reused instead of being
+    opened per decode. Every call has connect/read timeouts, and 5xx
+    responses and connection errors are retried with jittered backoff.
+    """
+
+    def __init__(self, base_url=VPIC_BASE_URL, connect_timeout=3.05, read_timeout=10,
+                 max_retries=2, backoff_factor=0.25, pool_size=10):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            backoff_jitter=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset({'GET', 'POST'}),
+            raise_on_status=False)
+
+        self.session = requests.Session()
+        self.session.mount(self.base_url, HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retry))
+
+    def get_json(self, path, **params):
+        """GET a vPIC endpoint and return the decoded JSON body"""
+        params.setdefault('format', 'json')
+        return self._request('get', path, params=params)
+
+    def post_json(self, path, data):
+        """POST form data to a vPIC endpoint and return the decoded JSON body"""
+        data.setdefault('format', 'json')
+        return self._request('post', path, data=data)
+
+    def _request(self, method, path, **kwargs):
+        endpoint = path.split('/')[0]
+        status = 'error'
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, f'{self.base_url}/{path}', timeout=self.timeout, **kwargs)
+            status = str(response.status_code)
+            response.raise_for_status()
+            return response.json()
+        finally:
+            request_duration.observe(time.perf_counter() - start, endpoint)
+            requests_total.inc(endpoint, status)
+
+    def close(self):
+        self.session.close()
+
+
+client = None
+
+
+def connect_vpic(app):
+    """Configure the shared vPIC client from the app config"""
+    global client
+    if client:
+        client.close()
+    client = VpicClient(
+        base_url=app.config.get('VPIC_BASE_URL', VPIC_BASE_URL),
+        connect_timeout=app.config.get('VPIC_CONNECT_TIMEOUT', 3.05),
+        read_timeout=app.config.get('VPIC_READ_TIMEOUT', 10),
+        max_retries=app.config.get('VPIC_MAX_RETRIES', 2),
+        backoff_factor=app.config.get('VPIC_BACKOFF_FACTOR', 0.25),
+        pool_size=app.config.get('VPIC_POOL_SIZE', 10))